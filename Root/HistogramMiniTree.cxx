@@ -25,12 +25,16 @@
 #include "TLorentzVector.h"
 #include "TEnv.h"
 #include "TSystem.h"
+#include "TROOT.h"
 
 #include <utility>
 #include <iostream>
 #include <fstream>
 #include <sstream>
 #include <stdlib.h>
+#include <algorithm>
+#include <thread>
+#include <stdexcept>
 
 using namespace std;
 
@@ -79,6 +83,21 @@ HistogramMiniTree :: HistogramMiniTree () :
   m_isMC = true;
   m_XSWeight = 1.0;
   m_mcChannelNumber = "";
+  m_inputIndex = "";
+  m_treeCacheSize = -1;
+  m_treeCacheLearnEntries = -1;
+  f_treeCacheAsync = false;
+  m_treeCache = 0;
+  m_histTable = "$ROOTCOREBIN/data/ttHHistogrammer/HistogramTable.txt";
+  m_nThreads = 1;
+  m_threadBlockSize = 10000;
+  m_threadFile = 0;
+  m_threadTree = 0;
+  m_fillBuffer = 0;
+  m_skimDir = "";
+  m_skimFile = 0;
+  m_skimTree = 0;
+  m_extraTreeNames = "";
 }
 
 
@@ -103,6 +122,13 @@ EL::StatusCode  HistogramMiniTree :: configure ()
   m_trigger                  = config->GetValue("Trigger" ,        m_trigger.c_str() );
   f_use2015                  = config->GetValue("Use2015" ,        f_use2015 );
   f_use2016                  = config->GetValue("Use2016" ,        f_use2016 );
+  if( m_inputIndex.empty() )
+    m_inputIndex             = config->GetValue("InputIndex" ,     m_inputIndex.c_str() );
+  m_treeCacheSize            = config->GetValue("TreeCacheSize" ,  m_treeCacheSize );
+  m_treeCacheLearnEntries    = config->GetValue("TreeCacheLearnEntries" , m_treeCacheLearnEntries );
+  f_treeCacheAsync           = config->GetValue("TreeCacheAsync" , f_treeCacheAsync );
+  m_histTable                = config->GetValue("HistogramTable" , m_histTable.c_str() );
+  m_threadBlockSize          = config->GetValue("ThreadBlockSize" , m_threadBlockSize );
 
   // Set this to true if using lepton decision, i.e. ejets
   // Set to false if you want to count the # of leptons, i.e. el_pt->size()
@@ -297,6 +323,12 @@ EL::StatusCode  HistogramMiniTree :: configure ()
   selection_el_6j4b->bJetEquality = false;
   selections.push_back( selection_el_6j4b );
 
+  // Selections are evaluated into a 64 bit mask in execute()
+  if( selections.size() > 64 ){
+    Error("configure()", "At most 64 selections are supported, %lu were defined", selections.size());
+    return EL::StatusCode::FAILURE;
+  }
+
   // Save triggers to use
   std::stringstream ss(m_trigger);
   std::string thisTrigger;
@@ -364,141 +396,156 @@ EL::StatusCode HistogramMiniTree :: histInitialize ()
     Error("initialize()", "Failed to properly configure. Exiting." );
     return EL::StatusCode::FAILURE;
   }
+  if ( !m_inputIndex.empty() && this->loadInputIndex() == EL::StatusCode::FAILURE ) {
+    Error("histInitialize()", "Failed to read the input index %s. Exiting.", m_inputIndex.c_str() );
+    return EL::StatusCode::FAILURE;
+  }
+  m_treeCache = 0;
+  m_cacheFileEvents = m_cacheEvents = 0;
+  m_cacheFileHitRate = m_cacheFileEfficiency = 0.;
+  m_cacheHitRateSum = m_cacheEfficiencySum = 0.;
+  m_skimFile = 0;
+  m_skimTree = 0;
+  m_skimEvents = 0;
+  if( !m_skimDir.empty() && m_nThreads > 1 ){
+    Warning("histInitialize()", "Skims are written by a single thread, ignoring %i threads", m_nThreads);
+    m_nThreads = 1;
+  }
+
 
+  if ( this->loadHistTable() == EL::StatusCode::FAILURE ) {
+    Error("histInitialize()", "Failed to read the histogram table %s. Exiting.", m_histTable.c_str() );
+    return EL::StatusCode::FAILURE;
+  }
 
   //if( m_debug)  Info("histInitialize()()", " Defining histograms \n");
   HistogramManager* HM = new HistogramManager("tmpName", "tmpDetail");
   //HistogramManager::HistogramManager* HM = new HistogramManager::HistogramManager("tmpName", "tmpDetail");
 
-  // Basic histograms
-  std::string outDir = "";
-  numHistElectrons = 1;
-  numHistMuons = 1;
-  numHistJets = 6;
+  // The EventLoop tree fills the selection directories, and every extra tree a copy of them in its own directory
+  m_selectionHists = bookHists( HM, "" );
+  createTreeWorkers( HM );
+
+  HM->record( wk() ); //Add all histograms to EventLoop output
+  return EL::StatusCode::SUCCESS;
+}
 
-  // A new TDirectory for each selection
+
+
+//Books the histograms of the table in a new TDirectory dirPrefix+selection for each selection
+vector< vector<HistogramMiniTree::FilledHist> > HistogramMiniTree :: bookHists(HistogramManager* HM, const std::string& dirPrefix) {
+
+  std::string outDir = "";
+  unsigned int nBooked = 0;
+  vector< vector<FilledHist> > selectionHists;
   for(unsigned int iS=0; iS < selections.size(); ++iS){
-// !H! Book histograms here
-
-    outDir = selections.at(iS)->name+"/";
-
-    // Electrons //
-    h_el_pt_all.push_back( HM->book(outDir, "h_el_pt_all", "Electron P_{T} (GeV)", 50, 0, 300.) );
-    h_el_eta_all.push_back( HM->book( outDir,"h_el_eta_all", "Electron #eta", 50, -4., 4.) );
-    h_el_phi_all.push_back( HM->book( outDir,"h_el_phi_all", "Electron #phi", 50, -3.14, 3.14) );
-    h_el_e_all.push_back( HM->book( outDir,"h_el_e_all", "Electron Energy (GeV)", 50, 0, 300.) );
-
-    vector<TH1F*> vh_el_pt_tmp;
-    vector<TH1F*> vh_el_eta_tmp;
-    vector<TH1F*> vh_el_phi_tmp;
-    vector<TH1F*> vh_el_e_tmp;
-    for(unsigned int iE=0; iE < numHistElectrons; ++iE){
-      vh_el_pt_tmp.push_back( HM->book( outDir, ("h_el_"+to_string(iE)+"_pt").c_str(),  "Electron P_{T} (GeV)", 40, 25, 225.) );
-      vh_el_eta_tmp.push_back( HM->book( outDir, ("h_el_"+to_string(iE)+"_eta").c_str(), "Electron #eta", 50, -4, 4) );
-      vh_el_phi_tmp.push_back( HM->book( outDir, ("h_el_"+to_string(iE)+"_phi").c_str(), "Electron #phi", 50, -3.14, 3.14) );
-      vh_el_e_tmp.push_back( HM->book( outDir, ("h_el_"+to_string(iE)+"_e").c_str(),   "Electron Energy (GeV)", 50, 0, 300.) );
-    }
-    vh_el_pt.push_back( vh_el_pt_tmp );
-    vh_el_eta.push_back( vh_el_eta_tmp );
-    vh_el_phi.push_back( vh_el_phi_tmp );
-    vh_el_e.push_back( vh_el_e_tmp );
-
-
-    // Muons //
-    h_mu_pt_all.push_back( HM->book(outDir, "h_mu_pt_all", "Muon P_{T} (GeV)", 50, 0, 300.) );
-    h_mu_eta_all.push_back( HM->book( outDir,"h_mu_eta_all", "Muon #eta", 50, -4., 4.) );
-    h_mu_phi_all.push_back( HM->book( outDir,"h_mu_phi_all", "Muon #phi", 50, -3.14, 3.14) );
-    h_mu_e_all.push_back( HM->book( outDir,"h_mu_e_all", "Muon Energy (GeV)", 50, 0, 300.) );
-
-    vector<TH1F*> vh_mu_pt_tmp;
-    vector<TH1F*> vh_mu_eta_tmp;
-    vector<TH1F*> vh_mu_phi_tmp;
-    vector<TH1F*> vh_mu_e_tmp;
-    for(unsigned int iE=0; iE < numHistMuons; ++iE){
-      vh_mu_pt_tmp.push_back( HM->book( outDir, ("h_mu_"+to_string(iE)+"_pt").c_str(), "Muon P_{T} (GeV)", 40, 25, 225.) );
-      vh_mu_eta_tmp.push_back( HM->book( outDir, ("h_mu_"+to_string(iE)+"_eta").c_str(), "Muon #eta", 50, -4, 4) );
-      vh_mu_phi_tmp.push_back( HM->book( outDir, ("h_mu_"+to_string(iE)+"_phi").c_str(), "Muon #phi", 50, -3.14, 3.14) );
-      vh_mu_e_tmp.push_back( HM->book( outDir, ("h_mu_"+to_string(iE)+"_e").c_str(),   "Muon Energy (GeV)", 50, 0, 300.) );
-    }
-    vh_mu_pt.push_back( vh_mu_pt_tmp );
-    vh_mu_eta.push_back( vh_mu_eta_tmp );
-    vh_mu_phi.push_back( vh_mu_phi_tmp );
-    vh_mu_e.push_back( vh_mu_e_tmp );
-
-    // Jets //
-    h_jet_n.push_back( HM->book(outDir, "h_jet_n", "Number of Jets", 20, 0, 20.) );
-    h_jet_ht.push_back( HM->book(outDir, "h_jet_ht", "H_{T} (GeV)", 50, 0, 3000.) );
-    h_jet_pt_all.push_back( HM->book(outDir, "h_jet_pt_all", "P_{T} of All Jets (GeV)", 50, 0, 300.) );
-    h_jet_eta_all.push_back( HM->book( outDir,"h_jet_eta_all", "#eta of All Jets", 50, -4., 4.) );
-    h_jet_phi_all.push_back( HM->book( outDir,"h_jet_phi_all", "#phi of All Jets", 50, -3.14, 3.14) );
-    h_jet_e_all.push_back( HM->book( outDir,"h_jet_e_all", "Energy of All Jets (GeV)", 50, 0, 300.) );
-    h_jet_mv2c10_all.push_back( HM->book(outDir, "h_jet_mv2c10_all", "Mv2c20 of All Jets", 50, -1., 1.) );
-
-    vector<TH1F*> vh_jet_pt_tmp;
-    vector<TH1F*> vh_jet_eta_tmp;
-    vector<TH1F*> vh_jet_phi_tmp;
-    vector<TH1F*> vh_jet_e_tmp;
-    vector<TH1F*> vh_jet_mv2c10_tmp;
-    for(unsigned int iE=0; iE < numHistJets; ++iE){
-      vh_jet_pt_tmp.push_back( HM->book( outDir, ("h_jet_"+to_string(iE)+"_pt").c_str(),  ("P_{T} of Jet "+to_string(iE+1)+" (GeV)").c_str(), 20, 0, 300.) );
-      vh_jet_eta_tmp.push_back( HM->book( outDir, ("h_jet_"+to_string(iE)+"_eta").c_str(), ("#eta of Jet "+to_string(iE+1)).c_str(), 50, -4, 4) );
-      vh_jet_phi_tmp.push_back( HM->book( outDir, ("h_jet_"+to_string(iE)+"_phi").c_str(), ("#phi of Jet "+to_string(iE+1)).c_str(), 50, -3.14, 3.14) );
-      vh_jet_e_tmp.push_back( HM->book( outDir, ("h_jet_"+to_string(iE)+"_e").c_str(),   ("Energy of Jet "+to_string(iE+1)+" (GeV)").c_str(), 50, 0, 300.) );
-      vh_jet_mv2c10_tmp.push_back( HM->book( outDir, ("h_jet_"+to_string(iE)+"_mv2c10").c_str(),   ("Mv2c10 of Jet "+to_string(iE+1)).c_str(), 50, -1., 1.) );
-    }
-    vh_jet_pt.push_back( vh_jet_pt_tmp );
-    vh_jet_eta.push_back( vh_jet_eta_tmp );
-    vh_jet_phi.push_back( vh_jet_phi_tmp );
-    vh_jet_e.push_back( vh_jet_e_tmp );
-    vh_jet_mv2c10.push_back( vh_jet_mv2c10_tmp );
-
-    // B-Jets //
-    h_bjet_n.push_back( HM->book(outDir, "h_bjet_n", "Number of B-Jets", 20, 0, 20.) );
-    h_bjet_ht.push_back( HM->book(outDir, "h_bjet_ht", "H_{T} of All B-Jets (GeV)", 50, 0, 300.) );
-    h_bjet_pt_all.push_back( HM->book(outDir, "h_bjet_pt_all", "P_{T} of All B-Jets (GeV)", 50, 0, 300.) );
-    h_bjet_eta_all.push_back( HM->book( outDir,"h_bjet_eta_all", "#eta of All B-Jets", 50, -4., 4.) );
-    h_bjet_phi_all.push_back( HM->book( outDir,"h_bjet_phi_all", "#phi of All B-Jets", 50, -3.14, 3.14) );
-    h_bjet_e_all.push_back( HM->book( outDir,"h_bjet_e_all", "Energy of All B-Jets (GeV)", 50, 0, 300.) );
-    h_bjet_mv2c10_all.push_back( HM->book(outDir, "h_bjet_mv2c10_all", "Mv2c20 of All B-Jets", 50, -1., 1.) );
-
-    vector<TH1F*> vh_bjet_pt_tmp;
-    vector<TH1F*> vh_bjet_eta_tmp;
-    vector<TH1F*> vh_bjet_phi_tmp;
-    vector<TH1F*> vh_bjet_e_tmp;
-    vector<TH1F*> vh_bjet_mv2c10_tmp;
-    for(unsigned int iE=0; iE < numHistJets; ++iE){
-      vh_bjet_pt_tmp.push_back( HM->book( outDir, ("h_bjet_"+to_string(iE)+"_pt").c_str(),  ("P_{T} of B-Jet "+to_string(iE+1)+" (GeV)").c_str(), 20, 0, 300.) );
-      vh_bjet_eta_tmp.push_back( HM->book( outDir, ("h_bjet_"+to_string(iE)+"_eta").c_str(), ("#eta of B-Jet "+to_string(iE+1)).c_str(), 50, -4, 4) );
-      vh_bjet_phi_tmp.push_back( HM->book( outDir, ("h_bjet_"+to_string(iE)+"_phi").c_str(), ("#phi of B-Jet "+to_string(iE+1)).c_str(), 50, -3.14, 3.14) );
-      vh_bjet_e_tmp.push_back( HM->book( outDir, ("h_bjet_"+to_string(iE)+"_e").c_str(),   ("Energy of B-Jet "+to_string(iE+1)+" (GeV)").c_str(), 50, 0, 300.) );
-      vh_bjet_mv2c10_tmp.push_back( HM->book( outDir, ("h_bjet_"+to_string(iE)+"_mv2c10").c_str(),   ("Mv2c10 of B-Jet "+to_string(iE+1)).c_str(), 50, -1., 1.) );
+// !H! Book histograms in data/HistogramTable.txt
+
+    outDir = dirPrefix+selections.at(iS)->name+"/";
+
+    vector<FilledHist> filledHists;
+    for(unsigned int iH=0; iH < m_histDefinitions.size(); ++iH){
+      const HistDefinition& definition = m_histDefinitions.at(iH);
+      if( !useSelection( definition, selections.at(iS)->name ) )
+        continue;
+
+      FilledHist filledHist;
+      filledHist.hist = HM->book( outDir, definition.name, definition.xTitle, definition.nBins, definition.xMin, definition.xMax );
+      filledHist.object = definition.object;
+      filledHist.variable = definition.variable;
+      filledHist.index = definition.index;
+      filledHists.push_back( filledHist );
     }
-    vh_bjet_pt.push_back( vh_bjet_pt_tmp );
-    vh_bjet_eta.push_back( vh_bjet_eta_tmp );
-    vh_bjet_phi.push_back( vh_bjet_phi_tmp );
-    vh_bjet_e.push_back( vh_bjet_e_tmp );
-    vh_bjet_mv2c10.push_back( vh_bjet_mv2c10_tmp );
-
-    // Others //
-    //h_met.push_back( HM->book(outDir, "h_met", "MET (GeV)", 40, 0, 400.) );
-    h_met.push_back( HM->book(outDir, "h_met", "MET (GeV)", 135, 0, 135.) );
-    h_ht_all.push_back( HM->book(outDir, "h_ht_all", "H_{T} of All Jets + Lepton + MET (GeV)", 50, 0, 300.) );
-    h_ClassifBDTOutput_withReco_basic.push_back( HM->book(outDir, "h_ClassifBDTOutput_withReco_basic", "ClassifBDTOutput_withReco_basic", 1000, -1., 1.) );
+    nBooked += filledHists.size();
+    selectionHists.push_back( filledHists );
   }// for each selection
+  Info("bookHists()", "Booked %u histograms in %lu selections%s%s", nBooked, selections.size(),
+      dirPrefix.empty() ? "" : " of ", dirPrefix.c_str());
+  return selectionHists;
+}
 
-  HM->record( wk() ); //Add all histograms to EventLoop output
-  return EL::StatusCode::SUCCESS;
+//Creates a copy of this algorithm for each of m_extraTreeNames, with its histograms booked under the tree name
+//The histogram table, selections and branch lists are shared, only the booking is repeated
+void HistogramMiniTree :: createTreeWorkers(HistogramManager* HM) {
+
+  m_extraTrees.clear();
+  m_treeWorkers.clear();
+  m_extraTreeEvents = 0;
+  std::stringstream ss(m_extraTreeNames);
+  std::string thisTree;
+  while (std::getline(ss, thisTree, ',')) {
+    if( thisTree.empty() )
+      continue;
+    HistogramMiniTree* worker = new HistogramMiniTree();
+    copyConfiguration( worker );
+    worker->m_selectionHists = bookHists( HM, thisTree+"/" );
+    m_extraTrees.push_back( thisTree );
+    m_treeWorkers.push_back( worker );
+  }
+}
+
+//Copies the configuration and booked histograms of this algorithm into a worker
+void HistogramMiniTree :: copyConfiguration(HistogramMiniTree* worker) {
+
+  worker->selections = selections;
+  worker->m_selectionHists = m_selectionHists;
+  worker->m_usedBranches = m_usedBranches;
+  std::copy(m_usedEventValues, m_usedEventValues+kNEventValues, worker->m_usedEventValues);
+  worker->triggerNames = triggerNames;
+  worker->triggers = triggers;
+  worker->f_leptonDecision = f_leptonDecision;
+  worker->f_use2015 = f_use2015;
+  worker->f_use2016 = f_use2016;
+  worker->m_bTagWP = m_bTagWP;
+  worker->m_treeCacheSize = m_treeCacheSize;
+  worker->m_treeCacheLearnEntries = m_treeCacheLearnEntries;
+  worker->f_treeCacheAsync = f_treeCacheAsync;
 }
 
 
 
+//Returns the name of an input file without its directory
+static std::string getInputFileName(TFile* inputFile) {
+  std::string inputFileName = inputFile->GetName();
+  //Remove directory structure if present
+  const size_t iLastSlash = inputFileName.find_last_of("\\/");
+  if (std::string::npos != iLastSlash)
+  {
+      inputFileName.erase(0, iLastSlash + 1);
+  }
+  return inputFileName;
+}
+
 EL::StatusCode HistogramMiniTree :: fileExecute ()
 {
   // Here you do everything that needs to be done exactly once for every
   // single file, e.g. collect a list of all lumi-blocks processed
+
+  // execute() reads the extra trees alongside the EventLoop tree, but is never called for a file whose
+  // EventLoop tree is empty or absent.  The extra trees of such a file, which may have entries, are read here
+  TTree* tree = wk()->tree();
+  if( m_treeWorkers.empty() || (tree && tree->GetEntries() > 0) )
+    return EL::StatusCode::SUCCESS;
+  TFile* inputFile = wk()->inputFile();
+  Info("fileExecute()", "No entries of the EventLoop tree in %s, reading only the extra trees", inputFile->GetName());
+  setNormalization( inputFile, getInputFileName(inputFile) );
+  connectExtraTrees( inputFile );
+  processExtraTrees( 0, true );
   return EL::StatusCode::SUCCESS;
 }
 
+//Returns true for data files, with a field starting with data1 (data15, data16, ...) among the first three
+//'.' separated fields of their name.  The same rule as parseFileName() of scripts/buildInputIndex.py
+static bool isDataFileName(const std::string& fileName) {
+  std::stringstream ss(fileName);
+  std::string thisField;
+  for(int iField=0; iField < 3 && std::getline(ss, thisField, '.'); ++iField){
+    if( thisField.compare(0, 5, "data1") == 0 )
+      return true;
+  }
+  return false;
+}
+
 // !B! Connect branch variable with tree here
 EL::StatusCode HistogramMiniTree :: changeInput (bool firstFile)
 {
@@ -507,19 +554,73 @@ EL::StatusCode HistogramMiniTree :: changeInput (bool firstFile)
   // D3PDReader or a similar service this method is not needed.
 
 //  if( m_debug)  Info("changeInput()", "Loading Cutflows \n");
+  addTreeCacheStats(); //the cache of the previous file is gone with it
+  closeSkim();
+  if( m_nThreads > 1 ){ //Finish the previous file with its own workers and normalization
+    processPendingEntries();
+    deleteThreadWorkers();
+  }
   TFile* inputFile = wk()->inputFile();
-  std::string inputFileName = inputFile->GetName();
-  //Remove directory structure if present
-  const size_t iLastSlash = inputFileName.find_last_of("\\/");
-  if (std::string::npos != iLastSlash)
-  {
-      inputFileName.erase(0, iLastSlash + 1);
+  std::string inputFileName = getInputFileName( inputFile );
+  setNormalization( inputFile, inputFileName );
+
+//  TIter next(inputFile->GetListOfKeys());
+//  TKey *key;
+//  while ((key = (TKey*)next())) {
+//    std::string keyName = key->GetName();
+//
+//    std::size_t found = keyName.find("cutflow");
+//
+//    found = keyName.find("weighted");
+//    bool foundWeighted = (found!=std::string::npos);
+//
+//  }//over Keys
+
+  connectExtraTrees( inputFile );
+
+  if( m_debug)  Info("changeInput()", "Loading Branches \n");
+  TTree *tree = wk()->tree();
+  if( m_nThreads > 1 ){
+    // The worker threads read their own copies of the input, so EventLoop only steps through the entries
+    // They are bound to this file and its normalization now, as its entries may only be read after the next file is open
+    tree->SetBranchStatus ("*", 0);
+    createThreadWorkers();
+    return EL::StatusCode::SUCCESS;
+  }
+
+  connectBranches( tree );
+  setupTreeCache( tree );
+  if( !m_skimDir.empty() )
+    openSkim( inputFile, tree, inputFileName );
+
+  return EL::StatusCode::SUCCESS;
+}
+
+//Sets data or MC, the cross section and the sumWeights normalization of an input file
+void HistogramMiniTree :: setNormalization(TFile* inputFile, const std::string& inputFileName) {
+
+  // Take the normalization from the input index if it has an up to date line for this file
+  std::unordered_map<std::string, InputFileInfo>::const_iterator indexIter = m_inputFileInfos.find(inputFileName);
+  if (indexIter != m_inputFileInfos.end() && indexIter->second.size != inputFile->GetSize()){
+    Warning("setNormalization()", "Input index is out of date for %s, reading it from the file", inputFileName.c_str());
+    indexIter = m_inputFileInfos.end();
   }
-  if (inputFileName.find("data15") != std::string::npos){
-    Info("changeInput()","Setting to Data");
+
+  if (indexIter != m_inputFileInfos.end()){
+    const InputFileInfo& fileInfo = indexIter->second;
+    m_isMC = !fileInfo.isData;
+    Info("setNormalization()", m_isMC ? "Setting to MC" : "Setting to Data");
+    if(m_isMC){
+      m_mcChannelNumber = fileInfo.dsid;
+      getLumiWeights(); //retrieve XS+FiltEff weights for MC
+      m_totalNumEvents = fileInfo.sumWeights;
+      Info("setNormalization()", "From input index, found totalNumber of events %f", m_totalNumEvents);
+    }
+  } else if (isDataFileName(inputFileName)){
+    Info("setNormalization()","Setting to Data");
     m_isMC = false;
   } else {
-    Info("changeInput()","Setting to MC");
+    Info("setNormalization()","Setting to MC");
     m_isMC = true;
 
     // Get MC number from string
@@ -555,30 +656,56 @@ EL::StatusCode HistogramMiniTree :: changeInput (bool firstFile)
   /*  TH1F* cutflow = (TH1F*) inputFile->Get("ejets_2015/cutflow_mc_Loose");
     m_totalNumEvents = cutflow->GetBinContent(1);*/
     //cout << "m_totalNumEvents : " << m_totalNumEvents << endl;
-    Info("changeInput()", "From sumWeights TTree, found totalNumber of events %f", m_totalNumEvents);
+    Info("setNormalization()", "From sumWeights TTree, found totalNumber of events %f", m_totalNumEvents);
   }// if MC
+}
 
-//  TIter next(inputFile->GetListOfKeys());
-//  TKey *key;
-//  while ((key = (TKey*)next())) {
-//    std::string keyName = key->GetName();
-//
-//    std::size_t found = keyName.find("cutflow");
-//
-//    found = keyName.find("weighted");
-//    bool foundWeighted = (found!=std::string::npos);
-//
-//  }//over Keys
+//Connects the extra trees of the new input file, read with its normalization
+void HistogramMiniTree :: connectExtraTrees(TFile* inputFile) {
+
+  for(unsigned int iT=0; iT < m_treeWorkers.size(); ++iT){
+    HistogramMiniTree* worker = m_treeWorkers.at(iT);
+    worker->m_isMC = m_isMC;
+    worker->m_XSWeight = m_XSWeight;
+    worker->m_totalNumEvents = m_totalNumEvents;
+    worker->m_threadTree = dynamic_cast<TTree*>( inputFile->Get( m_extraTrees.at(iT).c_str() ) );
+    if( !worker->m_threadTree ){
+      Warning("connectExtraTrees()", "No TTree %s in %s, skipping it", m_extraTrees.at(iT).c_str(), inputFile->GetName());
+      continue;
+    }
+    worker->connectBranches( worker->m_threadTree );
+    worker->setupTreeCache( worker->m_threadTree );
+  }
+}
+
+//Reads and fills the entry of each extra tree with the same number as the current EventLoop entry.  With toEnd,
+//at the last entry of the EventLoop tree, also the remaining entries of longer extra trees, so entry range shards cover them
+void HistogramMiniTree :: processExtraTrees(Long64_t entry, bool toEnd) {
+
+  for(unsigned int iT=0; iT < m_treeWorkers.size(); ++iT){
+    HistogramMiniTree* worker = m_treeWorkers.at(iT);
+    TTree* tree = worker->m_threadTree;
+    if( !tree )
+      continue;
+    Long64_t endEntry = toEnd ? tree->GetEntries() : std::min(entry+1, tree->GetEntries());
+    for(Long64_t iEntry = entry; iEntry < endEntry; ++iEntry){
+      tree->GetEntry( iEntry );
+      worker->processEvent();
+      ++m_extraTreeEvents;
+    }
+  }
+}
+
+//Sets the addresses of the branches read by the selections and the enabled histograms
+void HistogramMiniTree :: connectBranches(TTree* tree) {
 
-  if( m_debug)  Info("changeInput()", "Loading Branches \n");
-  TTree *tree = wk()->tree();
   tree->SetBranchStatus ("*", 0);
 
 
   tree->SetBranchStatus("ejets_2015", 1);   tree->SetBranchAddress( "ejets_2015", &ejets_2015);
   tree->SetBranchStatus("ejets_2016", 1);   tree->SetBranchAddress( "ejets_2016", &ejets_2016);
   tree->SetBranchStatus("mujets_2015", 1);   tree->SetBranchAddress( "mujets_2015", &mujets_2015);
-  tree->SetBranchStatus("mujets_2016", 1);   tree->SetBranchAddress( "mujets_2016", &mujets_2015);
+  tree->SetBranchStatus("mujets_2016", 1);   tree->SetBranchAddress( "mujets_2016", &mujets_2016);
   //Dilepton Events
   tree->SetBranchStatus("ee_2015", 1);   tree->SetBranchAddress( "ee_2015", &ee_2015);
   tree->SetBranchStatus("ee_2016", 1);   tree->SetBranchAddress( "ee_2016", &ee_2016);
@@ -631,7 +758,99 @@ EL::StatusCode HistogramMiniTree :: changeInput (bool firstFile)
     tree->SetBranchAddress( triggerNames.at(iT).c_str(), &triggers.at(iT) );
   }
 
-  return EL::StatusCode::SUCCESS;
+  // Switch off the branches that neither the selections nor the enabled histograms read
+  // A skim keeps all of the above, so histograms can be added later without a new skim
+  if( !m_skimDir.empty() )
+    return;
+  TObjArray* branches = tree->GetListOfBranches();
+  for(int iB=0; iB < branches->GetEntriesFast(); ++iB){
+    const char* branchName = branches->At(iB)->GetName();
+    if( tree->GetBranchStatus(branchName) && m_usedBranches.find(branchName) == m_usedBranches.end() )
+      tree->SetBranchStatus(branchName, 0);
+  }
+}
+
+//Opens the skim of the current input in m_skimDir, under the same file name: a copy of its TTree with only
+//the connected branches, filled with the events passing at least one selection, and a copy of sumWeights
+void HistogramMiniTree :: openSkim(TFile* inputFile, TTree* tree, const std::string& inputFileName) {
+
+  gSystem->mkdir( m_skimDir.c_str(), kTRUE );
+  std::string skimName = m_skimDir+"/"+inputFileName;
+  m_skimFile = TFile::Open( skimName.c_str(), "RECREATE" );
+  if( !m_skimFile || m_skimFile->IsZombie() ){
+    Error("openSkim()", "Could not create skim %s", skimName.c_str());
+    throw std::runtime_error("Failed to create a skim file");
+  }
+
+  // Copied now, as the input is closed before the skim
+  TTree* sumWeightsTree = dynamic_cast<TTree*>( inputFile->Get("sumWeights") );
+  if( sumWeightsTree ){
+    m_skimFile->cd();
+    sumWeightsTree->CloneTree(-1, "fast")->Write();
+  }
+
+  m_skimFile->cd();
+  m_skimTree = tree->CloneTree(0);
+  m_skimTree->SetDirectory( m_skimFile );
+  Info("openSkim()", "Skimming %s to %s", inputFileName.c_str(), skimName.c_str());
+}
+
+//Writes and closes the skim of the previous input
+void HistogramMiniTree :: closeSkim() {
+
+  if( !m_skimFile )
+    return;
+  m_skimFile->cd();
+  m_skimTree->Write("", TObject::kOverwrite);
+  Info("closeSkim()", "Wrote %lld events to %s", m_skimTree->GetEntries(), m_skimFile->GetName());
+  m_skimFile->Close();
+  delete m_skimFile;
+  m_skimFile = 0;
+  m_skimTree = 0;
+}
+
+//Sets the TTreeCache of the input tree from the TreeCache* config options, caching only the enabled branches
+//TreeCacheSize is in MB, and a negative value leaves the EventLoop defaults untouched
+void HistogramMiniTree :: setupTreeCache(TTree* tree) {
+
+  m_treeCache = 0;
+  if( m_treeCacheSize < 0 )
+    return;
+
+  if( m_treeCacheLearnEntries > 0 )
+    TTreeCache::SetLearnEntries( m_treeCacheLearnEntries );
+  tree->SetCacheSize( static_cast<Long64_t>(m_treeCacheSize)*1024*1024 );
+  if( m_treeCacheSize == 0 )
+    return;
+
+  TObjArray* branches = tree->GetListOfBranches();
+  int nCached = 0;
+  for(int iB=0; iB < branches->GetEntriesFast(); ++iB){
+    const char* branchName = branches->At(iB)->GetName();
+    if( tree->GetBranchStatus(branchName) ){
+      tree->AddBranchToCache( branchName, kTRUE );
+      ++nCached;
+    }
+  }
+  // Without a learning phase the enabled branches are all that is read, so stop learning right away
+  if( m_treeCacheLearnEntries == 0 )
+    tree->StopCacheLearningPhase();
+
+  m_treeCache = dynamic_cast<TTreeCache*>( tree->GetCurrentFile()->GetCacheRead(tree) );
+  if( m_treeCache && f_treeCacheAsync )
+    m_treeCache->SetEnablePrefetching( kTRUE );
+  Info("setupTreeCache()", "TTreeCache of %i MB for %i enabled branches, learning entries %i, asynchronous prefetching %s",
+      m_treeCacheSize, nCached, m_treeCacheLearnEntries, (m_treeCache && f_treeCacheAsync) ? "on" : "off");
+}
+
+//Adds the cache statistics of the current input file to the job totals, weighted by its events
+void HistogramMiniTree :: addTreeCacheStats() {
+  m_cacheHitRateSum += m_cacheFileHitRate*m_cacheFileEvents;
+  m_cacheEfficiencySum += m_cacheFileEfficiency*m_cacheFileEvents;
+  m_cacheEvents += m_cacheFileEvents;
+  m_cacheFileEvents = 0;
+  m_cacheFileHitRate = m_cacheFileEfficiency = 0.;
+  m_treeCache = 0;
 }
 
 
@@ -667,9 +886,31 @@ EL::StatusCode HistogramMiniTree :: execute ()
 
   if( (m_eventCounter%1000) == 0) Info("execute()", "Event number %i", m_eventCounter);
 
+  if( !m_treeWorkers.empty() )
+    processExtraTrees( wk()->treeEntry(), wk()->treeEntry()+1 == wk()->tree()->GetEntries() );
+
+  // In threaded mode the entry is only queued, and read and filled with the next block
+  if( m_nThreads > 1 ){
+    m_pendingEntries.push_back( wk()->treeEntry() );
+    if( m_pendingEntries.size() >= static_cast<size_t>(m_nThreads)*m_threadBlockSize )
+      processPendingEntries();
+    return EL::StatusCode::SUCCESS;
+  }
+
   //weight_mc = weight_pileup = weight_leptonSF = weight_bTagSF_70 = 1.; //Set ahead of time for data
   wk()->tree()->GetEntry (wk()->treeEntry());
+  if( m_treeCache ){ //Kept per event, as the cache is deleted with its file before the next changeInput()
+    ++m_cacheFileEvents;
+    m_cacheFileHitRate = m_treeCache->GetEfficiencyRel();
+    m_cacheFileEfficiency = m_treeCache->GetEfficiency();
+  }
 
+  processEvent();
+  return EL::StatusCode::SUCCESS;
+}
+
+//Applies the selections to the event read into the branch variables and fills its histograms
+void HistogramMiniTree :: processEvent() {
 
   if( m_debug)  Info("execute()", "Starting execute() \n");
   bool passedTriggers = false;
@@ -704,165 +945,247 @@ EL::StatusCode HistogramMiniTree :: execute ()
     //eventWeight *= weight_mc*weight_leptonSF*weight_bTagSF*weight_jvt*m_XSWeight/m_totalNumEvents;
 //    cout << "weights: " << eventWeight << "*** weight_mc ***  " << weight_mc << "**** m_XSWeight ****  " << m_XSWeight << "***TotalEventWeighted ***** " << m_totalNumEvents << endl;
   }
-  // Start different selections
+  // Per-event objects, shared by every selection //
+  m_BJetIndicies.clear();
+  for(unsigned int iJet=0; iJet < jet_mv2c10->size(); ++iJet){
+    if( jet_mv2c10->at(iJet) > m_bTagWP )
+      m_BJetIndicies.push_back(iJet);
+  }
+
+  // Evaluate every selection into one bitmask, bit iS for selections.at(iS)
+  unsigned long long passedSelections = getPassedSelections();
+  if( m_skimTree && passedSelections != 0 ){
+    m_skimTree->Fill();
+    ++m_skimEvents;
+  }
+  if( passedSelections == 0 )
+    return;
+
+  // Per event values, summed once in the same order and precision as before, and only if a histogram uses them //
+  float lepton_sumPt = 0.0;
+  if( m_usedEventValues[kHtAll] ){
+    for(unsigned int iE=0; iE < el_pt->size(); ++iE)
+      lepton_sumPt += el_pt->at(iE)/1e3;
+    for(unsigned int iM=0; iM < mu_pt->size(); ++iM)
+      lepton_sumPt += mu_pt->at(iM)/1e3;
+  }
+
+  float ht_hadronic = 0.0;
+  if( m_usedEventValues[kJetHt] || m_usedEventValues[kHtAll] ){
+    for(unsigned int iJ=0; iJ < jet_pt->size(); ++iJ)
+      ht_hadronic += jet_pt->at(iJ)/1e3;
+  }
+
+  float ht_hadronic_bjet = 0.0;
+  if( m_usedEventValues[kBJetHt] ){
+    for(unsigned int iB=0; iB < m_BJetIndicies.size(); ++iB)
+      ht_hadronic_bjet += jet_pt->at(m_BJetIndicies.at(iB))/1e3;
+  }
+
+  m_eventValues[kJetN] = jet_pt->size();
+  m_eventValues[kJetHt] = ht_hadronic;
+  m_eventValues[kBJetN] = m_BJetIndicies.size();
+  m_eventValues[kBJetHt] = ht_hadronic_bjet;
+  if( m_usedEventValues[kMet] || m_usedEventValues[kHtAll] ){
+    m_eventValues[kMet] = met_met/1e3;
+    m_eventValues[kHtAll] = ht_hadronic + lepton_sumPt + met_met/1e3;
+  }
+  if( m_usedEventValues[kBDT] )
+    m_eventValues[kBDT] = ClassifBDTOutput_withReco_basic;
+
+  // Fill only the selections whose bit is set
+  for(unsigned int iS=0; iS < selections.size(); ++iS){
+    if( passedSelections & (1ULL << iS) )
+      fillHists( iS, eventWeight );
+  } //selections
+}
+
+
+//Returns a bitmask of the selections passed by the current event, bit iS for selections.at(iS)
+//The channel flags and object multiplicities are checked once per event, not once per selection
+unsigned long long HistogramMiniTree :: getPassedSelections() {
+
+  unsigned int nJets = jet_pt->size();
+  unsigned int nBJets = m_BJetIndicies.size();
+
+  // Get selections from Preselection //
+  bool passedElectron = true, passedMuon = true;
+  if (f_leptonDecision){
+    passedElectron = (!f_use2016 || ejets_2016 == 1) && (!f_use2015 || ejets_2015 == 1);
+    passedMuon = (!f_use2016 || mujets_2016 == 1) && (!f_use2015 || mujets_2015 == 1);
+  }
+
+  unsigned long long passedSelections = 0;
   for(unsigned int iS=0; iS < selections.size(); ++iS){
+    const Selection* selection = selections.at(iS);
 
-    if( m_debug)  Info("execute()", "Starting selection %s \n", selections.at(iS)->name.c_str() );
-    //selections
-    //
-   
-    if (selections.at(iS)->jetNum != -1){ //jet Selection is set
-       if( selections.at(iS)->jetEquality && jet_pt->size() != selections.at(iS)->jetNum)
+    if (selection->jetNum != -1){ //jet Selection is set
+      if( selection->jetEquality && nJets != selection->jetNum )
         continue;
-       else if( (!selections.at(iS)->jetEquality) && jet_pt->size() < selections.at(iS)->jetNum)
+      else if( (!selection->jetEquality) && nJets < selection->jetNum )
         continue;
     }
 
-    // Get selections from Preselection //
     if (f_leptonDecision){
-      if (selections.at(iS)->elNum == 1 && f_use2016 && ejets_2016 != 1){
+      if (selection->elNum == 1 && !passedElectron)
         continue;
-      }
-      if (selections.at(iS)->muNum == 1 && f_use2016 && mujets_2016 != 1){
-        continue;
-      }
-      if (selections.at(iS)->elNum == 1 && f_use2015 && ejets_2015 != 1){
-        continue;
-      }
-      if (selections.at(iS)->muNum == 1 && f_use2015 && mujets_2015 != 1){
+      if (selection->muNum == 1 && !passedMuon)
         continue;
-      }
     } else {
-
-      if (selections.at(iS)->elNum != -1 && el_pt->size() != selections.at(iS)->elNum)
+      if (selection->elNum != -1 && el_pt->size() != selection->elNum)
         continue;
-      if (selections.at(iS)->muNum != -1 && mu_pt->size() != selections.at(iS)->muNum)
+      if (selection->muNum != -1 && mu_pt->size() != selection->muNum)
         continue;
-
     }
 
-      //cout << "Channel e / mu " << ejets << " / " << mujets << endl;
-      //cout << "#of electrons: " << el_pt->size() << endl;
-      //cout << "#of Muons: " << mu_pt->size() << endl;
-    //Here to remove the overlap with the dilepton channel!
-
-
-    vector<int> BJetIndicies;
-    for(unsigned int iJet=0; iJet < jet_mv2c10->size(); ++iJet){
-      if( jet_mv2c10->at(iJet) > m_bTagWP )
-        BJetIndicies.push_back(iJet);
-  } 
-
-    if (selections.at(iS)->bJetNum != -1){
-      if( selections.at(iS)->bJetEquality &&  BJetIndicies.size() != selections.at(iS)->bJetNum)
+    if (selection->bJetNum != -1){
+      if( selection->bJetEquality && nBJets != selection->bJetNum )
         continue;
-      if( (!selections.at(iS)->bJetEquality) &&  BJetIndicies.size() < selections.at(iS)->bJetNum)
+      if( (!selection->bJetEquality) && nBJets < selection->bJetNum )
         continue;
     }
-    
-    // Histogram Filling //
-    if( m_debug)  Info("execute()", "Starting Histogram filling \n");
-    float lepton_sumPt = 0.0;
-
-    //electrons
-    for(unsigned int iE=0; iE < el_pt->size(); ++iE){
-      h_el_pt_all.at(iS)->Fill( el_pt->at(iE)/1e3, eventWeight );
-      h_el_eta_all.at(iS)->Fill( el_eta->at(iE), eventWeight );
-      h_el_phi_all.at(iS)->Fill( el_phi->at(iE), eventWeight );
-      h_el_e_all.at(iS)->Fill( el_e->at(iE)/1e3, eventWeight );
 
-      lepton_sumPt += el_pt->at(iE)/1e3;
+    passedSelections |= (1ULL << iS);
+  }
 
-      if( iE < numHistElectrons){
-        vh_el_pt.at(iS).at(iE)->Fill( el_pt->at(iE)/1e3, eventWeight );
-        vh_el_eta.at(iS).at(iE)->Fill( el_eta->at(iE), eventWeight );
-        vh_el_phi.at(iS).at(iE)->Fill( el_phi->at(iE), eventWeight );
-        vh_el_e.at(iS).at(iE)->Fill( el_e->at(iE)/1e3, eventWeight );
-      }
-    }//end electrons
+  return passedSelections;
+}
 
-    //muons
-    for(unsigned int iM=0; iM < mu_pt->size(); ++iM){
-      if( (mu_pt->at(iM)/1e3) < 25.){
-        //cout << "Bad event" << endl;
-        //cout << mu_pt->size() << " vs " << el_pt->size() << endl;
-      }
-      h_mu_pt_all.at(iS)->Fill( mu_pt->at(iM)/1e3, eventWeight );
-      h_mu_eta_all.at(iS)->Fill( mu_eta->at(iM), eventWeight );
-      h_mu_phi_all.at(iS)->Fill( mu_phi->at(iM), eventWeight );
-      h_mu_e_all.at(iS)->Fill( mu_e->at(iM)/1e3, eventWeight );
 
-      lepton_sumPt += mu_pt->at(iM)/1e3;
+//Fills the booked histograms of selection iS for the current event
+void HistogramMiniTree :: fillHists(unsigned int iS, float eventWeight) {
 
-      if( iM < numHistMuons){
-        vh_mu_pt.at(iS).at(iM)->Fill( mu_pt->at(iM)/1e3, eventWeight );
-        vh_mu_eta.at(iS).at(iM)->Fill( mu_eta->at(iM), eventWeight );
-        vh_mu_phi.at(iS).at(iM)->Fill( mu_phi->at(iM), eventWeight );
-        vh_mu_e.at(iS).at(iM)->Fill( mu_e->at(iM)/1e3, eventWeight );
-      }
-    }//end muons
+  if( m_debug)  Info("execute()", "Starting Histogram filling for selection %s \n", selections.at(iS)->name.c_str() );
+  const vector<FilledHist>& filledHists = m_selectionHists.at(iS);
+  for(unsigned int iH=0; iH < filledHists.size(); ++iH){
+    const FilledHist& filledHist = filledHists.at(iH);
+    if( filledHist.index == -2 ){
+      fill( filledHist.hist, m_eventValues[filledHist.variable], eventWeight );
+      continue;
+    }
 
-    //jets
-    float ht_hadronic = 0.0;
+    // b-jets are the jets at m_BJetIndicies
+    const vector<float>* values = getObjectValues( filledHist.object, filledHist.variable );
+    const bool isBJet = (filledHist.object == kBJet);
+    const unsigned int nObjects = isBJet ? m_BJetIndicies.size() : values->size();
+    const double scale = (filledHist.variable == kPt || filledHist.variable == kE) ? 1e3 : 1.; //MeV to GeV
+    if( filledHist.index == -1 ){
+      for(unsigned int iObj=0; iObj < nObjects; ++iObj)
+        fill( filledHist.hist, values->at( isBJet ? m_BJetIndicies.at(iObj) : iObj )/scale, eventWeight );
+    } else if( (unsigned int) filledHist.index < nObjects ){
+      fill( filledHist.hist, values->at( isBJet ? m_BJetIndicies.at(filledHist.index) : filledHist.index )/scale, eventWeight );
+    }
+  }
+}
 
-    h_jet_n.at(iS)->Fill( jet_pt->size(), eventWeight );
-    for(unsigned int iJ=0; iJ < jet_pt->size(); ++iJ){
-      ht_hadronic += jet_pt->at(iJ)/1e3;
+//Returns the branch vector of an object variable
+const vector<float>* HistogramMiniTree :: getObjectValues(int object, int variable) {
 
-      h_jet_pt_all.at(iS)->Fill( jet_pt->at(iJ)/1e3, eventWeight );
-      h_jet_eta_all.at(iS)->Fill( jet_eta->at(iJ), eventWeight );
-      h_jet_phi_all.at(iS)->Fill( jet_phi->at(iJ), eventWeight );
-      h_jet_e_all.at(iS)->Fill( jet_e->at(iJ)/1e3, eventWeight );
-      h_jet_mv2c10_all.at(iS)->Fill( jet_mv2c10->at(iJ), eventWeight );
-
-      if( iJ < numHistJets){
-        vh_jet_pt.at(iS).at(iJ)->Fill( jet_pt->at(iJ)/1e3, eventWeight );
-        vh_jet_eta.at(iS).at(iJ)->Fill( jet_eta->at(iJ), eventWeight );
-        vh_jet_phi.at(iS).at(iJ)->Fill( jet_phi->at(iJ), eventWeight );
-        vh_jet_e.at(iS).at(iJ)->Fill( jet_e->at(iJ)/1e3, eventWeight );
-        vh_jet_mv2c10.at(iS).at(iJ)->Fill( jet_mv2c10->at(iJ), eventWeight );
-      }
-    }//end jets
-    h_jet_ht.at(iS)->Fill( ht_hadronic, eventWeight );
-
-    float ht_hadronic_bjet = 0.0;
-    //b-jets
-    h_bjet_n.at(iS)->Fill( BJetIndicies.size(), eventWeight );
-    for(unsigned int iB=0; iB < BJetIndicies.size(); ++iB){
-      unsigned int iJ = BJetIndicies.at(iB);
-
-      ht_hadronic_bjet += jet_pt->at(iJ)/1e3;
-
-      h_bjet_pt_all.at(iS)->Fill( jet_pt->at(iJ)/1e3, eventWeight );
-      h_bjet_eta_all.at(iS)->Fill( jet_eta->at(iJ), eventWeight );
-      h_bjet_phi_all.at(iS)->Fill( jet_phi->at(iJ), eventWeight );
-      h_bjet_e_all.at(iS)->Fill( jet_e->at(iJ)/1e3, eventWeight );
-      h_bjet_mv2c10_all.at(iS)->Fill( jet_mv2c10->at(iJ), eventWeight );
-
-      if( iB < numHistJets){
-        vh_bjet_pt.at(iS).at(iB)->Fill( jet_pt->at(iJ)/1e3, eventWeight );
-        vh_bjet_eta.at(iS).at(iB)->Fill( jet_eta->at(iJ), eventWeight );
-        vh_bjet_phi.at(iS).at(iB)->Fill( jet_phi->at(iJ), eventWeight );
-        vh_bjet_e.at(iS).at(iB)->Fill( jet_e->at(iJ)/1e3, eventWeight );
-        vh_bjet_mv2c10.at(iS).at(iB)->Fill( jet_mv2c10->at(iJ), eventWeight );
-      }
-    }//end b-jets
-    h_bjet_ht.at(iS)->Fill( ht_hadronic_bjet, eventWeight );
+  switch( object ){
+    case kElectron: {
+      const vector<float>* values[] = { el_pt, el_eta, el_phi, el_e };
+      return values[variable];
+    }
+    case kMuon: {
+      const vector<float>* values[] = { mu_pt, mu_eta, mu_phi, mu_e };
+      return values[variable];
+    }
+    default: {
+      const vector<float>* values[] = { jet_pt, jet_eta, jet_phi, jet_e, jet_mv2c10 };
+      return values[variable];
+    }
+  }
+}
+
+
+//Opens the current input file once per worker thread, each a copy of this algorithm reading its own TTree
+//Called from changeInput(), so the workers read the file and use the normalization of the entries queued after it
+void HistogramMiniTree :: createThreadWorkers() {
+
+  ROOT::EnableThreadSafety();
+  const std::string fileName = wk()->inputFile()->GetName();
+  const std::string treeName = wk()->tree()->GetName();
+  for(int iT=0; iT < m_nThreads; ++iT){
+    HistogramMiniTree* worker = new HistogramMiniTree();
+    copyConfiguration( worker ); //Same histograms, only recorded into fill buffers by the worker
+    worker->m_isMC = m_isMC;
+    worker->m_XSWeight = m_XSWeight;
+    worker->m_totalNumEvents = m_totalNumEvents;
+
+    worker->m_threadFile = TFile::Open( fileName.c_str(), "READ" );
+    worker->m_threadTree = worker->m_threadFile ? dynamic_cast<TTree*>( worker->m_threadFile->Get(treeName.c_str()) ) : 0;
+    if( !worker->m_threadTree ){
+      Error("createThreadWorkers()", "Could not read TTree %s of %s", treeName.c_str(), fileName.c_str());
+      delete worker->m_threadFile;
+      delete worker;
+      throw std::runtime_error("Failed to open the input of a worker thread");
+    }
+    worker->connectBranches( worker->m_threadTree );
+    worker->setupTreeCache( worker->m_threadTree );
+    worker->m_cacheFileEvents = 0;
+    worker->m_cacheFileHitRate = worker->m_cacheFileEfficiency = 0.;
+    m_threadWorkers.push_back( worker );
+  }
+  Info("createThreadWorkers()", "Reading %s with %i threads", fileName.c_str(), m_nThreads);
+}
 
-    //float ClassifBDTOutput_withReco_basic =0.0;
+//Adds the cache statistics of the worker threads to the job totals, then closes their inputs
+void HistogramMiniTree :: deleteThreadWorkers() {
+  for(unsigned int iT=0; iT < m_threadWorkers.size(); ++iT){
+    const HistogramMiniTree* worker = m_threadWorkers.at(iT);
+    m_cacheHitRateSum += worker->m_cacheFileHitRate*worker->m_cacheFileEvents;
+    m_cacheEfficiencySum += worker->m_cacheFileEfficiency*worker->m_cacheFileEvents;
+    m_cacheEvents += worker->m_cacheFileEvents;
+    delete m_threadWorkers.at(iT)->m_threadFile;
+    delete m_threadWorkers.at(iT);
+  }
+  m_threadWorkers.clear();
+}
 
-    //others
-    if( m_debug)  Info("execute()", "Starting other histograms \n");
-    h_met.at(iS)->Fill( met_met/1e3 , eventWeight );
-    h_ht_all.at(iS)->Fill( ht_hadronic + lepton_sumPt + met_met/1e3, eventWeight );
-    h_ClassifBDTOutput_withReco_basic.at(iS)->Fill( ClassifBDTOutput_withReco_basic, eventWeight );
+//Reads and selects the queued entries in contiguous ranges, one per worker thread, then replays the
+//recorded fills range by range.  Every histogram is filled in entry order, as without threads, so
+//the output is identical to the single-threaded event loop
+void HistogramMiniTree :: processPendingEntries() {
 
-    // mtw ?!
+  if( m_pendingEntries.empty() )
+    return;
+  if( m_threadWorkers.empty() ){
+    Error("processPendingEntries()", "No worker threads for %lu queued entries", m_pendingEntries.size());
+    throw std::runtime_error("Entries queued without worker threads");
+  }
 
+  const size_t nEntries = m_pendingEntries.size();
+  const size_t nWorkers = m_threadWorkers.size();
+  vector< vector<FillRecord> > fillBuffers( nWorkers );
+  vector<std::thread> threads;
+  for(size_t iT=0; iT < nWorkers; ++iT){
+    threads.push_back( std::thread( &HistogramMiniTree::processEntries, m_threadWorkers.at(iT),
+          m_pendingEntries.begin()+nEntries*iT/nWorkers, m_pendingEntries.begin()+nEntries*(iT+1)/nWorkers, &fillBuffers.at(iT) ) );
+  }
+  for(size_t iT=0; iT < nWorkers; ++iT)
+    threads.at(iT).join();
 
-  } //selections
+  for(size_t iT=0; iT < nWorkers; ++iT){
+    const vector<FillRecord>& fillBuffer = fillBuffers.at(iT);
+    for(size_t iF=0; iF < fillBuffer.size(); ++iF)
+      fillBuffer[iF].hist->Fill( fillBuffer[iF].value, fillBuffer[iF].weight );
+  }
+  m_pendingEntries.clear();
+}
 
-  return EL::StatusCode::SUCCESS;
+//Run by a worker thread, records the fills of the entries [first, last) of its own TTree into fillBuffer
+void HistogramMiniTree :: processEntries(vector<Long64_t>::const_iterator first, vector<Long64_t>::const_iterator last, vector<FillRecord>* fillBuffer) {
+  m_fillBuffer = fillBuffer;
+  for(vector<Long64_t>::const_iterator entry = first; entry != last; ++entry){
+    m_threadTree->GetEntry( *entry );
+    processEvent();
+  }
+  if( m_treeCache ){ //Read before deleteThreadWorkers() closes the file with its cache
+    m_cacheFileEvents += last-first;
+    m_cacheFileHitRate = m_treeCache->GetEfficiencyRel();
+    m_cacheFileEfficiency = m_treeCache->GetEfficiency();
+  }
+  m_fillBuffer = 0;
 }
 
 
@@ -888,6 +1211,32 @@ EL::StatusCode HistogramMiniTree :: finalize ()
   // merged.  This is different from histFinalize() in that it only
   // gets called on worker nodes that processed input events.
 
+  if( m_nThreads > 1 ){
+    processPendingEntries();
+    deleteThreadWorkers();
+  }
+
+  closeSkim();
+  if( !m_skimDir.empty() )
+    Info("finalize()", "Skimmed %lld of %i events to %s", m_skimEvents, m_eventCounter+1, m_skimDir.c_str());
+
+  if( !m_treeWorkers.empty() )
+    Info("finalize()", "Processed %lld events of %lu extra trees", m_extraTreeEvents, m_treeWorkers.size());
+  for(unsigned int iT=0; iT < m_treeWorkers.size(); ++iT)
+    delete m_treeWorkers.at(iT);
+  m_treeWorkers.clear();
+
+  // Summary lines parsed by runLocalHistogrammer.py for the job telemetry
+  Info("finalize()", "Processed %i events", m_eventCounter+1);
+  Info("finalize()", "Bytes read %lld", TFile::GetFileBytesRead());
+  Info("finalize()", "Read calls %i", TFile::GetFileReadCalls());
+  addTreeCacheStats();
+  if( m_cacheEvents > 0 ){
+    double hitRate = m_cacheHitRateSum/m_cacheEvents;
+    Info("finalize()", "TTreeCache hit rate %.4f, miss rate %.4f, prefetch efficiency %.4f over %lld events",
+        hitRate, 1.-hitRate, m_cacheEfficiencySum/m_cacheEvents, m_cacheEvents);
+  }
+
   return EL::StatusCode::SUCCESS;
 }
 
@@ -908,40 +1257,217 @@ EL::StatusCode HistogramMiniTree :: histFinalize ()
   return EL::StatusCode::SUCCESS;
 }
 
-//This grabs cross section and acceptance from XS_Samples.txt
-EL::StatusCode HistogramMiniTree :: getLumiWeights() {
+//Replaces every occurance of from in str
+static void replaceAll(std::string& str, const std::string& from, const std::string& to) {
+  for(size_t iPos = str.find(from); iPos != std::string::npos; iPos = str.find(from, iPos+to.size()))
+    str.replace(iPos, from.size(), to);
+}
 
-  m_XSWeight = 1.;
-  if(!m_isMC){
-    return EL::StatusCode::SUCCESS;
+//This reads the histogram table into m_histDefinitions, with one definition per object position,
+//and records the branches and per event values needed by the selections and the enabled histograms
+EL::StatusCode HistogramMiniTree :: loadHistTable() {
+
+  m_histDefinitions.clear();
+  for(int iV=0; iV < kNEventValues; ++iV)
+    m_usedEventValues[iV] = false;
+
+  // Always read for the selections and the event weight
+  const char* selectionBranches[] = { "ejets_2015", "ejets_2016", "mujets_2015", "mujets_2016", "jet_pt", "jet_mv2c10",
+    "weight_mc", "weight_pileup", "weight_leptonSF", "weight_bTagSF_70", "weight_jvt" };
+  m_usedBranches = std::set<std::string>( selectionBranches, selectionBranches+11 );
+  if( !f_leptonDecision ){
+    m_usedBranches.insert("el_pt");
+    m_usedBranches.insert("mu_pt");
   }
+  m_usedBranches.insert( triggerNames.begin(), triggerNames.end() );
+
+  ifstream fileIn(  gSystem->ExpandPathName(m_histTable.c_str()) );
+  if( !fileIn.is_open() ){
+    cerr << "ERROR: Could not open histogram table " << m_histTable << endl;
+    return EL::StatusCode::FAILURE;
+  }
+
+  const std::string objectNames[] = { "el", "mu", "jet", "bjet", "event" };
+  const std::string branchPrefixes[] = { "el_", "mu_", "jet_", "jet_" };
+  const std::string variableNames[] = { "pt", "eta", "phi", "e", "mv2c10" };
+  const std::string eventValueNames[] = { "n", "ht", "n", "ht", "met", "ht_all", "ClassifBDTOutput_withReco_basic" };
+  const int eventValueObjects[] = { kJet, kJet, kBJet, kBJet, kEvent, kEvent, kEvent };
 
-  ifstream fileIn(  gSystem->ExpandPathName("$ROOTCOREBIN/data/ttHHistogrammer/XS_Samples.txt") );
   std::string line;
-  std::string subStr;
+  while (getline(fileIn, line)){
+    // Titles may hold a # (i.e. #eta), so only lines starting with one are comments
+    size_t iFirst = line.find_first_not_of(" \t");
+    if (iFirst == std::string::npos || line[iFirst] == '#')
+      continue;
+
+    istringstream iss(line);
+    HistDefinition definition;
+    std::string objectName, variableName, indexRange, selectionList;
+    if( !(iss >> definition.name >> objectName >> variableName >> indexRange >> definition.nBins >> definition.xMin >> definition.xMax >> selectionList) ){
+      Error("loadHistTable()", "Could not read histogram table line %s", line.c_str());
+      return EL::StatusCode::FAILURE;
+    }
+    getline(iss, definition.xTitle);
+    definition.xTitle.erase(0, definition.xTitle.find_first_not_of(" \t"));
+    definition.xTitle.erase(definition.xTitle.find_last_not_of(" \t\r")+1);
+
+    definition.object = std::find(objectNames, objectNames+5, objectName) - objectNames;
+    definition.variable = -1;
+    if( indexRange == "-" ){
+      definition.index = -2;
+      for(int iV=0; iV < kNEventValues; ++iV){
+        if( eventValueObjects[iV] == definition.object && eventValueNames[iV] == variableName )
+          definition.variable = iV;
+      }
+    } else if( definition.object < kEvent ){
+      definition.index = -1;
+      int nVariables = (definition.object == kJet || definition.object == kBJet) ? 5 : 4;
+      for(int iV=0; iV < nVariables; ++iV){
+        if( variableNames[iV] == variableName )
+          definition.variable = iV;
+      }
+    }
+    if( definition.variable == -1 ){
+      Error("loadHistTable()", "Unknown histogram variable %s %s with index %s", objectName.c_str(), variableName.c_str(), indexRange.c_str());
+      return EL::StatusCode::FAILURE;
+    }
+
+    std::stringstream ss(selectionList);
+    std::string thisSelection;
+    while (std::getline(ss, thisSelection, ','))
+      definition.selections.push_back( thisSelection );
+
+    // Branches and per event values this histogram needs
+    if( definition.index == -2 ){
+      m_usedEventValues[definition.variable] = true;
+      if( definition.variable == kMet || definition.variable == kHtAll )
+        m_usedBranches.insert("met_met");
+      if( definition.variable == kHtAll ){
+        m_usedBranches.insert("el_pt");
+        m_usedBranches.insert("mu_pt");
+      }
+      if( definition.variable == kBDT )
+        m_usedBranches.insert("ClassifBDTOutput_withReco_basic");
+    } else {
+      m_usedBranches.insert( branchPrefixes[definition.object]+variableNames[definition.variable] );
+    }
+
+    // One definition for all objects or per event, or one per object position of i or i-j
+    if( indexRange == "-" || indexRange == "all" ){
+      m_histDefinitions.push_back( definition );
+      continue;
+    }
+    int firstIndex = -1, lastIndex = -1;
+    size_t iDash = indexRange.find('-');
+    try {
+      firstIndex = std::stoi( indexRange.substr(0, iDash) );
+      lastIndex = (iDash == std::string::npos) ? firstIndex : std::stoi( indexRange.substr(iDash+1) );
+    } catch (const std::exception&) {}
+    if( firstIndex < 0 || lastIndex < firstIndex ){
+      Error("loadHistTable()", "Bad object index %s of histogram %s", indexRange.c_str(), definition.name.c_str());
+      return EL::StatusCode::FAILURE;
+    }
+    for(int iObj=firstIndex; iObj <= lastIndex; ++iObj){
+      HistDefinition objectDefinition = definition;
+      objectDefinition.index = iObj;
+      replaceAll( objectDefinition.name, "$i", to_string(iObj) );
+      replaceAll( objectDefinition.name, "$n", to_string(iObj+1) );
+      replaceAll( objectDefinition.xTitle, "$i", to_string(iObj) );
+      replaceAll( objectDefinition.xTitle, "$n", to_string(iObj+1) );
+      m_histDefinitions.push_back( objectDefinition );
+    }
+  }
+
+  Info("loadHistTable()", "Loaded %lu histograms reading %lu branches from %s", m_histDefinitions.size(), m_usedBranches.size(), m_histTable.c_str());
+  return EL::StatusCode::SUCCESS;
+}
+
+//Returns true if the histogram is enabled for the selection, by name or by a pattern with a trailing *
+bool HistogramMiniTree :: useSelection(const HistDefinition& definition, const std::string& selectionName) {
+
+  for(unsigned int iSel=0; iSel < definition.selections.size(); ++iSel){
+    const std::string& pattern = definition.selections.at(iSel);
+    if( !pattern.empty() && pattern[pattern.size()-1] == '*' ){
+      if( selectionName.compare(0, pattern.size()-1, pattern, 0, pattern.size()-1) == 0 )
+        return true;
+    } else if( pattern == selectionName ){
+      return true;
+    }
+  }
+  return false;
+}
 
+//This reads the text index of buildInputIndex.py into m_inputFileInfos
+EL::StatusCode HistogramMiniTree :: loadInputIndex() {
 
-  bool foundFile = false;
-  float thisXS;
-  float thisFiltEff;
+  m_inputFileInfos.clear();
+  ifstream fileIn(  gSystem->ExpandPathName(m_inputIndex.c_str()) );
+  if( !fileIn.is_open() ){
+    cerr << "ERROR: Could not open input index " << m_inputIndex << endl;
+    return EL::StatusCode::FAILURE;
+  }
+
+  std::string line;
   while (getline(fileIn, line)){
+    if (line.empty() || line[0] == '#')
+      continue;
     istringstream iss(line);
-    iss >> subStr;
-    if (subStr.find(m_mcChannelNumber) != string::npos){
-      foundFile = true;
-      iss >> subStr;
-      sscanf(subStr.c_str(), "%e", &thisXS);
-      iss >> subStr;
-      sscanf(subStr.c_str(), "%e", &thisFiltEff);
-      cout << "Setting xs / acceptance " << thisXS << ":" << thisFiltEff << endl;
-      m_XSWeight = thisXS*thisFiltEff;
+    std::string fileName;
+    InputFileInfo fileInfo;
+    if( !(iss >> fileName >> fileInfo.entries >> fileInfo.sumWeights >> fileInfo.dsid >> fileInfo.isData >> fileInfo.size) ){
+      cerr << "WARNING: Skipping input index line " << line << endl;
       continue;
     }
+    m_inputFileInfos[fileName] = fileInfo;
+  }
+  Info("loadInputIndex()", "Loaded %lu files from input index %s", m_inputFileInfos.size(), m_inputIndex.c_str());
+  return EL::StatusCode::SUCCESS;
+}
+
+//This parses XS_Samples.txt once into m_XSWeights, keyed by the DSID without leading zeros
+//The same format is read by scripts/crossSections.py
+EL::StatusCode HistogramMiniTree :: loadXSWeights() {
+
+  m_XSWeights.clear();
+  ifstream fileIn(  gSystem->ExpandPathName("$ROOTCOREBIN/data/ttHHistogrammer/XS_Samples.txt") );
+  if( !fileIn.is_open() ){
+    cerr << "ERROR: Could not open XS_Samples.txt" << endl;
+    return EL::StatusCode::FAILURE;
+  }
+
+  std::string line;
+  while (getline(fileIn, line)){
+    line = line.substr(0, line.find('#'));
+    istringstream iss(line);
+    std::string dsid;
+    float thisXS, thisFiltEff;
+    if( !(iss >> dsid >> thisXS >> thisFiltEff) )
+      continue;
+    dsid.erase(0, std::min(dsid.find_first_not_of('0'), dsid.size()-1)); //Remove leading zeros
+    m_XSWeights[dsid] = thisXS*thisFiltEff;
   }
-  if( !foundFile ){
+  Info("loadXSWeights()", "Loaded cross sections of %lu samples", m_XSWeights.size());
+  return EL::StatusCode::SUCCESS;
+}
+
+//This grabs cross section and acceptance from XS_Samples.txt
+EL::StatusCode HistogramMiniTree :: getLumiWeights() {
+
+  m_XSWeight = 1.;
+  if(!m_isMC){
+    return EL::StatusCode::SUCCESS;
+  }
+
+  if( m_XSWeights.empty() && loadXSWeights() != EL::StatusCode::SUCCESS )
+    return EL::StatusCode::FAILURE;
+
+  std::unordered_map<std::string, float>::const_iterator xsIter = m_XSWeights.find(m_mcChannelNumber);
+  if( xsIter == m_XSWeights.end() ){
     cerr << "ERROR: Could not find proper file information for file number " << m_mcChannelNumber << endl;
     return EL::StatusCode::FAILURE;
   }
+  m_XSWeight = xsIter->second;
+  cout << "Setting xs * acceptance " << m_XSWeight << endl;
   return EL::StatusCode::SUCCESS;
 }
 
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+##############################################################
+# buildInputIndex.py                                         #
+##############################################################
+# Scan a directory of input TTrees in parallel and record    #
+# the entries, sumWeights, DSID and size of every file       #
+##############################################################
+# Jeff.Dandoy and Nedaa.Asbah                                #
+##############################################################
+
+## Writes <name>.json, used by runLocalHistogrammer.py to balance jobs, and <name>.txt with one ##
+## "fileName entries sumWeights DSID isData size" line per file, read by HistogramMiniTree     ##
+## instead of parsing the file name and summing the sumWeights tree of every input.           ##
+
+import os, sys, glob, json, struct, multiprocessing
+import argparse
+
+parser = argparse.ArgumentParser(description="%prog [options]", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument("--path", dest='fileDir', default="./",
+     help="Path to input files")
+parser.add_argument("--inTag", dest='inputTag', default="",
+     help="Input tag for choosing files")
+parser.add_argument("--treeName", dest='treeName', default="nominal_Loose",
+     help="Name of the TTree whose entries are counted")
+parser.add_argument("--ncores", dest='ncores', default=4,
+     type=int, help="Number of files scanned in parallel")
+parser.add_argument("--output", dest='output', default=None,
+     help="Index name, without extension.  By default <path>/inputIndex")
+
+def getIndexName( fileDir, output=None ):
+  if output:
+    return output[:-5] if output.endswith('.json') else output
+  return os.path.join(fileDir, 'inputIndex')
+
+def parseFileName( fileName ):
+  """DSID or run number, and data flag, from fields like user.nasbah.mc15_13TeV.410000.ttbar...
+  Data has a field starting with data1 among the first three, the same rule as HistogramMiniTree::changeInput()"""
+  baseName = os.path.basename(fileName)
+  fields = baseName.split('.')
+  dsid = fields[3].lstrip('0') if len(fields) > 3 else ''
+  isData = any( field.startswith('data1') for field in fields[:3] )
+  return dsid or '0', isData
+
+def scanFile( scanArgs ):
+  fileName, treeName = scanArgs
+  import ROOT
+  info = {'size': os.path.getsize(fileName), 'mtime': os.path.getmtime(fileName), 'treeName': treeName}
+  info['dsid'], info['isData'] = parseFileName( fileName )
+
+  inFile = ROOT.TFile.Open(fileName, "READ")
+  if not inFile or inFile.IsZombie():
+    info['error'] = "Could not open file"
+    return fileName, info
+
+  tree = inFile.Get(treeName)
+  info['entries'] = int(tree.GetEntries()) if tree else 0
+
+  ## Accumulated in single precision, like changeInput(), so the normalization is identical ##
+  sumWeights = 0.
+  sumWeightsTree = inFile.Get("sumWeights")
+  if sumWeightsTree:
+    for iEntry in range(sumWeightsTree.GetEntries()):
+      sumWeightsTree.GetEntry(iEntry)
+      sumWeights = struct.unpack('f', struct.pack('f', sumWeights + sumWeightsTree.totalEventsWeighted))[0]
+  info['sumWeights'] = sumWeights
+  inFile.Close()
+  return fileName, info
+
+def loadIndex( indexName ):
+  """Return {fileName: info} of an existing index, or {} if there is none"""
+  if not os.path.exists(indexName+'.json'):
+    return {}
+  try:
+    with open(indexName+'.json', 'r') as indexFile:
+      return json.load(indexFile)
+  except ValueError:
+    print "WARNING: Could not read", indexName+'.json', "rescanning all inputs"
+    return {}
+
+def isCurrent( info, fileName, treeName ):
+  return ( info is not None and not 'error' in info and info['treeName'] == treeName
+      and info['size'] == os.path.getsize(fileName) and info['mtime'] == os.path.getmtime(fileName) )
+
+def buildIndex( fileNames, indexName, treeName, ncores=4 ):
+  """Scan fileNames, reusing the entries of files unchanged since the last scan, and write the index"""
+  oldIndex = loadIndex( indexName )
+  index = {}
+  toScan = []
+  for fileName in fileNames:
+    baseName = os.path.basename(fileName)
+    if isCurrent( oldIndex.get(baseName), fileName, treeName ):
+      index[baseName] = oldIndex[baseName]
+    else:
+      toScan.append( (fileName, treeName) )
+
+  if len(toScan) > 0:
+    print "Scanning", len(toScan), "of", len(fileNames), "files"
+    pool = multiprocessing.Pool( max(1, min(ncores, len(toScan))) )
+    try:
+      for fileName, info in pool.imap_unordered( scanFile, toScan ):
+        if 'error' in info:
+          print "WARNING:", info['error'], fileName
+        index[os.path.basename(fileName)] = info
+    finally:
+      pool.close()
+      pool.join()
+
+  writeIndex( index, indexName )
+  return index
+
+def writeIndex( index, indexName ):
+  with open(indexName+'.json.tmp', 'w') as indexFile:
+    json.dump(index, indexFile, indent=1, sort_keys=True)
+  os.rename(indexName+'.json.tmp', indexName+'.json')
+
+  with open(indexName+'.txt.tmp', 'w') as indexFile:
+    indexFile.write("# fileName entries sumWeights DSID isData size\n")
+    for baseName, info in sorted(index.items()):
+      if 'error' in info:
+        continue
+      indexFile.write( "{0} {1} {2!r} {3} {4} {5}\n".format(baseName, info['entries'], info['sumWeights'], info['dsid'], int(info['isData']), info['size']) )
+  os.rename(indexName+'.txt.tmp', indexName+'.txt')
+
+def main():
+  args = parser.parse_args()
+  fileNames = glob.glob(args.fileDir.rstrip('/')+'/*'+args.inputTag+'*.root')
+  if len(fileNames) == 0:
+    print "ERROR: No input files found in", args.fileDir
+    exit(1)
+
+  indexName = getIndexName( args.fileDir, args.output )
+  index = buildIndex( fileNames, indexName, args.treeName, args.ncores )
+  nEntries = sum( info.get('entries', 0) for info in index.values() )
+  print "Indexed", len(index), "files with", nEntries, "entries in", indexName+'.json', "and", indexName+'.txt'
+
+if __name__ == "__main__":
+  main()
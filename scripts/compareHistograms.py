@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+##############################################################
+# compareHistograms.py                                       #
+##############################################################
+# Compare every histogram of two histogram files, i.e. the   #
+# EventLoop and pyHistogrammer.py outputs of the same input  #
+##############################################################
+# Jeff.Dandoy and Nedaa.Asbah                                #
+##############################################################
+
+## pyHistogrammer.py rounds the bin contents to single precision after every fill in the      ##
+## order of the EventLoop, like TH1F, so by default every bin must be identical.  A relative   ##
+## tolerance can be given to compare outputs filled in a different order, i.e. merged shards.  ##
+
+import os, sys
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'plotting'))
+
+parser = argparse.ArgumentParser(description="%prog [options]", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument("reference", help="Reference histogram file, i.e. the EventLoop output")
+parser.add_argument("test", help="Histogram file compared to the reference")
+parser.add_argument("--tolerance", dest='tolerance', default=0.,
+     type=float, help="Relative tolerance of the bin contents and errors")
+parser.add_argument("--verbose", dest='verbose', action='store_true', default=False,
+     help="Print every differing bin, not only the first of each histogram")
+
+def getHists( directory, path="" ):
+  """{path/name: histogram} of all 1D histograms of a directory, recursively"""
+  import ROOT
+  hists = {}
+  for key in directory.GetListOfKeys():
+    obj = key.ReadObj()
+    name = path+obj.GetName()
+    if obj.InheritsFrom("TDirectory"):
+      hists.update( getHists( obj, name+"/" ) )
+    elif obj.InheritsFrom("TH1") and obj.GetDimension() == 1:
+      obj.SetDirectory(0)
+      hists[name] = obj
+  return hists
+
+def isClose( a, b, tolerance ):
+  return abs(a-b) <= tolerance*max(abs(a), abs(b)) or (a == 0 and b == 0)
+
+def compareHist( name, refHist, testHist, tolerance, verbose=False ):
+  """Return a list of the differences between two histograms"""
+  import histArrays
+  if refHist.GetNbinsX() != testHist.GetNbinsX() or not isClose( refHist.GetXaxis().GetXmin(), testHist.GetXaxis().GetXmin(), 1e-6 ) \
+      or not isClose( refHist.GetXaxis().GetXmax(), testHist.GetXaxis().GetXmax(), 1e-6 ):
+    return [ name+": different binning" ]
+
+  differences = []
+  if int(refHist.GetEntries()) != int(testHist.GetEntries()):
+    differences.append( "{0}: entries {1} != {2}".format(name, int(refHist.GetEntries()), int(testHist.GetEntries())) )
+
+  refContents, refSumw2 = histArrays.getArrays( refHist )
+  testContents, testSumw2 = histArrays.getArrays( testHist )
+  for iBin in range(len(refContents)):
+    for label, refValue, testValue in [('content', refContents[iBin], testContents[iBin]), ('sumw2', refSumw2[iBin], testSumw2[iBin])]:
+      if not isClose( refValue, testValue, tolerance ):
+        differences.append( "{0}: bin {1} {2} {3!r} != {4!r}".format(name, iBin, label, refValue, testValue) )
+        if not verbose:
+          return differences
+  return differences
+
+def main():
+  args = parser.parse_args()
+  import ROOT
+  refFile = ROOT.TFile.Open( args.reference, "READ" )
+  testFile = ROOT.TFile.Open( args.test, "READ" )
+  refHists = getHists( refFile )
+  testHists = getHists( testFile )
+
+  differences = []
+  for name in sorted( set(refHists) - set(testHists) ):
+    differences.append( name+": missing from "+args.test )
+  for name in sorted( set(testHists) - set(refHists) ):
+    differences.append( name+": missing from "+args.reference )
+  for name in sorted( set(refHists) & set(testHists) ):
+    differences += compareHist( name, refHists[name], testHists[name], args.tolerance, args.verbose )
+
+  for difference in differences:
+    print difference
+  print "Compared", len( set(refHists) & set(testHists) ), "histograms,", len(differences), "differences"
+  refFile.Close()
+  testFile.Close()
+  if len(differences) > 0:
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+##############################################################
+# crossSections.py                                           #
+##############################################################
+# Parsed XS_Samples.txt, with an exact DSID lookup shared by #
+# the histogramming, merging and plotting scripts            #
+##############################################################
+# Jeff.Dandoy and Nedaa.Asbah                                #
+##############################################################
+
+## XS_Samples.txt has one "DSID  cross-section[pb]  k-factor  #comment" line per sample. ##
+## HistogramMiniTree weights MC by cross-section*k-factor, parsed the same way.          ##
+
+import os, sys
+import argparse
+
+def getDefaultXSFile():
+  """The XS_Samples.txt used by the event loop, or the one of this package if not installed"""
+  if os.getenv('ROOTCOREBIN'):
+    installedFile = os.path.join(os.getenv('ROOTCOREBIN'), 'data', 'ttHHistogrammer', 'XS_Samples.txt')
+    if os.path.exists(installedFile):
+      return installedFile
+  return os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'XS_Samples.txt')
+
+xsDatabases = {}
+
+def loadCrossSections( fileName=None ):
+  """Return {DSID: (crossSection, kFactor)} of fileName, parsing each file only once per process.
+  DSIDs are integers, so leading zeros do not matter, and a DSID given twice keeps its last entry"""
+  if fileName is None:
+    fileName = getDefaultXSFile()
+  fileName = os.path.abspath(fileName)
+  if fileName in xsDatabases:
+    return xsDatabases[fileName]
+
+  crossSections = {}
+  with open(fileName, 'r') as xsFile:
+    for iLine, line in enumerate(xsFile):
+      fields = line.split('#')[0].split()
+      if len(fields) == 0:
+        continue
+      if len(fields) < 3:
+        print "WARNING: Skipping line", iLine+1, "of", fileName, ":", line.strip()
+        continue
+      try:
+        crossSections[int(fields[0])] = (float(fields[1]), float(fields[2]))
+      except ValueError:
+        print "WARNING: Skipping line", iLine+1, "of", fileName, ":", line.strip()
+
+  xsDatabases[fileName] = crossSections
+  return crossSections
+
+def getXSWeight( dsid, fileName=None ):
+  """cross-section*k-factor of dsid, as applied by HistogramMiniTree, or None if unknown"""
+  crossSections = loadCrossSections( fileName )
+  if not int(dsid) in crossSections:
+    return None
+  crossSection, kFactor = crossSections[int(dsid)]
+  return crossSection*kFactor
+
+def parseOverrides( overrides, crossSections ):
+  """Apply "DSID,crossSection[,kFactor]" overrides to a copy of crossSections.
+  If the k-factor is not given, the one of crossSections is kept"""
+  newCrossSections = dict(crossSections)
+  for override in overrides:
+    fields = override.split(',')
+    if not len(fields) in [2, 3]:
+      raise ValueError( "Cross-section overrides must be DSID,crossSection[,kFactor], not "+override )
+    dsid = int(fields[0])
+    kFactor = float(fields[2]) if len(fields) == 3 else crossSections.get(dsid, (0., 1.))[1]
+    newCrossSections[dsid] = (float(fields[1]), kFactor)
+  return newCrossSections
+
+def main():
+  parser = argparse.ArgumentParser(description="Print the cross-section of DSIDs", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("dsids", nargs='+', type=int, help="DSIDs to print")
+  parser.add_argument("--xsFile", dest='xsFile', default=None, help="Cross-section file, by default the installed XS_Samples.txt")
+  args = parser.parse_args()
+
+  crossSections = loadCrossSections( args.xsFile )
+  for dsid in args.dsids:
+    if not dsid in crossSections:
+      print dsid, "not found"
+      continue
+    crossSection, kFactor = crossSections[dsid]
+    print dsid, crossSection, kFactor, crossSection*kFactor
+
+if __name__ == "__main__":
+  main()
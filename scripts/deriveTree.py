@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+
+##############################################################
+# deriveTree.py                                              #
+##############################################################
+# Derive new TTrees from input files, defining new branches  #
+# from expressions or constants, renaming or dropping        #
+# branches, and rewriting the sumWeights tree                #
+##############################################################
+# Jeff.Dandoy and Nedaa.Asbah                                #
+##############################################################
+
+## Uses RDataFrame, so the branches are read in blocks of baskets and the definitions are compiled,  ##
+## rather than looping over the entries in python.  A definition is name=expression or name/T=expr,  ##
+## where the expression is C++ of the input branches or a constant, and T is the leaf type (F, D, I, ##
+## L, i, l or O).  Without T a new branch is a float and a redefined branch keeps its type.          ##
+##                                                                                                   ##
+## Needs RDataFrame, in ROOT 6.14 or newer.  Existing branches are redefined under a temporary       ##
+## name and renamed in the output after writing, so later definitions always see the input value of  ##
+## a redefined branch, whatever the ROOT version.                                                    ##
+##                                                                                                   ##
+## The fake lepton tree of data, previously made by createFakeTree.py:                              ##
+##   deriveTree.py user.nasbah.data15_13TeV.00280862.physics_Main.Gradient_20160208_output.root     ##
+##     --outTreeName nominal --replaceName Main:Main_Fake data15:fake15                              ##
+##     --define weight_mc=fakesMM_weight_ejets_nominal weight_pileup=1 weight_leptonSF=1              ##
+##              weight_bTagSF_77=1                                                                   ##
+##     --metaSingleEntry --metaDefine dsid=999999 totalEventsWeighted=1 totalEvents=1               ##
+
+import os, sys
+import argparse
+
+##put argparse before ROOT call.  This allows for argparse help options to be printed properly (otherwise pyroot hijacks --help)
+parser = argparse.ArgumentParser(description="%prog [options]", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument("files", nargs='+',
+     help="Input root files")
+parser.add_argument("--treeName", dest='treeName', default="nominal_Loose",
+     help="Name of the input TTree")
+parser.add_argument("--outTreeName", dest='outTreeName', default=None,
+     help="Name of the output TTree.  By default the input name")
+parser.add_argument("--define", dest='define', nargs='+', default=[],
+     help="New or redefined branches as name=expression or name/T=expression")
+parser.add_argument("--rename", dest='rename', nargs='+', default=[],
+     help="Branches to rename, as old:new")
+parser.add_argument("--drop", dest='drop', nargs='+', default=[],
+     help="Branches not written to the output")
+parser.add_argument("--metaTreeName", dest='metaTreeName', default="sumWeights",
+     help="Name of the metadata TTree")
+parser.add_argument("--metaDefine", dest='metaDefine', nargs='+', default=[],
+     help="Redefined or new branches of the metadata tree, like --define")
+parser.add_argument("--metaSingleEntry", dest='metaSingleEntry', action='store_true', default=False,
+     help="Only keep the first entry of the metadata tree, i.e. to write one synthetic entry")
+parser.add_argument("--replaceName", dest='replaceName', nargs='+', default=[],
+     help="Output file names replace these old:new parts of the input names")
+parser.add_argument("--outDir", dest='outDir', default=None,
+     help="Directory of the outputs.  By default the directory of each input")
+parser.add_argument("--nthreads", dest='nthreads', default=1,
+     type=int, help="Threads of each derivation.  More than 1 does not keep the order of the entries")
+
+leafTypes = {'F': 'float', 'D': 'double', 'I': 'int', 'L': 'Long64_t', 'i': 'unsigned int', 'l': 'ULong64_t', 'O': 'bool'}
+
+def parseDefinitions( definitions ):
+  """[(name, leafType or None, expression)] of the name[/T]=expression arguments"""
+  parsed = []
+  for definition in definitions:
+    if not '=' in definition:
+      print "ERROR: definitions should be name=expression, not", definition
+      exit(1)
+    name, expression = definition.split('=', 1)
+    leafType = None
+    if '/' in name:
+      name, leafType = name.split('/', 1)
+      if not leafType in leafTypes:
+        print "ERROR: Unknown leaf type", leafType, "of", name+".  Use one of", " ".join(sorted(leafTypes))
+        exit(1)
+    parsed.append( (name.strip(), leafType, expression.strip()) )
+  return parsed
+
+def parsePairs( pairs, argName ):
+  parsed = []
+  for pair in pairs:
+    if not ':' in pair:
+      print "ERROR:", argName, "arguments should be old:new, not", pair
+      exit(1)
+    parsed.append( tuple(pair.split(':', 1)) )
+  return parsed
+
+def getOutputName( fileName, replaceName, outDir=None ):
+  baseName = os.path.basename(fileName)
+  for old, new in replaceName:
+    baseName = baseName.replace(old, new)
+  outName = os.path.join(outDir if outDir else os.path.dirname(fileName), baseName)
+  if os.path.abspath(outName) == os.path.abspath(fileName):
+    print "ERROR: Output would overwrite the input", fileName+".  Use --replaceName or --outDir"
+    exit(1)
+  return outName
+
+def applyDefinitions( frame, definitions ):
+  """Define or redefine the branches of frame.  Returns the new frame, and {temporary name: branch}
+  of the redefined branches, which are defined under a temporary name so that later definitions see
+  the input value, rather than with RDataFrame::Redefine"""
+  columns = set( str(column) for column in frame.GetColumnNames() )
+  redefined = {}
+  for name, leafType, expression in definitions:
+    if leafType:
+      cppType = leafTypes[leafType]
+    elif name in columns:
+      cppType = str(frame.GetColumnType(name))
+    else:
+      cppType = 'float'
+    expression = "static_cast<{0}>({1})".format(cppType, expression)
+    if name in columns:
+      tmpName = name+'_deriveTree'
+      while tmpName in columns:
+        tmpName += '_'
+      frame = frame.Define( tmpName, expression )
+      columns.add( tmpName )
+      redefined[tmpName] = name
+    else:
+      frame = frame.Define( name, expression )
+      columns.add( name )
+  return frame, redefined
+
+def getColumns( frame, dropped, redefined ):
+  """std::vector of the columns to write, without the dropped ones and the originals of redefined ones"""
+  import ROOT
+  dropped = set(dropped) | set(redefined.values())
+  columns = ROOT.std.vector('string')()
+  for column in frame.GetColumnNames():
+    if not str(column) in dropped:
+      columns.push_back( column )
+  return columns
+
+def renameBranches( outName, treeName, redefined ):
+  """Give the branches written under a temporary name the name of the branch they redefine"""
+  if len(redefined) == 0:
+    return
+  import ROOT
+  outFile = ROOT.TFile.Open( outName, "UPDATE" )
+  tree = outFile.Get( treeName )
+  for tmpName, name in redefined.items():
+    branch = tree.GetBranch( tmpName )
+    branch.SetTitle( branch.GetTitle().replace(tmpName, name, 1) )
+    branch.SetName( name )
+    leaf = branch.GetLeaf( tmpName )
+    leaf.SetTitle( leaf.GetTitle().replace(tmpName, name, 1) )
+    leaf.SetName( name )
+  tree.Write( "", ROOT.TObject.kOverwrite )
+  outFile.Close()
+
+def getSnapshotOptions( inFile, mode ):
+  import ROOT
+  options = ROOT.RDF.RSnapshotOptions()
+  options.fMode = mode
+  options.fCompressionAlgorithm = inFile.GetCompressionAlgorithm()
+  options.fCompressionLevel = inFile.GetCompressionLevel()
+  return options
+
+def deriveFile( fileName, args, definitions, renames, metaDefinitions, replaceName ):
+  import ROOT
+  inFile = ROOT.TFile.Open(fileName, "READ")
+  if not inFile or inFile.IsZombie():
+    print "ERROR: Could not open", fileName
+    return False
+  if not inFile.Get( args.treeName ):
+    print "ERROR: No TTree", args.treeName, "in", fileName
+    inFile.Close()
+    return False
+
+  outName = getOutputName( fileName, replaceName, args.outDir )
+  outTreeName = args.outTreeName if args.outTreeName else args.treeName
+
+  frame, redefined = applyDefinitions( ROOT.RDataFrame(args.treeName, fileName), definitions )
+  dropped = set(args.drop)
+  for old, new in renames:
+    frame = frame.Define( new, old )
+    dropped.add( old )
+  nEntries = frame.Count()
+  frame.Snapshot( outTreeName, outName, getColumns(frame, dropped, redefined), getSnapshotOptions(inFile, "RECREATE") )
+  renameBranches( outName, outTreeName, redefined )
+
+  if inFile.Get( args.metaTreeName ):
+    metaFrame = ROOT.RDataFrame(args.metaTreeName, fileName)
+    if args.metaSingleEntry:
+      metaFrame = metaFrame.Filter("rdfentry_ == 0") # Range() is not allowed with multiple threads
+    metaFrame, metaRedefined = applyDefinitions( metaFrame, metaDefinitions )
+    metaFrame.Snapshot( args.metaTreeName, outName, getColumns(metaFrame, [], metaRedefined), getSnapshotOptions(inFile, "UPDATE") )
+    renameBranches( outName, args.metaTreeName, metaRedefined )
+  else:
+    print "WARNING: No", args.metaTreeName, "tree in", fileName
+
+  print "Derived", nEntries.GetValue(), "entries of", os.path.basename(fileName), "into", outName
+  inFile.Close()
+  return True
+
+def main():
+  args = parser.parse_args()
+  definitions = parseDefinitions( args.define )
+  metaDefinitions = parseDefinitions( args.metaDefine )
+  renames = parsePairs( args.rename, "--rename" )
+  replaceName = parsePairs( args.replaceName, "--replaceName" )
+  if args.outDir and not os.path.exists(args.outDir):
+    os.makedirs(args.outDir)
+
+  import ROOT
+  ROOT.gROOT.SetBatch(True)
+  if args.nthreads > 1:
+    ROOT.EnableImplicitMT( args.nthreads )
+
+  nFailed = 0
+  for fileName in args.files:
+    if not deriveFile( fileName, args, definitions, renames, metaDefinitions, replaceName ):
+      nFailed += 1
+  if nFailed > 0:
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
+  print "Finished deriveTree.py"
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+##############################################################
+# mergeHistograms.py                                         #
+##############################################################
+# Merge HistogramMiniTree outputs into one file per sample   #
+# using a parallel pairwise (tree) reduction                 #
+##############################################################
+# Jeff.Dandoy and Nedaa.Asbah                                #
+##############################################################
+
+import os, sys, glob, subprocess, shutil, tempfile, multiprocessing
+import argparse
+parser = argparse.ArgumentParser(description="%prog [options]", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument("--inDir", dest='inDir', default="gridOutput/histOutput",
+     help="Directory containing the per-job histogram files")
+parser.add_argument("--outDir", dest='outDir', default="gridOutput/mergedOutput",
+     help="Directory for the merged per-sample histogram files")
+parser.add_argument("--inTag", dest='inputTag', default="",
+     help="Input tag for choosing files")
+parser.add_argument("--ncores", dest='ncores', default=4,
+     type=int, help="Number of parallel merges")
+parser.add_argument("--fanIn", dest='fanIn', default=2,
+     type=int, help="Number of files combined by each merge step")
+
+
+############## Group files by sample #############################
+def getSampleKey( fileName ):
+  ## Files are named like hists_user.nasbah.mc15_13TeV.410000.ttbar_hdamp172p5_nonallhad.Gradient_20160121_output.3_NewStudy.root
+  ## The first five fields identify the sample (DSID or run number, and its physics name) ##
+  baseName = os.path.basename(fileName)
+  if baseName.endswith('.root'):
+    baseName = baseName[:-5]
+  fields = baseName.split('.')
+  if len(fields) < 5:
+    return baseName
+  return '.'.join(fields[:5])
+
+def groupBySample( fileNames ):
+  samples = {}
+  for fileName in sorted(fileNames):
+    samples.setdefault( getSampleKey(fileName), [] ).append( fileName )
+  return samples
+
+############## Merge ##############################################
+def mergeStep( step ):
+  inputs, output = step
+  devnull = open(os.devnull, 'w')
+  result = subprocess.call(['hadd', '-f', output] + inputs, stdout=devnull, stderr=subprocess.STDOUT)
+  devnull.close()
+  return result
+
+def mergeSamples( fileNames, outDir, ncores=4, fanIn=2 ):
+  """Merge fileNames into one outDir/<sample>.root per sample, returning the merged file names.
+  Each round merges groups of fanIn files for all samples at once over a process pool,
+  until a single file is left for every sample."""
+  if not os.path.exists(outDir):
+    os.makedirs(outDir)
+  fanIn = max(2, fanIn)
+  tmpDir = tempfile.mkdtemp(prefix='merge_', dir=outDir)
+
+  samples = groupBySample( fileNames )
+  levels = dict( (key, list(files)) for key, files in samples.items() )
+  temporaries = set()
+  pool = multiprocessing.Pool( max(1, ncores) )
+  nStep = 0
+  try:
+    while any( len(files) > 1 for files in levels.values() ):
+      steps, stepKeys = [], []
+      for key, files in sorted(levels.items()):
+        if len(files) <= 1:
+          continue
+        nextLevel = []
+        for iFile in range(0, len(files), fanIn):
+          theseFiles = files[iFile:iFile+fanIn]
+          if len(theseFiles) == 1:  # odd file out goes straight to the next round
+            nextLevel.append( theseFiles[0] )
+            continue
+          output = os.path.join(tmpDir, 'step'+str(nStep)+'.root')
+          nStep += 1
+          steps.append( (theseFiles, output) )
+          stepKeys.append( key )
+          nextLevel.append( output )
+        levels[key] = nextLevel
+
+      results = pool.map( mergeStep, steps )
+      for iStep, result in enumerate(results):
+        if result != 0:
+          raise RuntimeError("hadd failed while merging sample "+stepKeys[iStep]+": "+' '.join(steps[iStep][0]))
+        ## Intermediate files are no longer needed once merged ##
+        for inputFile in steps[iStep][0]:
+          if inputFile in temporaries:
+            os.remove( inputFile )
+            temporaries.discard( inputFile )
+        temporaries.add( steps[iStep][1] )
+
+    mergedFiles = []
+    for key, files in sorted(levels.items()):
+      outputFile = os.path.join(outDir, key+'.root')
+      if files[0] in temporaries:
+        shutil.move( files[0], outputFile )
+      else:
+        shutil.copy( files[0], outputFile )
+      mergedFiles.append( outputFile )
+  finally:
+    pool.close()
+    pool.join()
+    ## Also drop the partial step files of a failed merge ##
+    shutil.rmtree( tmpDir, ignore_errors=True )
+
+  return mergedFiles
+
+def main():
+  args = parser.parse_args()
+  fileNames = glob.glob(args.inDir.rstrip('/')+'/*'+args.inputTag+'*.root')
+  if len(fileNames) == 0:
+    print "ERROR: No histogram files found in", args.inDir
+    exit(1)
+
+  print "Merging", len(fileNames), "files into", len(groupBySample(fileNames)), "samples"
+  mergedFiles = mergeSamples( fileNames, args.outDir, args.ncores, args.fanIn )
+  for mergedFile in mergedFiles:
+    print "  ", mergedFile
+
+if __name__ == "__main__":
+  main()
+  print "Finished mergeHistograms()"
@@ -0,0 +1,66 @@
+##############################################################
+# histArrays.py                                              #
+##############################################################
+# Bulk NumPy access to the bins of 1D ROOT histograms, used  #
+# for vectorized ratios, sums and normalizations             #
+##############################################################
+# Jeff.Dandoy and Nedaa.Asbah                                #
+##############################################################
+
+import numpy
+
+def getArrays( hist ):
+  """Return copies of the bin contents and sum of squared weights of a TH1, including under/overflow bins"""
+  nCells = hist.GetNbinsX()+2
+  dtype = numpy.float64 if hist.InheritsFrom("TArrayD") else numpy.float32
+  buf = hist.GetArray()
+  if hasattr(buf, 'SetSize'):
+    buf.SetSize(nCells)
+  contents = numpy.frombuffer(buf, dtype=dtype, count=nCells).astype(numpy.float64)
+
+  if hist.GetSumw2N() > 0:
+    sumw2Buf = hist.GetSumw2().GetArray()
+    if hasattr(sumw2Buf, 'SetSize'):
+      sumw2Buf.SetSize(nCells)
+    sumw2 = numpy.frombuffer(sumw2Buf, dtype=numpy.float64, count=nCells).copy()
+  else:
+    sumw2 = numpy.abs(contents)
+  return contents, sumw2
+
+def setArrays( hist, contents, sumw2 ):
+  """Write bin contents and sum of squared weights, including under/overflow bins, back to a TH1"""
+  contents = numpy.ascontiguousarray(contents, dtype=numpy.float64)
+  hist.SetContent( contents )
+  if hist.GetSumw2N() == 0:
+    hist.Sumw2()
+  hist.GetSumw2().Set( len(sumw2), numpy.ascontiguousarray(sumw2, dtype=numpy.float64) )
+
+def integral( contents ):
+  """Same as TH1::Integral(), the sum of all bins excluding under/overflow"""
+  return contents[1:-1].sum()
+
+def sumArrays( hists ):
+  """Bin-wise sum of a list of histograms, i.e. the members of a THStack"""
+  totalContents, totalSumw2 = getArrays( hists[0] )
+  for hist in hists[1:]:
+    contents, sumw2 = getArrays( hist )
+    totalContents += contents
+    totalSumw2 += sumw2
+  return totalContents, totalSumw2
+
+def relativeDifference( refContents, refSumw2, contents, sumw2 ):
+  """(ref - hist) / hist with the error propagation of TH1::Add and TH1::Divide.
+  Bins where hist is empty are set to 0, as TH1::Divide does"""
+  diff = refContents - contents
+  diffSumw2 = refSumw2 + sumw2
+  nonZero = contents != 0
+  safeContents = numpy.where(nonZero, contents, 1.)
+  ratio = numpy.where(nonZero, diff/safeContents, 0.)
+  ratioSumw2 = numpy.where(nonZero, (diffSumw2*safeContents**2 + sumw2*diff**2)/safeContents**4, 0.)
+  return ratio, ratioSumw2
+
+def getTotalArrays( hist ):
+  """Arrays of a TH1, or of the sum of all members for a THStack"""
+  if hist.InheritsFrom("THStack"):
+    return sumArrays( list(hist.GetHists()) )
+  return getArrays( hist )
@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+
+##############################################################
+# histBundle.py                                              #
+##############################################################
+# Export HistogramMiniTree outputs to compact bundles of    #
+# bin arrays, and read them back without ROOT                #
+##############################################################
+# Jeff.Dandoy and Nedaa.Asbah                                #
+##############################################################
+
+## A bundle holds, for every 1D histogram of the input files, its bin edges, contents and sumw2 ##
+## (including under/overflow) concatenated into three flat float64 arrays, plus a json header  ##
+## with the name, title, entries and offsets of each histogram, and the source files.         ##
+##                                                                                             ##
+## The file is the magic bundleMagic, the header length as a little endian uint64, the header  ##
+## padded to 8 bytes, then the raw little endian edges, contents and sumw2 arrays at the       ##
+## offsets of header['arrays'].  Readers memory-map the arrays, so only the pages of the       ##
+## histograms actually read are loaded from disk.                                              ##
+
+import os, sys, re, json, struct
+import argparse
+import numpy
+
+bundleVersion = 2
+bundleMagic = b'HISTBNDL'
+bundleExtension = '.hbundle'
+arrayNames = ['edges', 'contents', 'sumw2']
+
+################# Reading ###########################################
+class BundleHist(object):
+  """One 1D histogram of a bundle, as numpy arrays including under/overflow bins"""
+  def __init__( self, name, edges, contents, sumw2, title='', xTitle='', yTitle='', entries=0. ):
+    self.name = name
+    self.edges = edges
+    self.contents = contents
+    self.sumw2 = sumw2
+    self.title = title
+    self.xTitle = xTitle
+    self.yTitle = yTitle
+    self.entries = entries
+
+  def integral( self ):
+    """Same as TH1::Integral(), excluding under/overflow"""
+    return self.contents[1:-1].sum()
+
+  def integralError( self ):
+    return numpy.sqrt( self.sumw2[1:-1].sum() )
+
+  def scaled( self, factor ):
+    """A copy with contents scaled by factor, or self if factor is 1"""
+    if factor == 1.:
+      return self
+    return BundleHist( self.name, self.edges, self.contents*factor, self.sumw2*factor*factor,
+        self.title, self.xTitle, self.yTitle, self.entries )
+
+  def toROOT( self, newName=None ):
+    """Convert to a TH1D, only importing ROOT when called"""
+    import ROOT
+    import histArrays
+    if newName is None:
+      newName = self.name.split('/')[-1]
+    hist = ROOT.TH1D( newName, self.title, len(self.edges)-1, numpy.ascontiguousarray(self.edges) )
+    hist.SetDirectory( 0 )
+    hist.Sumw2()
+    histArrays.setArrays( hist, self.contents, self.sumw2 )
+    hist.SetEntries( self.entries )
+    hist.GetXaxis().SetTitle( self.xTitle )
+    hist.GetYaxis().SetTitle( self.yTitle )
+    return hist
+
+class HistBundle(object):
+  """Lazy reader of a bundle.  Only the header is read on opening, and the bin arrays are memory-mapped
+  on first access, so each histogram only reads its own bins"""
+  def __init__( self, fileName ):
+    self.fileName = fileName
+    with open( fileName, 'rb' ) as inFile:
+      magic = inFile.read( len(bundleMagic) )
+      if magic != bundleMagic:
+        raise ValueError( fileName+" is not a histogram bundle" )
+      headerSize = struct.unpack( '<Q', inFile.read(8) )[0]
+      self.header = json.loads( inFile.read(headerSize).decode('utf-8') )
+    if self.header['version'] != bundleVersion:
+      raise ValueError( "Unsupported histogram bundle version "+str(self.header['version'])+" in "+fileName )
+    self.dataOffset = len(bundleMagic)+8+headerSize
+    self.index = dict( (info['name'], info) for info in self.header['hists'] )
+    self.data = None
+
+  def getArray( self, arrayName ):
+    """View of a flat array of the memory-mapped data, without reading it"""
+    offset, size = self.header['arrays'][arrayName]
+    if size == 0:
+      return numpy.zeros(0)
+    if self.data is None:
+      self.data = numpy.memmap( self.fileName, dtype='<f8', mode='r', offset=self.dataOffset )
+    return self.data[ offset : offset+size ]
+
+  def getDirs( self ):
+    dirs = []
+    for info in self.header['hists']:
+      if '/' in info['name']:
+        dirName = info['name'].rsplit('/', 1)[0]
+        if not dirName in dirs:
+          dirs.append( dirName )
+    return dirs
+
+  def getHistNames( self, plotDir='' ):
+    """Names of the histograms directly in plotDir, as plotDir/histName like in plotHistograms"""
+    histNames = []
+    for info in self.header['hists']:
+      dirName, baseName = info['name'].rsplit('/', 1) if '/' in info['name'] else ('', info['name'])
+      if dirName == plotDir:
+        histNames.append( plotDir+'/'+baseName )
+    return histNames
+
+  def get( self, histName ):
+    info = self.index[ histName.lstrip('/') ]
+    nBins = info['nBins']
+    edges = self.getArray('edges')[ info['edgeOffset'] : info['edgeOffset']+nBins+1 ]
+    contents = self.getArray('contents')[ info['cellOffset'] : info['cellOffset']+nBins+2 ]
+    sumw2 = self.getArray('sumw2')[ info['cellOffset'] : info['cellOffset']+nBins+2 ]
+    return BundleHist( info['name'], edges, contents, sumw2, info['title'], info['xTitle'], info['yTitle'], info['entries'] )
+
+def sumHists( hists ):
+  """Bin-wise sum of BundleHists with identical binning"""
+  total = BundleHist( hists[0].name, hists[0].edges, hists[0].contents.copy(), hists[0].sumw2.copy(),
+      hists[0].title, hists[0].xTitle, hists[0].yTitle, hists[0].entries )
+  for hist in hists[1:]:
+    if not numpy.array_equal( hist.edges, total.edges ):
+      raise ValueError( "Cannot add histograms with different binning: "+hist.name )
+    total.contents += hist.contents
+    total.sumw2 += hist.sumw2
+    total.entries += hist.entries
+  return total
+
+################# Writing ###########################################
+def readRootHists( fileName ):
+  """Read every 1D histogram of a ROOT file, recursing into its TDirectories, as [BundleHist]"""
+  import ROOT
+  import histArrays
+  inFile = ROOT.TFile.Open( fileName, "READ" )
+  if not inFile or inFile.IsZombie():
+    raise IOError( "Could not open "+fileName )
+
+  hists = []
+  directories = [ (inFile, '') ]
+  while len(directories) > 0:
+    directory, path = directories.pop(0)
+    for key in directory.GetListOfKeys():
+      keyClass = ROOT.TClass.GetClass( key.GetClassName() )
+      if keyClass.InheritsFrom('TDirectory'):
+        directories.append( (key.ReadObj(), path+key.GetName()+'/') )
+      elif keyClass.InheritsFrom('TH1') and not keyClass.InheritsFrom('TH2') and not keyClass.InheritsFrom('TH3'):
+        hist = key.ReadObj()
+        axis = hist.GetXaxis()
+        if axis.GetXbins().GetSize() > 0:
+          edges = numpy.array( [axis.GetBinLowEdge(iBin) for iBin in range(1, hist.GetNbinsX()+2)] )
+        else:
+          edges = numpy.linspace( axis.GetXmin(), axis.GetXmax(), hist.GetNbinsX()+1 )
+        contents, sumw2 = histArrays.getArrays( hist )
+        hists.append( BundleHist( path+key.GetName(), edges, contents, sumw2, hist.GetTitle(),
+            axis.GetTitle(), hist.GetYaxis().GetTitle(), hist.GetEntries() ) )
+  inFile.Close()
+  return hists
+
+def writeBundle( outName, hists, sources ):
+  """Write [BundleHist] to outName, replacing it atomically"""
+  header = {'version': bundleVersion, 'sources': sources, 'hists': []}
+  edgeOffset, cellOffset = 0, 0
+  for hist in hists:
+    nBins = len(hist.edges)-1
+    header['hists'].append( {'name': hist.name, 'title': hist.title, 'xTitle': hist.xTitle, 'yTitle': hist.yTitle,
+        'entries': hist.entries, 'nBins': nBins, 'edgeOffset': edgeOffset, 'cellOffset': cellOffset} )
+    edgeOffset += nBins+1
+    cellOffset += nBins+2
+
+  arrays = []
+  header['arrays'], offset = {}, 0
+  for arrayName in arrayNames:
+    array = numpy.concatenate( [getattr(hist, arrayName) for hist in hists] ) if hists else numpy.zeros(0)
+    arrays.append( numpy.ascontiguousarray(array, dtype='<f8') )
+    header['arrays'][arrayName] = [offset, len(array)]
+    offset += len(array)
+
+  headerBytes = json.dumps(header).encode('utf-8')
+  headerBytes += b' '*( -(len(bundleMagic)+8+len(headerBytes)) % 8 ) # the arrays start 8 byte aligned
+  with open(outName+'.tmp', 'wb') as outFile:
+    outFile.write( bundleMagic )
+    outFile.write( struct.pack('<Q', len(headerBytes)) )
+    outFile.write( headerBytes )
+    for array in arrays:
+      outFile.write( array.tobytes() )
+  os.rename( outName+'.tmp', outName )
+
+def exportFiles( fileNames, outName ):
+  """Sum the histograms of the ROOT files fileNames into the bundle outName"""
+  histNames, sampleHists = [], {}
+  for fileName in fileNames:
+    for hist in readRootHists( fileName ):
+      if hist.name in sampleHists:
+        sampleHists[hist.name] = sumHists( [sampleHists[hist.name], hist] )
+      else:
+        histNames.append( hist.name )
+        sampleHists[hist.name] = hist
+  sources = [ [os.path.basename(fileName), os.path.getmtime(fileName), os.path.getsize(fileName)] for fileName in fileNames ]
+  writeBundle( outName, [sampleHists[histName] for histName in histNames], sources )
+  return len(histNames)
+
+def getBundleName( fileName, outDir ):
+  baseName = os.path.basename(fileName)
+  if baseName.endswith('.root'):
+    baseName = baseName[:-5]
+  return os.path.join( outDir, baseName+bundleExtension )
+
+################# Command line ######################################
+parser = argparse.ArgumentParser(description="Export ROOT histogram files to .hbundle bundles, or print the yields of bundles without ROOT",
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument("inputs", nargs='+', help="ROOT files to export, or bundles with --yields")
+parser.add_argument("--outDir", dest='outDir', default="gridOutput/bundles", help="Directory for one bundle per input file")
+parser.add_argument("--output", dest='output', default=None, help="Sum all input files into this single bundle instead, i.e. for a merged sample")
+parser.add_argument("--yields", dest='yields', action='store_true', default=False, help="Print the summed yield of every histogram of the input bundles")
+parser.add_argument("--hists", dest='hists', default=None, help="Regular expression selecting the histograms printed with --yields")
+
+def printYields( fileNames, histExpr ):
+  bundles = [HistBundle(fileName) for fileName in fileNames]
+  histNames = [info['name'] for info in bundles[0].header['hists']]
+  if histExpr:
+    histNames = [histName for histName in histNames if re.search(histExpr, histName)]
+  for histName in histNames:
+    missing = [bundle.fileName for bundle in bundles if not histName in bundle.index]
+    if len(missing) > 0:
+      print "WARNING:", histName, "is missing from", ', '.join(missing)
+      continue
+    total = sumHists( [bundle.get(histName) for bundle in bundles] )
+    print '{0:60s} {1:14.3f} +- {2:.3f}'.format( histName, total.integral(), total.integralError() )
+
+def main():
+  args = parser.parse_args()
+  if args.yields:
+    printYields( args.inputs, args.hists )
+    return
+
+  if args.output:
+    if os.path.dirname(args.output) and not os.path.exists( os.path.dirname(args.output) ):
+      os.makedirs( os.path.dirname(args.output) )
+    nHists = exportFiles( args.inputs, args.output )
+    print "Wrote", nHists, "histograms of", len(args.inputs), "files to", args.output
+  else:
+    if not os.path.exists(args.outDir):
+      os.makedirs(args.outDir)
+    for fileName in args.inputs:
+      outName = getBundleName( fileName, args.outDir )
+      nHists = exportFiles( [fileName], outName )
+      print "Wrote", nHists, "histograms to", outName
+
+if __name__ == "__main__":
+  main()
@@ -10,10 +10,13 @@
 ##############################################################
 
 
-import os, sys, glob, copy, subprocess
+import os, sys, re, glob, fnmatch, copy, subprocess, json, hashlib, multiprocessing
 import time
 import argparse
 import AtlasStyle
+import histArrays, histBundle, sampleCatalog
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import crossSections
 from collections import defaultdict
 from math import sqrt, log, isnan, isinf, fabs, exp
 import ROOT
@@ -24,7 +27,7 @@ import ROOT
 parser = argparse.ArgumentParser(description="%prog [options]", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 parser.add_argument("-b", dest='b', action='store_true', default=False, help="Batch mode for PyRoot")
 parser.add_argument("-v", dest='v', action='store_true', default=False, help="Verbose mode for debugging")
-parser.add_argument("--plotDir", dest='plotDir', default="sel_mu_4j_2b", help="TDirectory to search for plots in ROOT file.  By default no directory")
+parser.add_argument("--plotDir", dest='plotDir', default="sel_mu_4j_2b", help="TDirectory to search for plots in ROOT file.  By default no directory.  Several may be given seperated by a comma, and may be glob patterns, i.e. 'sel_mu_*,sel_el_4j'")
 
 
 parser.add_argument("--plotPartial", dest='plotPartial', action='store_true', default=False, help="Plot all histograms, even if some sample types do not contain the histogram (i.e. truth for data)")
@@ -68,7 +71,13 @@ parser.add_argument('--ratioRange2DMax', dest='ratioRange2DMax', default=1.1999,
 parser.add_argument('--ratioRange2DMin', dest='ratioRange2DMin', default=0.8, help='Min value of ratio plot range.  If this and ratioRange2DMax is 0, it uses ROOT defaults')
 parser.add_argument("--lumi", dest='lumi', type=float, default=0, help="Scale by Luminosity, in /fb")
 
-parser.add_argument("--writeMerged", dest='writeMerged', action='store_true', default=False)
+parser.add_argument("--ncores", dest='ncores', type=int, default=1, help="Number of parallel processes formatting, scaling and drawing the histograms")
+parser.add_argument("--bundles", dest='bundles', action='store_true', default=False, help="Read .hbundle histogram bundles written by histBundle.py instead of ROOT files")
+parser.add_argument("--xsFile", dest='xsFile', default=None, help="Reweight MC to the cross-sections of this file, instead of the XS_Samples.txt used when histogramming")
+parser.add_argument('--xsOverride', dest='xsOverride', nargs='+', help='Reweight MC DSIDs to a new cross-section and optionally k-factor, i.e. "410000,400.5 410501,380.1,1.1"')
+parser.add_argument("--writeMerged", dest='writeMerged', action='store_true', default=False, help="Cache the merged histograms of each sample in a mergedCache/ directory next to its files, and reuse them until any contributing file changes")
+parser.add_argument('--includeHists', dest='includeHists', nargs='+', help='Only read and plot histograms whose name matches any of these regular expressions, i.e. "^h_jet_pt_all$ ClassifBDTOutput"')
+parser.add_argument('--excludeHists', dest='excludeHists', nargs='+', help='Do not read or plot histograms whose name matches any of these regular expressions')
 parser.add_argument('--extraText', dest='extraText', nargs='+', help='add an extra line of text to the canvas, i.e. "NumTrkPt500PV,p_{T}^{trk}>500MeV"')
 
 
@@ -84,6 +93,18 @@ if not os.path.exists(args.outDir):
 
 AtlasStyle.SetAtlasStyle()
 
+## Histogram name filters, applied before any histogram is read ##
+includeHists = [re.compile(expr) for expr in args.includeHists] if args.includeHists else []
+excludeHists = [re.compile(expr) for expr in args.excludeHists] if args.excludeHists else []
+
+## Cross-sections used when histogramming, and the ones to reweight MC to ##
+nominalXS, targetXS = None, None
+if args.xsFile or args.xsOverride:
+  nominalXS = crossSections.loadCrossSections()
+  targetXS = crossSections.loadCrossSections( args.xsFile ) if args.xsFile else nominalXS
+  if args.xsOverride:
+    targetXS = crossSections.parseOverrides( args.xsOverride, targetXS )
+
 
 #### TODO Rebinning and reranging stuff####
 ## Rebinning and ranges, make global for now
@@ -137,7 +158,7 @@ def getPlotList():
   if not args.signalDir:  args.signalDir = args.inDir
 
   ########## Get all fileNames to use ##########
-  SampleNames, SampleTypes, SampleFiles = [], [], []
+  SampleNames, SampleTypes, SampleFiles, SampleDefs = [], [], [], []
   ## Get All Background Files ##
   if len(args.bkgType) > 0:
     args.bkgType = args.bkgType.split(',')
@@ -149,6 +170,7 @@ def getPlotList():
         thisBkgName = thisBkgType
       SampleNames.append( thisBkgName )
       SampleTypes.append( "bkg" )
+      SampleDefs.append( (args.bkgDir, thisBkgType) )
       SampleFiles.append( getFileNames( args.bkgDir, thisBkgType.split('+') ) )
 
   ## Get All Signal Files ##
@@ -162,6 +184,7 @@ def getPlotList():
         thisSigName = thisSigType
       SampleNames.append( thisSigName)
       SampleTypes.append( "signal" )
+      SampleDefs.append( (args.signalDir, thisSigType) )
       SampleFiles.append( getFileNames( args.signalDir, thisSigType.split('+') ) )
 
   #TODO#### Keep Data Last!! ####
@@ -176,49 +199,60 @@ def getPlotList():
         thisDataName = thisDataType
       SampleNames.append( thisDataName )
       SampleTypes.append( "data" )
+      SampleDefs.append( (args.dataDir, thisDataType) )
       SampleFiles.append( getFileNames( args.dataDir, thisDataType.split('+') ) )
 
-  ##### Get histogram list from first file #####
-  HistNames = getHistNames( SampleFiles )
-
-  ##### Get all histograms #####
-  Hists = []
-  for iS, fileList in enumerate(SampleFiles):
-    Hists.append( getHists(SampleNames[iS], fileList, HistNames) )
+  ##### Get all histograms of every plotDir, opening each file once #####
+  args.plotDirs = getPlotDirs( SampleFiles[0][0] )
+  PlotDirHists = getHists( SampleNames, SampleFiles, SampleDefs, args.plotDirs )
 
   ## TODO ## Properly create stacked histograms
 
-  return SampleNames, SampleTypes, HistNames, Hists
+  return SampleNames, SampleTypes, PlotDirHists
+
+############## Get TDirectories to plot #############################
+def getPlotDirs( fileName ):
+  """Expand the comma seperated --plotDir list, matching any glob patterns against the TDirectories of fileName"""
+  patterns = args.plotDir.split(',')
+  if not any( glob.has_magic(pattern) for pattern in patterns ):
+    return patterns
+
+  if args.bundles:
+    fileDirs = histBundle.HistBundle(fileName).getDirs()
+  else:
+    inFile = ROOT.TFile.Open(fileName, "READ")
+    fileDirs = [key.GetName() for key in inFile.GetListOfKeys() if key.GetClassName().startswith('TDirectory')]
+    inFile.Close()
+
+  plotDirs = []
+  for pattern in patterns:
+    if not glob.has_magic(pattern):
+      plotDirs.append( pattern )
+      continue
+    matchedDirs = fnmatch.filter( fileDirs, pattern )
+    if len(matchedDirs) == 0:
+      print "ERROR: No TDirectory matching", pattern, "in", fileName
+      exit(1)
+    plotDirs += [plotDir for plotDir in matchedDirs if not plotDir in plotDirs]
+
+  if args.v: print "Plotting directories", plotDirs
+  return plotDirs
 
 
 
 ############## Get File List #############################
+## One catalog per histogram directory, so it is only scanned once ##
+sampleCatalogs = {}
+
 def getFileNames( histDir, histFileTags ):
 
-###
-  thisHistDir = histDir
-  thisHistFileTags = histFileTags
-  thisHistFileTags.append(".root") #must be root files
-  thisHistDir += '/'
+  extension = ".hbundle" if args.bundles else ".root" #must be root files, or bundles
+  if not (histDir, extension) in sampleCatalogs:
+    sampleCatalogs[(histDir, extension)] = sampleCatalog.SampleCatalog( histDir, extension )
 
   ## Get List of Files that match the tag ##
-  histFileNames = []
-  for f in os.listdir(histDir):
-    if not os.path.isfile( os.path.join(histDir,f) ): continue
-
-    passed = True
-    for tag in histFileTags:
-      if '=' in tag:
-        if not any(splitTag in f for splitTag in list(tag.split('='))):
-          passed = False
-      else:
-        if not tag in f:
-          passed = False
-
-    if passed:
-      histFileNames.append( os.path.join(histDir,f) )
+  histFileNames = sampleCatalogs[(histDir, extension)].resolve( histFileTags )
 
-  histFileNames.sort()
   if len(histFileNames)<1:
     print "ERROR:  There are no histogram files of requested type", histFileTags
     exit(1)
@@ -227,68 +261,267 @@ def getFileNames( histDir, histFileTags ):
 
   return histFileNames
 
-################# Get Histogram List ################################
-def getHistNames( inFileNames ):
+############## Cross-section reweighting ##########################
+def getXSScale( fileName ):
+  """Factor reweighting the MC histograms of fileName from the nominal to the target cross-section"""
+  if targetXS is None:
+    return 1.
+  dsid = sampleCatalog.parseFileName( fileName )['dsid']
+  if dsid is None or targetXS.get(dsid) == nominalXS.get(dsid):
+    return 1.
+  if not dsid in nominalXS or not dsid in targetXS:
+    print "WARNING: No cross-section to reweight DSID", dsid, "of", fileName
+    return 1.
+  nominalWeight = nominalXS[dsid][0]*nominalXS[dsid][1]
+  if nominalWeight == 0.:
+    return 1.
+  return targetXS[dsid][0]*targetXS[dsid][1] / nominalWeight
+
+################# Histogram key index ################################
+## Histogram names of each file are cached in a .histKeyIndex.json in its directory, keyed by the file mtime ##
+keyIndexName = '.histKeyIndex.json'
+keyIndexes = {}  # directory -> {fileName: {'mtime':, 'keys': {plotDir: [histNames]}}}
+
+def getKeyIndex( fileName ):
+  histDir = os.path.dirname( os.path.abspath(fileName) )
+  if not histDir in keyIndexes:
+    keyIndexes[histDir] = {'modified': False, 'files': {}}
+    indexFileName = os.path.join(histDir, keyIndexName)
+    if os.path.exists( indexFileName ):
+      try:
+        with open(indexFileName, 'r') as indexFile:
+          keyIndexes[histDir]['files'] = json.load(indexFile)
+      except ValueError:
+        print "WARNING: Ignoring unreadable key index", indexFileName
+  return keyIndexes[histDir]
+
+def getIndexedKeys( fileName, plotDir ):
+  """Return the cached histogram names of plotDir in fileName, or None if not indexed or the file changed"""
+  fileEntry = getKeyIndex( fileName )['files'].get( os.path.basename(fileName) )
+  if not fileEntry or fileEntry['mtime'] != os.path.getmtime(fileName):
+    return None
+  return fileEntry['keys'].get( plotDir )
+
+def setIndexedKeys( fileName, plotDir, histNames ):
+  keyIndex = getKeyIndex( fileName )
+  mtime = os.path.getmtime(fileName)
+  fileEntry = keyIndex['files'].get( os.path.basename(fileName) )
+  if not fileEntry or fileEntry['mtime'] != mtime:
+    fileEntry = {'mtime': mtime, 'keys': {}}
+    keyIndex['files'][os.path.basename(fileName)] = fileEntry
+  fileEntry['keys'][plotDir] = histNames
+  keyIndex['modified'] = True
+
+def saveKeyIndexes():
+  for histDir, keyIndex in keyIndexes.items():
+    if not keyIndex['modified']:
+      continue
+    indexFileName = os.path.join(histDir, keyIndexName)
+    try:
+      with open(indexFileName+'.tmp', 'w') as indexFile:
+        json.dump(keyIndex['files'], indexFile)
+      os.rename(indexFileName+'.tmp', indexFileName)
+      keyIndex['modified'] = False
+    except (IOError, OSError):
+      if args.v: print "Could not write key index", indexFileName
+
+def getFileHistNames( inFile, fileName, plotDir ):
+  """Get the histogram names of plotDir in an open file, from the key index if it is up to date"""
 #TODO need to check that they're actually histograms!!
+  histNames = getIndexedKeys( fileName, plotDir )
+  if histNames is not None:
+    return histNames
+
+  if len(plotDir) > 0:
+    thisPlotDir = inFile.Get(plotDir)
+    if not thisPlotDir:
+      print "ERROR, Couldn't find TDirectory", plotDir, "in", fileName
+      exit(1)
+  else:
+    thisPlotDir = inFile
+  histNames = [plotDir+'/'+key.GetName() for key in thisPlotDir.GetListOfKeys()]
+  setIndexedKeys( fileName, plotDir, histNames )
+  return histNames
 
-  ## Get names of all histograms in all files ##
-  ## Histogram list will be all those common to all files ##
-
-  allFileNames = sum( inFileNames, [])
-  allHistNames = []
-  for inFileName in allFileNames:
-    allHistNames.append([])
-    inFile = ROOT.TFile(inFileName, 'READ')
-    if len(args.plotDir) > 0:
-      plotDir = inFile.Get(args.plotDir)
-      if not plotDir:
-        print "ERROR, Couldn't find TDirectory", args.plotDir, "in", inFileName
-        exit(1)
+def selectHistNames( histNames ):
+  """Apply --includeHists and --excludeHists to the histogram names, matched without their TDirectory"""
+  if not includeHists and not excludeHists:
+    return histNames
+  selectedNames = []
+  for histName in histNames:
+    baseName = histName.split('/')[-1]
+    if includeHists and not any( expr.search(baseName) for expr in includeHists ):
+      continue
+    if any( expr.search(baseName) for expr in excludeHists ):
+      continue
+    selectedNames.append( histName )
+  return selectedNames
+
+def getCommonHistNames( allHistNames ):
+  ## Hist Names must be common to all files, keeping the order of the first file ##
+  commonHistNames = set(allHistNames[0]).intersection( *allHistNames[1:] )
+  return [histName for histName in allHistNames[0] if histName in commonHistNames]
+
+################# Merged sample cache ##############################
+## The summed histograms of a sample are cached in <histDir>/mergedCache/, together with ##
+## a .json recording the contributing files, so they are reused until any of them change ##
+def getMergedCacheName( sampleDef, plotDir ):
+  histDir, sampleExpr = sampleDef
+  cacheKey = hashlib.sha1( json.dumps([os.path.abspath(histDir), sampleExpr, plotDir]) ).hexdigest()[:16]
+  return os.path.join(histDir, 'mergedCache', 'merged_'+cacheKey)
+
+def getFileStamps( fileList ):
+  return [ [os.path.basename(fileName), os.path.getmtime(fileName), os.path.getsize(fileName)] for fileName in fileList ]
+
+def loadMergedSample( sampleDef, plotDir, fileList ):
+  """Return the metadata of the cached merged sample, or None if it is missing or out of date"""
+  cacheName = getMergedCacheName( sampleDef, plotDir )
+  if not os.path.exists(cacheName+'.json') or not os.path.exists(cacheName+'.root'):
+    return None
+  try:
+    with open(cacheName+'.json', 'r') as cacheFile:
+      mergedSample = json.load(cacheFile)
+  except ValueError:
+    return None
+  if mergedSample['files'] != getFileStamps(fileList) or mergedSample.get('xsScales') != [getXSScale(fileName) for fileName in fileList]:
+    return None
+  mergedSample['fileName'] = cacheName+'.root'
+  return mergedSample
+
+def writeMergedSample( sampleDef, plotDir, fileList, sampleHists, histNames ):
+  cacheName = getMergedCacheName( sampleDef, plotDir )
+  if not os.path.exists( os.path.dirname(cacheName) ):
+    os.makedirs( os.path.dirname(cacheName) )
+
+  outFile = ROOT.TFile.Open(cacheName+'.root', "RECREATE")
+  for histName in histNames:
+    dirName, baseName = histName.rsplit('/', 1) if '/' in histName else ('', histName)
+    outDir = outFile
+    if len(dirName) > 0:
+      outDir = outFile.GetDirectory(dirName) or outFile.mkdir(dirName)
+    outDir.cd()
+    sampleHists[histName].Clone( baseName ).Write()
+  outFile.Close()
+
+  ## The .json is written last, so an interrupted write is never picked up ##
+  with open(cacheName+'.json', 'w') as cacheFile:
+    json.dump({'sample': sampleDef, 'plotDir': plotDir, 'files': getFileStamps(fileList),
+        'xsScales': [getXSScale(fileName) for fileName in fileList], 'histNames': histNames}, cacheFile)
+  print "Wrote merged sample", sampleDef[1], plotDir, "to", cacheName+'.root'
+
+################# Combine all samples ##############################
+def getHists( sampleNames, sampleFiles, sampleDefs, plotDirs ):
+  """Read and combine the histograms of every sample and plotDir, opening each file only once.
+  Returns {plotDir: (histNames, hists)}, with the histogram names common to all files
+  and the combined histograms as [sample][histName].
+  Histograms filtered out by --includeHists/--excludeHists are never read"""
+
+  if args.bundles:
+    return getBundleHists( sampleNames, sampleFiles, plotDirs )
+
+  ## A filtered run may read the merged cache, but not write its partial samples to it ##
+  writeMerged = args.writeMerged and not (includeHists or excludeHists)
+
+  ## Histogram names common to the files of each sample, from the merged cache or key index when available ##
+  mergedSamples, sampleHistNames = {}, {}
+  for iS, fileList in enumerate(sampleFiles):
+    for plotDir in plotDirs:
+      mergedSample = loadMergedSample(sampleDefs[iS], plotDir, fileList) if args.writeMerged else None
+      mergedSamples[(iS, plotDir)] = mergedSample
+      if mergedSample is not None:
+        sampleHistNames[(iS, plotDir)] = selectHistNames( mergedSample['histNames'] )
+        continue
+      indexedHistNames = [getIndexedKeys(fileName, plotDir) for fileName in fileList]
+      if all( histNames is not None for histNames in indexedHistNames ):
+        sampleHistNames[(iS, plotDir)] = selectHistNames( getCommonHistNames( indexedHistNames ) )
+      else:
+        sampleHistNames[(iS, plotDir)] = None
+
+  ## If every sample is indexed, only the histograms common to all files need to be read ##
+  histNames = {}
+  for plotDir in plotDirs:
+    theseHistNames = [sampleHistNames[(iS, plotDir)] for iS in range(len(sampleFiles))]
+    if all( thisHistNames is not None for thisHistNames in theseHistNames ):
+      histNames[plotDir] = getCommonHistNames( theseHistNames )
     else:
-      plotDir = inFile
-    keys = plotDir.GetListOfKeys()
-    for key in keys:
-      allHistNames[-1].append(args.plotDir+'/'+key.GetName())
-      #if len(args.plotDir <= 1):
-      #  allHistNames[-1].append(args.plotDir+'/'+key.GetName())
-      #else:
-      #  for thisPlotDir in args.plotDir:
-      #    allHistNames[-1].append(thisPlotDir+'/'+key.GetName())
+      histNames[plotDir] = None
+
+  CombinedHists = {}
+  for iS, fileList in enumerate(sampleFiles):
+    readDirs = []
+    for plotDir in plotDirs:
+      CombinedHists[(iS, plotDir)] = {}
+      mergedSample = mergedSamples[(iS, plotDir)]
+      if mergedSample is None:
+        readDirs.append( plotDir )
+        continue
+
+      file = ROOT.TFile.Open(mergedSample['fileName'], "READ")
+      for histName in (histNames[plotDir] if histNames[plotDir] is not None else sampleHistNames[(iS, plotDir)]):
+        thisHist = file.Get(histName)
+        CombinedHists[(iS, plotDir)][histName] = thisHist.Clone( sampleNames[iS]+'_'+thisHist.GetName() )
+        CombinedHists[(iS, plotDir)][histName].SetDirectory( 0 )
+      file.Close()
+
+    if len(readDirs) == 0:
+      continue
+
+    fileHistNames = dict( (plotDir, []) for plotDir in readDirs )
+    for fileName in fileList:
+      file = ROOT.TFile.Open(fileName, "READ")
+      xsScale = getXSScale( fileName )
+
+      for plotDir in readDirs:
+        fileHistNames[plotDir].append( selectHistNames( getFileHistNames( file, fileName, plotDir ) ) )
+        sampleHists = CombinedHists[(iS, plotDir)]
+        ## A sample written to the merged cache needs all of its histograms, not only the common ones ##
+        histNamesToRead = sampleHistNames[(iS, plotDir)] if writeMerged else histNames[plotDir]
+        if histNamesToRead is None:
+          histNamesToRead = fileHistNames[plotDir][-1]
+
+        for histName in histNamesToRead:
+          thisHist = file.Get(histName)
+          if not histName in sampleHists:
+            sampleHists[histName] = thisHist.Clone( sampleNames[iS]+'_'+thisHist.GetName() ) #Unique name for each type
+            sampleHists[histName].SetDirectory( 0 ) # just in case...
+            if xsScale != 1.:
+              sampleHists[histName].Scale( xsScale )
+          else:
+            sampleHists[histName].Add( thisHist, xsScale )
 
+      file.Close()
 
-    inFile.Close()
+    for plotDir in readDirs:
+      sampleHistNames[(iS, plotDir)] = getCommonHistNames( fileHistNames[plotDir] )
+      if writeMerged:
+        writeMergedSample( sampleDefs[iS], plotDir, fileList, CombinedHists[(iS, plotDir)], sampleHistNames[(iS, plotDir)] )
 
-  ## Hist Names must be common to all files ##
-  histNames = []
-  for histName in allHistNames[0]:
-    if all( histName in histNameList for histNameList in allHistNames):
-      histNames.append(histName)
+  saveKeyIndexes()
 
-  return histNames
+  PlotDirHists = {}
+  for plotDir in plotDirs:
+    if histNames[plotDir] is None:
+      histNames[plotDir] = getCommonHistNames( [sampleHistNames[(iS, plotDir)] for iS in range(len(sampleFiles))] )
+    Hists = [ [CombinedHists[(iS, plotDir)][histName] for histName in histNames[plotDir]] for iS in range(len(sampleFiles)) ]
+    PlotDirHists[plotDir] = (histNames[plotDir], Hists)
 
-################# Combine all samples ##############################
-def getHists( sampleName, fileList, histNames ):
+  return PlotDirHists
 
-  CombinedHists = []
+def getBundleHists( sampleNames, sampleFiles, plotDirs ):
+  """getHists for --bundles inputs.  The histograms are summed as arrays, and only the
+  selected histograms common to all files are converted to ROOT for drawing"""
+  bundles = [ [histBundle.HistBundle(fileName) for fileName in fileList] for fileList in sampleFiles ]
+  xsScales = [ [getXSScale(fileName) for fileName in fileList] for fileList in sampleFiles ]
 
-  for iF, fileName in enumerate(fileList):
-    file = ROOT.TFile.Open(fileName, "READ")
+  PlotDirHists = {}
+  for plotDir in plotDirs:
+    histNames = getCommonHistNames( [selectHistNames( bundle.getHistNames(plotDir) ) for sampleBundles in bundles for bundle in sampleBundles] )
+    Hists = []
+    for iS, sampleBundles in enumerate(bundles):
+      Hists.append( [histBundle.sumHists( [bundle.get(histName).scaled(xsScales[iS][iB]) for iB, bundle in enumerate(sampleBundles)] ).toROOT( sampleNames[iS]+'_'+histName.split('/')[-1] ) for histName in histNames] )
+    PlotDirHists[plotDir] = (histNames, Hists)
 
-    for iH, histName in enumerate(histNames):
-      thisHist = file.Get(histName)
-      if iF == 0:
-        CombinedHists.append( thisHist.Clone( sampleName+'_'+thisHist.GetName() ) ) #Unique name for each type
-        CombinedHists[-1].SetDirectory( 0 ) # just in case...
-      else:
-        CombinedHists[iH].Add( thisHist )
-
-    file.Close()
-
-#??    ##Need to add clone now else get's rebinned ##
-#??    CombinedHists.append(copy.copy(total))
-#??    CombinedHists[-1].SetName( total.GetName()+"_final")
-
-  return CombinedHists
+  return PlotDirHists
 
 ## Ideas to Add From before ###
 
@@ -302,52 +535,50 @@ def getHists( sampleName, fileList, histNames ):
   ##  hist.SetBinError( nbinX, newError )
 
 
-##  if args.writeMerged:
-##    f = ROOT.TFile(args.histDirData+"/"+mergeFileTag+"_mergedFiles.root","recreate")
-##    for hist in CombinedHists:
-##      hist.Write()
-##    f.Close()
-
-
 
 
 ##################################### Plotting Code ###########################################
-def plotAll( SampleNames, SampleTypes, HistNames, Hists):
+## Independent plotting jobs, (histograms of each sample, outputTag) ##
+## Filled before the worker processes are forked, so they inherit the histograms ##
+plotJobs = []
+
+def plotAll( SampleNames, SampleTypes, PlotDirHists, plotDirs ):
   print "plotAll"
 
   ### Align histograms and reorder so histName is first dimension ###
   #Hists are [fileType][histName]
-  newHistList = []  #Will be [histName][fileType]
-  for iHist, thisHistName in enumerate(HistNames):
-    newHistList.append([])
-
-    for iSample, thisSample in enumerate(SampleTypes):
-      newHistList[-1].append( Hists[iSample][iHist] )
-
-  Hists = newHistList
-
-#  for iHist, histName in enumerate(newHistNames):
-#    print  "-----------------------------"
-#    for iBkg, thisHistName in enumerate(histName):
-#      print thisHistName, newHistList[iHist][iBkg]
-
-
-
-
-  for iHist, histName in enumerate(HistNames):
-    theseHists = Hists[iHist]
-    theseTypes = SampleTypes
-    theseNames = SampleNames
-    formatHists(theseTypes, theseHists)
-    lumiScale = getLumiDifference(theseTypes, theseHists)
-    if(args.stackBkg):
-      theseTypes, theseHists, theseNames = stackBkg(theseTypes, theseHists, theseNames)
-    scaleHists(theseTypes, theseHists, lumiScale)
-    if ( type(theseHists[0]) == ROOT.TH1D or type(theseHists[0]) == ROOT.TH1F or type(theseHists[0]) == ROOT.THStack ):
-      plot1D( theseHists, theseTypes, theseNames )
+  for plotDir in plotDirs:
+    HistNames, Hists = PlotDirHists[plotDir]
+    outputTag = args.outputTag+'_'+plotDir.replace('/','_')
+    for iHist, thisHistName in enumerate(HistNames):
+      plotJobs.append( ([Hists[iSample][iHist] for iSample in range(len(SampleTypes))], outputTag) )
+
+  ## Every histogram is formatted, scaled and drawn independently, with deterministic output names ##
+  if args.ncores > 1 and len(plotJobs) > 1:
+    pool = multiprocessing.Pool( args.ncores )
+    pool.map( runPlotJob, [(SampleNames, SampleTypes, iJob) for iJob in range(len(plotJobs))], chunksize=1 )
+    pool.close()
+    pool.join()
+  else:
+    for iJob in range(len(plotJobs)):
+      runPlotJob( (SampleNames, SampleTypes, iJob) )
 
 #    plotHists( SampleNames, histsToPlot, histName[0], HistTypes, args.outputTag, args.outputVersion )
 
+def runPlotJob( job ):
+  SampleNames, SampleTypes, iJob = job
+  theseHists, outputTag = plotJobs[iJob]
+  theseTypes = SampleTypes
+  theseNames = SampleNames
+  formatHists(theseTypes, theseHists)
+  lumiScale = getLumiDifference(theseTypes, theseHists)
+  if(args.stackBkg):
+    theseTypes, theseHists, theseNames = stackBkg(theseTypes, theseHists, theseNames)
+  scaleHists(theseTypes, theseHists, lumiScale)
+  if ( type(theseHists[0]) == ROOT.TH1D or type(theseHists[0]) == ROOT.TH1F or type(theseHists[0]) == ROOT.THStack ):
+    plot1D( theseHists, theseTypes, theseNames, outputTag )
+  return iJob
+
 def stackBkg(SampleTypes, Hists, Names):
 
   newSampleTypes = []
@@ -391,70 +622,75 @@ def scaleHists( histTypes, hists, lumiScale ):
           stackHist.Scale( args.lumi*1000. ) #fb -> pb
 
   elif args.normToBkg or args.normToData:
+    ## Integrals are taken once, from the bin arrays, with stacks as the sum of their members ##
+    integrals = getIntegrals( hists )
     if not "stack" in histTypes:
       if args.normToBkg:
         iScale = histTypes.index("bkg")
       elif args.normToData:
         iScale = histTypes.index("data")
-      scaleNorm = hists[iScale].Integral()
+      scaleNorm = integrals[iScale]
 
       ## If only 1 bkg and there are signals, then scale signals by the same as the bkg ##
       if args.normToData and (histTypes.count('bkg') == 1) and ('signal' in histTypes) :
         bkgScaleFactor = 1.
         for iHist, hist in enumerate(hists):
-          if iHist != iData and hist.Integral() > 0 :
+          if iHist != iScale and integrals[iHist] > 0 :
             if histTypes[iHist] == 'bkg':
-              bkgScaleFactor = scaleNorm / hist.Integral()
+              bkgScaleFactor = scaleNorm / integrals[iHist]
               hist.Scale(bkgScaleFactor)
             elif histTypes[iHist] == 'data':
-              hist.Scale( scaleNorm / hist.Integral() )
+              hist.Scale( scaleNorm / integrals[iHist] )
         for iHist, hist in enumerate(hists):
           if histTypes[iHist] == 'signal':
             hist.Scale(bkgScaleFactor)
 
       else: ## Just scale the rest
         for iHist, hist in enumerate(hists):
-          if iHist != iScale and histTypes[iHist] != "signal" and hist.Integral() > 0:
-            hist.Scale( scaleNorm / hist.Integral() )
+          if iHist != iScale and histTypes[iHist] != "signal" and integrals[iHist] > 0:
+            hist.Scale( scaleNorm / integrals[iHist] )
 
     else: ## If a stack, treat like 1 bkg + signal case, but 1 bkg = stack
-      bkgScaleFactor = 0.
-      for iStack, stackHist in enumerate(hists[0].GetHists()):
-        bkgScaleFactor += stackHist.Integral()
+      bkgScaleFactor = integrals[0]
       if bkgScaleFactor <= 0 :
         return
       if args.normToData:
         iScale = histTypes.index("data")
-        scaleNorm = hists[iScale].Integral()
+        scaleNorm = integrals[iScale]
         for iHist, hist in enumerate(hists):
           if iHist == 0:
             for iStack, stackHist in enumerate(hists[iHist].GetHists()):
               stackHist.Scale( scaleNorm / bkgScaleFactor )
-          elif histTypes[iHist] == 'data' and hist.Integral() > 0:
-            hist.Scale( scaleNorm / hist.Integral() )
+          elif histTypes[iHist] == 'data' and integrals[iHist] > 0:
+            hist.Scale( scaleNorm / integrals[iHist] )
           elif histTypes[iHist] == 'signal':
             hist.Scale( scaleNorm / bkgScaleFactor )
       elif args.normToBkg:
         for iHist, hist in enumerate(hists):
-          if iHist != 0 and hist.Integral() > 0:
-            hist.Scale( bkgScaleFactor / hist.Integral() )
+          if iHist != 0 and integrals[iHist] > 0:
+            hist.Scale( bkgScaleFactor / integrals[iHist] )
 
   elif args.unitNormalize or args.differential:
     if "stack" in histTypes:
       print "Error, cannot do unitNormalize or differential with Stacked histograms"
       exit(1)
+    integrals = getIntegrals( hists )
     for iHist, hist in enumerate(hists):
-      if hist.Integral() > 0:
+      if integrals[iHist] > 0:
         if args.unitNormalize:
-          hist.Scale(1.0/hist.Integral())
+          hist.Scale(1.0/integrals[iHist])
         elif args.differential:
-          hist.Scale(1.0/hist.Integral(),"width")
+          hist.Scale(1.0/integrals[iHist],"width")
 
   return
 
+def getIntegrals( hists ):
+  return [ histArrays.integral( histArrays.getTotalArrays(hist)[0] ) for hist in hists ]
+
+
 
 #### Plot 1D Histograms ####
-def plot1D( Hists, SampleTypes, SampleNames ):
+def plot1D( Hists, SampleTypes, SampleNames, outputTag ):
 
   histName = '_'.join(Hists[0].GetName().split('_')[1:] )
   plotRatio = args.plotRatio
@@ -513,38 +749,30 @@ def plot1D( Hists, SampleTypes, SampleNames ):
   if plotRatio:
     ratioHists = [] #Ratio histograms
     iRatioHist = SampleTypes.index(args.ratioWRT)
+    refContents, refSumw2 = histArrays.getTotalArrays( Hists[iRatioHist] )
+    ## ratios are clones of the reference histogram, or of a member of a reference stack, holding the new arrays ##
+    refHist = Hists[iRatioHist]
+    if type(refHist) == ROOT.THStack:
+      refHist = refHist.GetHists()[0]
+    # flip it so excess is still positive on ratio
+    flipRatio = (args.ratioWRT == 'bkg' or args.ratioWRT == 'stack')
     for iHist, hist in enumerate(Hists):
       if iHist == iRatioHist: continue
 
-      ## get relevant hists ##
-      tmpRatioHist = Hists[iRatioHist].Clone( hist.GetName()+'_ratio' )
-      tmpHist = hist.Clone( 'tmp' )
-
-      ## create ratio ##
-      if type(tmpHist) == ROOT.THStack:
-        tmpStackHist = getCombinedStack( tmpHist )
-        for iStack, stackHist in enumerate(tmpHist.GetHists() ):
-          if iStack == 0:
-            tmpStackHist = stackHist.Clone('tmp2')
-          else:
-            tmpStackHist.Add( stackHist )
-        tmpRatioHist.Add( tmpStackHist, -1. )
-        tmpRatioHist.Divide( tmpStackHist )
-      else:
-        tmpRatioHist.Add( tmpHist, -1. )
-        tmpRatioHist.Divide( tmpHist )
-
-      # flip it so excess is still positive on ratio
-      if args.ratioWRT == 'bkg' or args.ratioWRT == 'stack':
-        tmpRatioHist.Scale( -1.0 )
+      ## create ratio from the bin arrays, summing stack members once ##
+      contents, sumw2 = histArrays.getTotalArrays( hist )
+      ratio, ratioSumw2 = histArrays.relativeDifference( refContents, refSumw2, contents, sumw2 )
+      if flipRatio:
+        ratio = -ratio
 
       ## If ratio value is 0 then there should be no ratio drawn
-      for iBin in range(1, tmpRatioHist.GetNbinsX()+1):
-        if Hists[iRatioHist].GetBinContent(iBin) == 0:
-          tmpRatioHist.SetBinContent(iBin, 0)
-          tmpRatioHist.SetBinError(iBin, 0)
+      ratio[refContents == 0] = 0.
+      ratioSumw2[refContents == 0] = 0.
 
-      configureRatioHist(tmpHist, tmpRatioHist)
+      tmpRatioHist = refHist.Clone( hist.GetName()+'_ratio' )
+      histArrays.setArrays( tmpRatioHist, ratio, ratioSumw2 )
+
+      configureRatioHist(hist, tmpRatioHist)
       ratioHists.append( tmpRatioHist )
 
   ## Draw Ratio Plots
@@ -576,7 +804,7 @@ def plot1D( Hists, SampleTypes, SampleNames ):
     else:
       AtlasStyle.myText(0.20,0.75, 1,extraTextString.split(',')[1])
 
-  c0.Print( args.outDir + "/" + args.outputTag + "_" + histName + args.outputVersion + ".png","png") #,"png")
+  c0.Print( args.outDir + "/" + outputTag + "_" + histName + args.outputVersion + ".png","png") #,"png")
 
 
   ## Draw y-log plots ##
@@ -600,7 +828,7 @@ def plot1D( Hists, SampleTypes, SampleNames ):
 
     Hists[iH].Draw( drawString )
 
-  c0.Print( args.outDir + "/" + args.outputTag + "_" + histName + args.outputVersion + "_logY.png","png") #,"png")
+  c0.Print( args.outDir + "/" + outputTag + "_" + histName + args.outputVersion + "_logY.png","png") #,"png")
 
 
 
@@ -863,16 +1091,7 @@ def getSqrtSLumiText( lumi ):
   sqrtSLumiText = "#sqrt{s}=13 TeV, "+str(lumi)+" fb^{-1}"
   return sqrtSLumiText
 
-def getCombinedStack( stackHist ):
-  for iStack, thisHist in enumerate(stackHist.GetHists() ):
-    if iStack == 0:
-      combinedHist = thisHist.Clone('tmp2')
-    else:
-      combinedHist.Add( thisHist )
-  return combinedHist
-
 if __name__ == "__main__":
-  args.outputTag = args.outputTag+'_'+args.plotDir
-  SampleNames, SampleTypes, HistNames, Hists = getPlotList()
-  plotAll( SampleNames, SampleTypes, HistNames, Hists )
+  SampleNames, SampleTypes, PlotDirHists = getPlotList()
+  plotAll( SampleNames, SampleTypes, PlotDirHists, args.plotDirs )
 
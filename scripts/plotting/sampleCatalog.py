@@ -0,0 +1,80 @@
+##############################################################
+# sampleCatalog.py                                           #
+##############################################################
+# Index of the histogram files of a directory, for resolving #
+# sample expressions without rescanning it for every sample  #
+##############################################################
+# Jeff.Dandoy and Nedaa.Asbah                                #
+##############################################################
+
+import os, re
+
+## i.e. user.nasbah.mc15_13TeV.410000.ttbar_hdamp172p5_nonallhad.Gradient_20160121_output.3_NewStudy.root ##
+## or   user.nasbah.data16_13TeV.00300279.physics_Main.Gradient_20160121_output.3_NewStudy.root             ##
+fileNameExpr = re.compile(r'(mc|data)(\d\d)_\d+TeV\.(\d{6,8})\.([^.]+)\.?(.*)$')
+periodExpr = re.compile(r'period([A-Z]\d*)')
+
+def parseFileName( fileName ):
+  """Return the DSID or run number, year, period, physics name and tag of a histogram file name"""
+  baseName = os.path.basename(fileName)
+  for extension in ['.root', '.hbundle']:
+    if baseName.endswith(extension):
+      baseName = baseName[:-len(extension)]
+  info = {'isData': False, 'dsid': None, 'run': None, 'year': None, 'period': None, 'physicsName': None, 'tag': None}
+  match = fileNameExpr.search( baseName )
+  if match:
+    info['isData'] = match.group(1) == 'data'
+    info['year'] = 2000+int(match.group(2))
+    if info['isData']:
+      info['run'] = int(match.group(3))
+    else:
+      info['dsid'] = int(match.group(3))
+    info['physicsName'] = match.group(4)
+    info['tag'] = match.group(5)
+  periodMatch = periodExpr.search( baseName )
+  if periodMatch:
+    info['period'] = periodMatch.group(1)
+  return info
+
+class SampleCatalog(object):
+  """All files of histDir with the given extension, scanned once and indexed by DSID and run number.
+  Sample expressions use the plotHistograms syntax: tags joined by '+' must all match, and a tag
+  may be a '=' seperated list of alternatives.  A tag that is a DSID or run number is looked up
+  in the index, any other tag is a substring match whose result is remembered"""
+  def __init__( self, histDir, extension='.root' ):
+    self.histDir = histDir
+    self.extension = extension
+    self.fileNames = sorted( fileName for fileName in os.listdir(histDir)
+        if fileName.endswith(extension) and os.path.isfile( os.path.join(histDir, fileName) ) )
+    self.info = {}
+    self.byNumber = {}
+    for fileName in self.fileNames:
+      info = parseFileName( fileName )
+      self.info[fileName] = info
+      number = info['run'] if info['isData'] else info['dsid']
+      if number is not None:
+        self.byNumber.setdefault( number, set() ).add( fileName )
+    self.tagMatches = {}
+
+  def getMatches( self, tag ):
+    """Set of file names matching a single tag"""
+    if not tag in self.tagMatches:
+      if tag.isdigit() and len(tag) >= 6 and int(tag) in self.byNumber:
+        self.tagMatches[tag] = self.byNumber[int(tag)]
+      else:
+        self.tagMatches[tag] = set( fileName for fileName in self.fileNames if tag in fileName )
+    return self.tagMatches[tag]
+
+  def resolve( self, tags ):
+    """Full paths of the files matching every tag of the list"""
+    selected = None
+    for tag in tags:
+      matched = set()
+      for splitTag in tag.split('='):
+        matched |= self.getMatches( splitTag )
+      selected = matched if selected is None else (selected & matched)
+      if len(selected) == 0:
+        break
+    if selected is None:
+      selected = self.fileNames
+    return [ os.path.join(self.histDir, fileName) for fileName in sorted(selected) ]
@@ -0,0 +1,433 @@
+#!/usr/bin/env python
+
+##############################################################
+# pyHistogrammer.py                                          #
+##############################################################
+# Columnar alternative to the HistogramMiniTree EventLoop.   #
+# Reads the MiniTree branches in chunks with uproot, applies #
+# the selections as masks and fills the same histograms     #
+# with numpy                                                 #
+##############################################################
+# Jeff.Dandoy and Nedaa.Asbah                                #
+##############################################################
+
+## The selections, histogram table and filling mirror HistogramMiniTree::configure,     ##
+## loadHistTable and execute, including the single precision of the event weight and   ##
+## HT sums, and the TH1F contents are summed in single precision in the same fill       ##
+## order, so outputs are identical to the EventLoop (see compareHistograms.py)          ##
+##                                                                                      ##
+## Needs uproot 3 and its awkward 0 arrays, the last versions supporting python 2       ##
+
+import os, sys, re, glob, time
+import argparse
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'plotting'))
+import crossSections, buildInputIndex
+
+parser = argparse.ArgumentParser(description="%prog [options]", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument("--file", dest='file', required=True,
+     help="Input root file, or a directory of them")
+parser.add_argument("--output", dest='output', default="hist-pyHistogrammer.root",
+     help="Output histogram file")
+parser.add_argument("--configName", dest='configName', default="$ROOTCOREBIN/data/ttHHistogrammer/ttHHistogrammer.config",
+     help="ttHHistogrammer config file")
+parser.add_argument("--treeName", dest='treeName', default="nominal_Loose",
+     help="Name of the input TTree")
+parser.add_argument("--firstEntry", dest='firstEntry', default=0,
+     type=int, help="First TTree entry to process")
+parser.add_argument("--lastEntry", dest='lastEntry', default=-1,
+     type=int, help="Process entries up to, but not including, this one (-1 for all)")
+parser.add_argument("--chunkSize", dest='chunkSize', default=100000,
+     type=int, help="Number of entries read and filled at once")
+
+
+############## Configuration ##############################
+def readConfig( configName ):
+  """Read the TEnv style "Key  value" config file into a dict of strings"""
+  config = {}
+  with open( os.path.expandvars(configName), 'r' ) as configFile:
+    for line in configFile:
+      line = line.strip()
+      if len(line) == 0 or line.startswith('#'):
+        continue
+      fields = re.split(r'[:\s]+', line, 1)
+      if len(fields) == 2:
+        config[fields[0]] = fields[1].strip()
+  return config
+
+def getConfigBool( config, key, default ):
+  if not key in config:
+    return default
+  return config[key].lower() in ['true', 'yes', 'on', '1']
+
+############## Selections (HistogramMiniTree::configure) ##############################
+class Selection(object):
+  def __init__( self, name, displayName, elNum=-1, muNum=-1, jetNum=-1, bJetNum=-1, jetEquality=True, bJetEquality=True ):
+    self.name = name
+    self.displayName = displayName
+    self.elNum = elNum
+    self.muNum = muNum
+    self.jetNum = jetNum
+    self.bJetNum = bJetNum
+    self.jetEquality = jetEquality
+    self.bJetEquality = bJetEquality
+
+selections = [
+  Selection( "sel_el_4j", "1 Electron, >= 4 jets", elNum=1, muNum=0, jetNum=4, jetEquality=False ),
+  Selection( "sel_mu_4j", "1 Muon, >= 4 jets", elNum=0, muNum=1, jetNum=4, jetEquality=False ),
+  Selection( "sel_mu_4j_2b", "1 Muon, >= 4 jets, >= 2 b-jets", elNum=0, muNum=1, jetNum=4, jetEquality=False, bJetNum=2, bJetEquality=False ),
+  Selection( "sel_mu_4j_3b", "1 Muon, = 4 jets, = 3 b-jets", elNum=0, muNum=1, jetNum=4, bJetNum=3 ),
+  Selection( "sel_mu_4j_4b", "1 Muon, = 4 jets, = 4 b-jets", elNum=0, muNum=1, jetNum=4, bJetNum=4 ),
+  Selection( "sel_el_4j_2b", "1 Electron, >= 4 jets, >= 2 b-jets", elNum=1, muNum=0, jetNum=4, jetEquality=False, bJetNum=2, bJetEquality=False ),
+  Selection( "sel_el_4j_3b", "1 Electron, = 4 jets, = 3 b-jets", elNum=1, muNum=0, jetNum=4, bJetNum=3 ),
+  Selection( "sel_el_4j_4b", "1 Electron, = 4 jets, = 4 b-jets", elNum=1, muNum=0, jetNum=4, bJetNum=4 ),
+  Selection( "sel_mu_5j_2b", "1 Muon, = 5 jets, = 2 b-jets", elNum=0, muNum=1, jetNum=5, bJetNum=2 ),
+  Selection( "sel_mu_5j_3b", "1 Muon, = 5 jets, = 3 b-jets", elNum=0, muNum=1, jetNum=5, bJetNum=3 ),
+  Selection( "sel_mu_5j_4b", "1 Muon, = 5 jets, >= 4 b-jets", elNum=0, muNum=1, jetNum=5, bJetNum=4, bJetEquality=False ),
+  Selection( "sel_el_5j_2b", "1 Electron, = 5 jets, = 2 b-jets", elNum=1, muNum=0, jetNum=5, bJetNum=2 ),
+  Selection( "sel_el_5j_3b", "1 Electron, = 5 jets, = 3 b-jets", elNum=1, muNum=0, jetNum=5, bJetNum=3 ),
+  Selection( "sel_el_5j_4b", "1 Electron, = 5 jets, >= 4 b-jets", elNum=1, muNum=0, jetNum=5, bJetNum=4, bJetEquality=False ),
+  Selection( "sel_mu_6j_2b", "1 Muon, >= 6 jets, = 2 b-jets", elNum=0, muNum=1, jetNum=6, jetEquality=False, bJetNum=2 ),
+  Selection( "sel_mu_6j_3b", "1 Muon, >= 6 jets, = 3 b-jets", elNum=0, muNum=1, jetNum=6, jetEquality=False, bJetNum=3 ),
+  Selection( "sel_mu_6j_4b", "1 Muon, >= 6 jets, >= 4 b-jets", elNum=0, muNum=1, jetNum=6, jetEquality=False, bJetNum=4, bJetEquality=False ),
+  Selection( "sel_el_6j_2b", "1 Electron, >= 6 jets, = 2 b-jets", elNum=1, muNum=0, jetNum=6, jetEquality=False, bJetNum=2 ),
+  Selection( "sel_el_6j_3b", "1 Electron, >= 6 jets, = 3 b-jets", elNum=1, muNum=0, jetNum=6, jetEquality=False, bJetNum=3 ),
+  Selection( "sel_el_6j_4b", "1 Electron, >= 6 jets, >= 4 b-jets", elNum=1, muNum=0, jetNum=6, jetEquality=False, bJetNum=4, bJetEquality=False ),
+]
+
+############## Histograms (HistogramMiniTree::loadHistTable) ##############################
+objectNames = ['el', 'mu', 'jet', 'bjet', 'event']
+objectVariables = {'el': ['pt', 'eta', 'phi', 'e'], 'mu': ['pt', 'eta', 'phi', 'e'],
+                   'jet': ['pt', 'eta', 'phi', 'e', 'mv2c10'], 'bjet': ['pt', 'eta', 'phi', 'e', 'mv2c10']}
+eventVariables = {'jet': ['n', 'ht'], 'bjet': ['n', 'ht'], 'event': ['met', 'ht_all', 'ClassifBDTOutput_withReco_basic']}
+
+class HistDefinition(object):
+  def __init__( self, name, xTitle, obj, variable, index, nBins, xMin, xMax, selections ):
+    self.name = name
+    self.xTitle = xTitle
+    self.obj = obj
+    self.variable = variable
+    self.index = index  # object position, 'all' for all objects or None for per event histograms
+    self.nBins = nBins
+    self.xMin = xMin
+    self.xMax = xMax
+    self.selections = selections
+
+  def useSelection( self, selectionName ):
+    for pattern in self.selections:
+      if pattern.endswith('*') and selectionName.startswith(pattern[:-1]):
+        return True
+      if pattern == selectionName:
+        return True
+    return False
+
+def readHistTable( tableName ):
+  """HistDefinitions of the data/HistogramTable.txt format, one per object position"""
+  definitions = []
+  with open( os.path.expandvars(tableName), 'r' ) as tableFile:
+    for line in tableFile:
+      ## Titles may hold a # (i.e. #eta), so only lines starting with one are comments ##
+      if len(line.strip()) == 0 or line.strip().startswith('#'):
+        continue
+      fields = line.split(None, 8)
+      if len(fields) < 8:
+        raise ValueError( "Could not read histogram table line "+line.strip() )
+      name, obj, variable, indexRange, nBins, xMin, xMax, selections = fields[:8]
+      xTitle = fields[8].strip() if len(fields) > 8 else ""
+      if indexRange == '-':
+        known = variable in eventVariables.get(obj, [])
+      else:
+        known = variable in objectVariables.get(obj, [])
+      if not known:
+        raise ValueError( "Unknown histogram variable {0} {1} with index {2}".format(obj, variable, indexRange) )
+
+      binning = (int(nBins), float(xMin), float(xMax), selections.split(','))
+      if indexRange in ['-', 'all']:
+        definitions.append( HistDefinition(name, xTitle, obj, variable, None if indexRange == '-' else 'all', *binning) )
+        continue
+      indices = indexRange.split('-')
+      for iObj in range( int(indices[0]), int(indices[-1])+1 ):
+        thisName = name.replace('$i', str(iObj)).replace('$n', str(iObj+1))
+        thisTitle = xTitle.replace('$i', str(iObj)).replace('$n', str(iObj+1))
+        definitions.append( HistDefinition(thisName, thisTitle, obj, variable, iObj, *binning) )
+  return definitions
+
+class Hist1D(object):
+  """Fixed binning 1D histogram binned like TAxis::FindBin.  Contents are float like TH1F, rounded after
+  every fill in fill order with numpy.add.at, and sumw2 is double like TH1::fSumw2"""
+  def __init__( self, name, xTitle, nBins, xMin, xMax ):
+    self.name = name
+    self.xTitle = xTitle
+    self.nBins = nBins
+    self.xMin = float(xMin)
+    self.xMax = float(xMax)
+    self.contents = numpy.zeros(nBins+2, dtype=numpy.float32)
+    self.sumw2 = numpy.zeros(nBins+2, dtype=numpy.float64)
+    self.entries = 0
+
+  def fill( self, x, w ):
+    if len(x) == 0:
+      return
+    bins = numpy.empty( len(x), dtype=numpy.int64 )
+    under = x < self.xMin
+    over = ~(x < self.xMax)
+    inside = ~(under | over)
+    bins[under] = 0
+    bins[over] = self.nBins+1
+    bins[inside] = 1 + (self.nBins*(x[inside]-self.xMin)/(self.xMax-self.xMin)).astype(numpy.int64)
+    w = numpy.asarray( w, dtype=numpy.float64 )
+    numpy.add.at( self.contents, bins, w.astype(numpy.float32) )
+    numpy.add.at( self.sumw2, bins, w*w )
+    self.entries += len(x)
+
+############## Reading ##############################
+def iterateChunks( fileName, treeName, branches, chunkSize, firstEntry=0, lastEntry=-1 ):
+  """Yield (nEvents, {branch: array}) chunks, with jagged branches as (counts, flat values)"""
+  import uproot
+  if not uproot.__version__.startswith('3.'):
+    print "ERROR: pyHistogrammer.py needs uproot 3, not", uproot.__version__
+    sys.exit(1)
+  tree = uproot.open( fileName )[treeName]
+  entryStop = None if lastEntry < 0 else lastEntry
+  chunks = tree.iterate( branches, entrysteps=chunkSize, entrystart=firstEntry, entrystop=entryStop, namedecode='utf-8' )
+
+  for chunk in chunks:
+    arrays = {}
+    for branch in branches:
+      arrays[branch] = toNumpy( chunk[branch] )
+    nEvents = len(arrays[branches[0]][0]) if type(arrays[branches[0]]) == tuple else len(arrays[branches[0]])
+    yield nEvents, arrays
+
+def toNumpy( array ):
+  """numpy array of a flat branch, or (counts, flat values) of a jagged awkward 0 JaggedArray"""
+  if hasattr(array, 'counts') and hasattr(array, 'flatten'):
+    return numpy.asarray(array.counts), numpy.asarray(array.flatten())
+  return numpy.asarray(array)
+
+def getSumWeights( fileName ):
+  """Summed totalEventsWeighted, accumulated in single precision like changeInput()"""
+  import uproot
+  try:
+    sumWeightsTree = uproot.open( fileName )["sumWeights"]
+  except KeyError:
+    return numpy.float32(0.)
+  weights = numpy.asarray( toNumpy( sumWeightsTree["totalEventsWeighted"].array() ), dtype=numpy.float32 )
+  if len(weights) == 0:
+    return numpy.float32(0.)
+  return numpy.add.accumulate( weights, dtype=numpy.float32 )[-1]
+
+############## Filling (HistogramMiniTree::execute) ##############################
+def sumInFloat( counts, starts, values, total=None ):
+  """Per-event sum of values, rounded to float after every object like the float HT sums of execute()"""
+  if total is None:
+    total = numpy.zeros( len(counts), dtype=numpy.float32 )
+  for iObj in range( counts.max() if len(counts) > 0 else 0 ):
+    hasObj = counts > iObj
+    total[hasObj] = (total[hasObj].astype(numpy.float64) + values[starts[hasObj]+iObj]).astype(numpy.float32)
+  return total
+
+class ObjectColumns(object):
+  """Flat per-object values of a chunk, with the event and position in the event of every object"""
+  def __init__( self, counts, values ):
+    self.counts = counts
+    self.starts = numpy.concatenate( ([0], numpy.cumsum(counts)[:-1]) ).astype(numpy.int64) if len(counts) > 0 else numpy.zeros(0, dtype=numpy.int64)
+    self.event = numpy.repeat( numpy.arange(len(counts)), counts )
+    self.index = numpy.arange( len(self.event) ) - numpy.repeat( self.starts, counts )
+    self.values = values
+
+def getDefaultHistTable():
+  """The HistogramTable.txt used by the event loop, or the one of this package if not installed"""
+  if os.getenv('ROOTCOREBIN'):
+    installedFile = os.path.join(os.getenv('ROOTCOREBIN'), 'data', 'ttHHistogrammer', 'HistogramTable.txt')
+    if os.path.exists(installedFile):
+      return installedFile
+  return os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'HistogramTable.txt')
+
+class Histogrammer(object):
+  def __init__( self, config ):
+    self.bTagWP = numpy.float32( float(config.get('BTagWP', 0.8244)) )
+    self.use2015 = getConfigBool( config, 'Use2015', False )
+    self.use2016 = getConfigBool( config, 'Use2016', False )
+    self.maxEvent = int(config.get('MaxEvent', -1))
+    self.leptonDecision = True
+    self.definitions = readHistTable( config.get('HistogramTable', getDefaultHistTable()) )
+    ## The histograms of the table enabled for each selection ##
+    self.hists = []
+    for selection in selections:
+      self.hists.append( [ (definition, Hist1D(definition.name, definition.xTitle, definition.nBins, definition.xMin, definition.xMax))
+          for definition in self.definitions if definition.useSelection(selection.name) ] )
+    self.eventValues = set( (definition.obj, definition.variable) for definition in self.definitions if definition.index is None )
+    self.nEvents = 0
+
+  def getBranches( self, isMC ):
+    """Branches read by the selections and the enabled histograms, like HistogramMiniTree::loadHistTable"""
+    branches = ['ejets_2015', 'ejets_2016', 'mujets_2015', 'mujets_2016', 'jet_pt', 'jet_mv2c10']
+    if isMC:
+      branches += ['weight_mc', 'weight_pileup', 'weight_leptonSF', 'weight_bTagSF_70', 'weight_jvt']
+    if not self.leptonDecision:
+      branches += ['el_pt', 'mu_pt']
+    for definition in self.definitions:
+      if definition.index is not None:
+        branches.append( definition.obj.replace('bjet', 'jet')+'_'+definition.variable )
+      elif definition.variable == 'met':
+        branches.append( 'met_met' )
+      elif definition.variable == 'ht_all':
+        branches += ['el_pt', 'mu_pt', 'met_met']
+      elif definition.variable == 'ClassifBDTOutput_withReco_basic':
+        branches.append( 'ClassifBDTOutput_withReco_basic' )
+    return sorted( set(branches) )
+
+  def getEventWeight( self, arrays, nEvents, isMC, xsWeight, totalNumEvents ):
+    if not isMC:
+      return numpy.ones( nEvents )
+    eventWeight = arrays['weight_mc'].astype(numpy.float32)
+    for weightName in ['weight_pileup', 'weight_leptonSF', 'weight_bTagSF_70', 'weight_jvt']:
+      eventWeight = eventWeight*arrays[weightName].astype(numpy.float32)
+    eventWeight = eventWeight*xsWeight/totalNumEvents
+    return eventWeight.astype(numpy.float64)
+
+  def getObjects( self, arrays, prefix ):
+    """ObjectColumns of the branches of prefix that were read, or None if there are none"""
+    variables = [ variable for variable in objectVariables[prefix] if prefix+'_'+variable in arrays ]
+    if len(variables) == 0:
+      return None
+    values = {}
+    for variable in variables:
+      values[variable] = arrays[prefix+'_'+variable][1].astype(numpy.float64)
+      if variable in ['pt', 'e']:
+        values[variable] = values[variable]/1e3
+    return ObjectColumns( arrays[prefix+'_'+variables[0]][0], values )
+
+  def fillChunk( self, arrays, nEvents, isMC, xsWeight, totalNumEvents ):
+    eventWeight = self.getEventWeight( arrays, nEvents, isMC, xsWeight, totalNumEvents )
+
+    objects = {'el': self.getObjects( arrays, 'el' ), 'mu': self.getObjects( arrays, 'mu' ), 'jet': self.getObjects( arrays, 'jet' )}
+    jets = objects['jet']
+    nJets = jets.counts
+
+    ## b-jets are the jets above the working point, in jet order ##
+    isBJet = arrays['jet_mv2c10'][1].astype(numpy.float32) > self.bTagWP
+    nBJets = numpy.bincount( jets.event[isBJet], minlength=nEvents )
+    objects['bjet'] = ObjectColumns( nBJets, dict( (variable, values[isBJet]) for variable, values in jets.values.items() ) )
+
+    ## Event quantities, summed in the order and precision of execute(), if a histogram uses them ##
+    eventValues = {('jet', 'n'): nJets.astype(numpy.float64), ('bjet', 'n'): nBJets.astype(numpy.float64)}
+    if ('jet', 'ht') in self.eventValues or ('event', 'ht_all') in self.eventValues:
+      ht_hadronic = sumInFloat( jets.counts, jets.starts, jets.values['pt'] )
+      eventValues[('jet', 'ht')] = ht_hadronic.astype(numpy.float64)
+    if ('bjet', 'ht') in self.eventValues:
+      bJets = objects['bjet']
+      eventValues[('bjet', 'ht')] = sumInFloat( bJets.counts, bJets.starts, bJets.values['pt'] ).astype(numpy.float64)
+    if ('event', 'met') in self.eventValues or ('event', 'ht_all') in self.eventValues:
+      eventValues[('event', 'met')] = arrays['met_met'].astype(numpy.float64)/1e3
+    if ('event', 'ht_all') in self.eventValues:
+      electrons, muons = objects['el'], objects['mu']
+      lepton_sumPt = sumInFloat( electrons.counts, electrons.starts, electrons.values['pt'] )
+      lepton_sumPt = sumInFloat( muons.counts, muons.starts, muons.values['pt'], lepton_sumPt )
+      eventValues[('event', 'ht_all')] = (ht_hadronic + lepton_sumPt).astype(numpy.float64) + eventValues[('event', 'met')]
+    if ('event', 'ClassifBDTOutput_withReco_basic') in self.eventValues:
+      eventValues[('event', 'ClassifBDTOutput_withReco_basic')] = arrays['ClassifBDTOutput_withReco_basic'].astype(numpy.float64)
+
+    for iS, selection in enumerate(selections):
+      passed = self.getSelectionMask( selection, arrays, nEvents, nJets, nBJets )
+      objPassed = {}
+      for definition, hist in self.hists[iS]:
+        if definition.index is None:
+          values = eventValues[(definition.obj, definition.variable)]
+          hist.fill( values[passed], eventWeight[passed] )
+          continue
+
+        thisObjects = objects[definition.obj]
+        if not definition.obj in objPassed:
+          objPassed[definition.obj] = passed[thisObjects.event]
+        thisPassed = objPassed[definition.obj]
+        if definition.index != 'all':
+          thisPassed = thisPassed & (thisObjects.index == definition.index)
+        hist.fill( thisObjects.values[definition.variable][thisPassed], eventWeight[thisObjects.event[thisPassed]] )
+
+    self.nEvents += nEvents
+
+  def getSelectionMask( self, selection, arrays, nEvents, nJets, nBJets ):
+    passed = numpy.ones( nEvents, dtype=bool )
+    if selection.jetNum != -1:
+      passed &= (nJets == selection.jetNum) if selection.jetEquality else (nJets >= selection.jetNum)
+
+    if self.leptonDecision:
+      for year, useYear in [('2016', self.use2016), ('2015', self.use2015)]:
+        if not useYear:
+          continue
+        if selection.elNum == 1:
+          passed &= arrays['ejets_'+year] == 1
+        if selection.muNum == 1:
+          passed &= arrays['mujets_'+year] == 1
+    else:
+      if selection.elNum != -1:
+        passed &= arrays['el_pt'][0] == selection.elNum
+      if selection.muNum != -1:
+        passed &= arrays['mu_pt'][0] == selection.muNum
+
+    if selection.bJetNum != -1:
+      passed &= (nBJets == selection.bJetNum) if selection.bJetEquality else (nBJets >= selection.bJetNum)
+    return passed
+
+  def processFile( self, fileName, treeName, chunkSize, firstEntry=0, lastEntry=-1 ):
+    ## Data or MC, DSID and normalization, as in changeInput() ##
+    dsid, isData = buildInputIndex.parseFileName( fileName )
+    isMC = not isData
+    xsWeight, totalNumEvents = numpy.float32(1.), numpy.float32(1.)
+    if isMC:
+      crossSection = crossSections.loadCrossSections().get( int(dsid) )
+      if crossSection is None:
+        print "ERROR: Could not find proper file information for file number", dsid
+        sys.exit(1)
+      xsWeight = numpy.float32(crossSection[0])*numpy.float32(crossSection[1])
+      totalNumEvents = getSumWeights( fileName )
+      print "Setting xs * acceptance", xsWeight, "and totalNumber of events", totalNumEvents
+
+    if self.maxEvent > 0:
+      remaining = self.maxEvent - self.nEvents
+      if remaining <= 0:
+        return
+      if lastEntry < 0 or lastEntry-firstEntry > remaining:
+        lastEntry = firstEntry+remaining
+
+    for nEvents, arrays in iterateChunks( fileName, treeName, self.getBranches(isMC), chunkSize, firstEntry, lastEntry ):
+      self.fillChunk( arrays, nEvents, isMC, xsWeight, totalNumEvents )
+      print "Processed", self.nEvents, "events"
+
+  def write( self, outName ):
+    import ROOT
+    import histArrays
+    if os.path.dirname(outName) and not os.path.exists( os.path.dirname(outName) ):
+      os.makedirs( os.path.dirname(outName) )
+    outFile = ROOT.TFile.Open( outName, "RECREATE" )
+    for iS, selection in enumerate(selections):
+      outDir = outFile.mkdir( selection.name )
+      outDir.cd()
+      for definition, thisHist in self.hists[iS]:
+        hist = ROOT.TH1F( definition.name, definition.name, definition.nBins, definition.xMin, definition.xMax )
+        hist.GetXaxis().SetTitle( definition.xTitle )
+        hist.Sumw2()
+        histArrays.setArrays( hist, thisHist.contents, thisHist.sumw2 )
+        hist.SetEntries( thisHist.entries )
+        hist.Write()
+    outFile.Close()
+
+def main():
+  args = parser.parse_args()
+  if os.path.isdir(args.file):
+    fileNames = sorted( glob.glob( os.path.join(args.file, '*.root*') ) )
+  else:
+    fileNames = [args.file]
+
+  startTime = time.time()
+  histogrammer = Histogrammer( readConfig(args.configName) )
+  for fileName in fileNames:
+    histogrammer.processFile( fileName, args.treeName, args.chunkSize, args.firstEntry, args.lastEntry )
+  histogrammer.write( args.output )
+  print "Processed", histogrammer.nEvents, "events in {0:.1f} s".format(time.time()-startTime)
+  print "Wrote", args.output
+
+if __name__ == "__main__":
+  main()
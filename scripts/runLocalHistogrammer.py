@@ -8,8 +8,10 @@
 # Jeff.Dandoy and Nedaa.Asbah                                #
 ##############################################################
 
-import os, math, sys, glob, subprocess, time, shutil
+import os, math, sys, glob, subprocess, time, shutil, errno, json, hashlib, re, csv
+from distutils.spawn import find_executable
 import argparse
+import mergeHistograms, buildInputIndex
 parser = argparse.ArgumentParser(description="%prog [options]", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 parser.add_argument("--path", dest='fileDir', default="./",
      help="Path to the directory containing the input TTrees")
@@ -19,10 +21,34 @@ parser.add_argument("--outTag", dest='outputTag', default="NewStudy",
      help="Output tag for the histogram root files")
 parser.add_argument("--ncores", dest='ncores', default=4,
      type=int, help="Number of parallel jobs ")
+parser.add_argument("--nthreads", dest='nthreads', default=1,
+     type=int, help="Threads of each runttHHistogrammer job, so a session uses up to ncores*nthreads cores")
 parser.add_argument("--config", dest='config', default="$ROOTCOREBIN/data/ttHHistogrammer/ttHHistogrammer.config",
      help="ttHHistogrammer config file")
+parser.add_argument("--treeName", dest='treeName', default="nominal_Loose",
+     help="Name of the input TTree")
+parser.add_argument("--extraTrees", dest='extraTrees', default=None,
+     help="Comma separated TTrees, i.e. systematics, histogrammed by the same jobs as --treeName, each in a directory of its name")
+parser.add_argument("--orderBy", dest='orderBy', default="size", choices=["size", "entries"],
+     help="Start the longest jobs first, as measured by file size or by TTree entries (requires ROOT or --inputIndex)")
+parser.add_argument("--maxShardSize", dest='maxShardSize', default=-1,
+     type=float, help="Split input files larger than this (in GB) into entry-range shards run in parallel (requires ROOT or --inputIndex).  With MaxEvent in the config, its first MaxEvent entries are split.  -1 for no splitting")
+parser.add_argument("--mergeSamples", dest='mergeSamples', action='store_true', default=False,
+     help="Merge the outputs into one histogram file per sample in gridOutput/mergedOutput")
+parser.add_argument("--noCache", dest='noCache', action='store_true', default=False,
+     help="Reprocess every input file, even if its cached output is up to date")
+parser.add_argument("--inputIndex", dest='inputIndex', default=None,
+     help="Input metadata index (see buildInputIndex.py), refreshed for new or changed inputs.  Its entries are used for job ordering and sharding, and its sumWeights and DSIDs by the histogrammer")
+parser.add_argument("--skimDir", dest='skimDir', default=None,
+     help="Also write the events passing any selection to skims of the inputs in this directory, to be used as --path of later runs.  Every input is rerun unsharded")
+parser.add_argument("--resume", dest='resume', action='store_true', default=False,
+     help="Resume an interrupted session from its job manifest, rerunning only unfinished or failed jobs")
 args = parser.parse_args()
 
+cacheFileName = 'gridOutput/histOutput/histCache.json'
+manifestFileName = 'gridOutput/localJobs/manifest.json'
+inputIndex = {} # {fileName: info} from buildInputIndex.py, if --inputIndex is used
+
 
 
 def main():
@@ -31,40 +57,72 @@ def main():
     if not os.path.exists("gridOutput/localJobs"):
       os.makedirs('gridOutput/localJobs')
 
-  args.logTag = args.outputTag + time.strftime("_%Y%m%d")
+  if args.resume:
+    manifest = loadManifest()
+    args.logTag = manifest['logTag']
+    jobs, outputFiles, cacheKeys = manifest['jobs'], manifest['outputFiles'], manifest['cacheKeys']
+    cache = loadCache()
+    for job in jobs:
+      if not job['state'] in ['done', 'collecting', 'collected']:
+        job['state'] = 'pending'
+    print "Resuming session", args.logTag+":", len([job for job in jobs if job['state'] != 'pending']), "of", len(jobs), "jobs already done"
 
-  if args.fileDir.endswith('/'):
-    args.fileDir = args.fileDir[:-1]
+  else:
+    if os.path.exists(manifestFileName):
+      print "WARNING: Replacing the manifest of an unfinished session, use --resume to continue it instead"
+    args.logTag = args.outputTag + time.strftime("_%Y%m%d")
+    if args.skimDir:
+      ## A skim needs every event of an input, written by one job ##
+      args.noCache = True
+      args.maxShardSize = -1
 
-  files = glob.glob(args.fileDir+'/*'+args.inputTag+'*.root')
+    if args.fileDir.endswith('/'):
+      args.fileDir = args.fileDir[:-1]
 
-  if not os.path.exists('logs/'+args.logTag+'/'):
-    os.makedirs('logs/'+args.logTag+'/')
+    files = glob.glob(args.fileDir+'/*'+args.inputTag+'*.root')
+
+    if args.inputIndex:
+      args.inputIndex = buildInputIndex.getIndexName( args.fileDir, args.inputIndex )
+      inputIndex.update( buildInputIndex.buildIndex( files, args.inputIndex, args.treeName, args.ncores ) )
+
+    outHistName = 'hist-'+args.fileDir.split('/')[-1]+'.root'
+
+    ## Define the histogramming jobs, one or more per input file ##
+    ## Inputs whose output is cached with an identical key are not rerun ##
+    cache = loadCache()
+    jobSettingsKey = getJobSettingsKey()
+    jobs, outputFiles, cacheKeys = [], [], {}
+    for file in files:
+      fileTag = os.path.basename(file)[:-5]+'_'+args.outputTag #remove path and .root
+      outputFile = 'gridOutput/histOutput/hists_'+fileTag+'.root'
+      outputFiles.append( outputFile )
+      cacheKeys[outputFile] = getCacheKey(file, jobSettingsKey)
+      if not args.noCache and cache.get(outputFile) == cacheKeys[outputFile] and os.path.exists(outputFile):
+        print "Skipping unchanged input", file
+        continue
+      jobs += getJobs(file, fileTag, outHistName)
 
-  outHistName = 'hist-'+args.fileDir.split('/')[-1]+'.root'
+    ## Longest jobs first, so a single large file never starts last and sets the total time ##
+    jobs.sort(key=lambda job: job['cost'], reverse=True)
+    for job in jobs:
+      job['state'] = 'pending'
 
-  pids, logFiles = [], []
-  ## Submit histogramming jobs ##
-  for file in files:
-    if len(pids) >= args.ncores:
-      wait_completion(pids, logFiles)
+    manifest = {'logTag': args.logTag, 'jobs': jobs, 'outputFiles': outputFiles, 'cacheKeys': cacheKeys}
 
-    fileTag = os.path.basename(file)[:-5]+'_'+args.outputTag #remove path and .root
-    logFile='logs/'+args.logTag+'/ttHHistogrammer_{0}'.format(fileTag)+'.log'
-    submit_dir = 'gridOutput/localJobs/'+fileTag
-    #this_output_tag = '...'+args.outputTag
+  if not os.path.exists('logs/'+args.logTag+'/'):
+    os.makedirs('logs/'+args.logTag+'/')
 
-    command = 'runttHHistogrammer  --file '+file+' --submitDir '+submit_dir+' --configName '+args.config
-    print command
+  pendingJobs = [job for job in jobs if job['state'] == 'pending']
+  for job in pendingJobs:
+    print job['command']
 
-    if not test:
-      res = submit_local_job(command, logFile)
-      pids.append(res[0])
-      logFiles.append(res[1])
+  if test:
+    return
 
-  wait_all(pids, logFiles)
-  for f in logFiles:
-    f.close()
+  saveManifest(manifest)
+  startTime = time.time()
+  run_jobs(pendingJobs, args.ncores, manifest)
+  writeSummary(pendingJobs, time.time()-startTime, 'logs/'+args.logTag+'/jobSummary')
 
   ## Now collect output ##
   if not os.path.exists("gridOutput/histOutput"):
@@ -72,39 +130,359 @@ def main():
 
 
   print 'Moving files to gridOutput/histOutput'
-  outDirs = glob.glob('gridOutput/localJobs/*')
-  ## Output is named hist-output.root by default; Rename and move these files ##
-  for outDir in outDirs:
-    shutil.move( outDir+'/'+outHistName, 'gridOutput/histOutput/hists_'+os.path.basename(outDir)+'.root' )
-    shutil.rmtree(outDir)
+  ## Output is named hist-output.root by default; Rename and move these files, merging any shards ##
+  outputs = {}
+  for job in jobs:
+    outputs.setdefault(job['outputFile'], []).append(job)
 
+  complete = True
+  for outputFile, outputJobs in outputs.items():
+    if all( job['state'] == 'collected' for job in outputJobs ):
+      continue
+    ## A session killed while collecting may have moved or merged the shards already, but not removed them ##
+    if all( job['state'] == 'collecting' for job in outputJobs ) and os.path.exists(outputFile) \
+        and not all( os.path.exists(job['histFile']) for job in outputJobs ):
+      markCollected( outputJobs, outputFile, manifest, cache, cacheKeys )
+      continue
+    missing = [job for job in outputJobs if not job['state'] in ['done', 'collecting'] or not os.path.exists(job['histFile'])]
+    if len(missing) > 0:
+      for job in missing:
+        print "ERROR: No output found for", job['file'], "see", job['logFile']
+      complete = False
+      continue
 
-def submit_local_job(exec_sequence, logfilename):
-  output_f=open(logfilename, 'w')
-  pid = subprocess.Popen(exec_sequence, shell=True, stderr=output_f, stdout=output_f)
-  time.sleep(0.5)  #Wait to prevent opening / closing of several files
+    for job in outputJobs:
+      job['state'] = 'collecting'
+    saveManifest(manifest)
+    if len(outputJobs) == 1:
+      shutil.move( outputJobs[0]['histFile'], outputFile )
+    else:
+      outputJobs.sort(key=lambda job: job['firstEntry'])
+      if subprocess.call(['hadd', '-f', outputFile] + [job['histFile'] for job in outputJobs]) != 0:
+        print "ERROR: Could not merge shards into", outputFile
+        complete = False
+        continue
+    markCollected( outputJobs, outputFile, manifest, cache, cacheKeys )
 
-  return pid, output_f
+  ## The manifest is kept until every job has been collected, so failed jobs can be rerun with --resume ##
+  if complete:
+    os.remove(manifestFileName)
+  else:
+    print "Some jobs failed, rerun them with --resume"
 
-def wait_completion(pids, logFiles):
-  print """Wait until the completion of one of the launched jobs"""
-  while True:
-    for pid in pids:
-      if pid.poll() is not None:
-        print "\nProcess", pid.pid, "has completed"
-        logFiles.pop(pids.index(pid)).close()  #remove logfile from list and close it
-        pids.remove(pid)
-
-        return
-    print ".",
-    sys.stdout.flush()
-    time.sleep(3) # wait before retrying
-
-def wait_all(pids, logFiles):
-  print """Wait until the completion of all launched jobs"""
-  while len(pids)>0:
-    wait_completion(pids, logFiles)
+  if args.mergeSamples:
+    histFiles = [outputFile for outputFile in outputFiles if os.path.exists(outputFile)]
+    print 'Merging', len(histFiles), 'files per sample into gridOutput/mergedOutput'
+    mergeHistograms.mergeSamples( histFiles, 'gridOutput/mergedOutput', args.ncores )
+
+
+############## Incremental rerun cache #############################
+def markCollected(outputJobs, outputFile, manifest, cache, cacheKeys):
+  """Remove the job directories of a collected output, and record it in the manifest and the cache"""
+  for job in outputJobs:
+    shutil.rmtree(job['submitDir'], ignore_errors=True)
+    job['state'] = 'collected'
+  saveManifest(manifest)
+  cache[outputFile] = cacheKeys[outputFile]
+  saveCache(cache)
+
+def getFileIdentity(fileName):
+  fileName = os.path.abspath(fileName)
+  return [fileName, os.path.getsize(fileName), os.path.getmtime(fileName)]
+
+def getFileContentHash(fileName):
+  fileHash = hashlib.sha1()
+  with open(fileName, 'rb') as inFile:
+    fileHash.update( inFile.read() )
+  return fileHash.hexdigest()
+
+def getJobSettingsKey():
+  """Identity of everything besides the input file that determines the output:
+  job options, the config file, histogram table and cross sections read by the histogrammer, and the histogrammer build"""
+  key = [args.treeName, args.extraTrees, bool(args.inputIndex)]
+
+  dataDir = os.path.expandvars('$ROOTCOREBIN/data/ttHHistogrammer/')
+  configName = getConfigName()
+  histTable = getHistTableName(configName, dataDir)
+  for dataFile in [configName, histTable, dataDir+'XS_Samples.txt']:
+    if os.path.exists(dataFile):
+      key.append( getFileContentHash(dataFile) )
+    else:
+      key.append( None )
+
+  buildFiles = glob.glob(os.path.expandvars('$ROOTCOREBIN/lib/*/libttHHistogrammer*'))
+  executable = find_executable('runttHHistogrammer')
+  if executable:
+    buildFiles.append( executable )
+  for buildFile in sorted(buildFiles):
+    key.append( getFileIdentity(buildFile) )
+
+  return key
+
+def getConfigName():
+  ## runttHHistogrammer reads the config of the same name from $ROOTCOREBIN/data/ttHHistogrammer/ ##
+  dataDir = os.path.expandvars('$ROOTCOREBIN/data/ttHHistogrammer/')
+  configName = dataDir+os.path.basename(os.path.expandvars(args.config))
+  if not os.path.exists(configName):
+    configName = os.path.expandvars(args.config)
+  return configName
+
+def getConfigValue(configName, configKey, default):
+  """The value of a TEnv config key, or default if it is not set"""
+  value = default
+  if os.path.exists(configName):
+    with open(configName, 'r') as configFile:
+      for line in configFile:
+        fields = re.split(r'[:\s]+', line.strip(), 1)
+        if len(fields) == 2 and fields[0] == configKey:
+          value = fields[1].strip()
+  return value
+
+def getHistTableName(configName, dataDir):
+  """The histogram table of the HistogramTable config key, or the default one of HistogramMiniTree"""
+  return os.path.expandvars( getConfigValue(configName, 'HistogramTable', dataDir+'HistogramTable.txt') )
+
+def getCacheKey(fileName, jobSettingsKey):
+  return hashlib.sha1( json.dumps([getFileIdentity(fileName), jobSettingsKey]) ).hexdigest()
+
+def loadCache():
+  if not os.path.exists(cacheFileName):
+    return {}
+  try:
+    with open(cacheFileName, 'r') as cacheFile:
+      return json.load(cacheFile)
+  except ValueError:
+    print "WARNING: Could not read", cacheFileName, "reprocessing all inputs"
+    return {}
+
+############## Job manifest for resuming sessions #############################
+manifestKeys = ['file', 'outputFile', 'firstEntry', 'lastEntry', 'logFile', 'submitDir', 'histFile', 'command', 'cost', 'state']
+
+def loadManifest():
+  if not os.path.exists(manifestFileName):
+    print "ERROR: No session to resume,", manifestFileName, "does not exist"
+    exit(1)
+  with open(manifestFileName, 'r') as manifestFile:
+    return json.load(manifestFile)
+
+def saveManifest(manifest):
+  """Atomically rewrite the manifest, so it is never left half written"""
+  jobs = [ dict( (key, job[key]) for key in manifestKeys if key in job ) for job in manifest['jobs'] ]
+  with open(manifestFileName+'.tmp', 'w') as manifestFile:
+    json.dump(dict(manifest, jobs=jobs), manifestFile, indent=1, sort_keys=True)
+    manifestFile.flush()
+    os.fsync(manifestFile.fileno())
+  os.rename(manifestFileName+'.tmp', manifestFileName)
+
+def saveCache(cache):
+  with open(cacheFileName+'.tmp', 'w') as cacheFile:
+    json.dump(cache, cacheFile, indent=1, sort_keys=True)
+  os.rename(cacheFileName+'.tmp', cacheFileName)
+
+def getJobs(fileName, fileTag, outHistName):
+  """Get the jobs for one input file, splitting large files into balanced entry-range shards"""
+  treeOption = ' --treeNames '+args.treeName+','+args.extraTrees if args.extraTrees else ' --treeName '+args.treeName
+  command = 'runttHHistogrammer  --file '+fileName+' --configName '+args.config+treeOption
+  if args.inputIndex:
+    command += ' --inputIndex '+os.path.abspath(args.inputIndex+'.txt')
+  if args.nthreads > 1:
+    command += ' --nthreads '+str(args.nthreads)
+  if args.skimDir:
+    command += ' --skimDir '+os.path.abspath(args.skimDir)
+
+  job = {}
+  job['file'] = fileName
+  job['outputFile'] = 'gridOutput/histOutput/hists_'+fileTag+'.root'
+  job['firstEntry'] = 0
+
+  nShards = 1
+  if args.maxShardSize > 0:
+    nShards = int(math.ceil( os.path.getsize(fileName)/1E9/args.maxShardSize ))
+    nShards = max(1, min(nShards, args.ncores))
+  nEntries = getEntries(fileName) if nShards > 1 else 0
+  ## MaxEvent of the config applies to every job, so shard only its first MaxEvent entries, as processed unsharded ##
+  maxEvents = int(getConfigValue(getConfigName(), 'MaxEvent', -1)) if nShards > 1 else -1
+  if maxEvents > 0:
+    nEntries = min(nEntries, maxEvents)
+  ## A tree with at most one entry, or none at all, cannot be split into entry ranges ##
+  if nEntries <= 1:
+    nShards = 1
+  if nShards == 1:
+    job['logFile'] = 'logs/'+args.logTag+'/ttHHistogrammer_{0}'.format(fileTag)+'.log'
+    job['submitDir'] = 'gridOutput/localJobs/'+fileTag
+    job['histFile'] = job['submitDir']+'/'+outHistName
+    job['command'] = command+' --submitDir '+job['submitDir']
+    job['cost'] = getJobCost(fileName)
+    return [job]
+
+  nShards = min(nShards, nEntries)
+  cost = nEntries if args.orderBy == "entries" else os.path.getsize(fileName)
+  shards = []
+  for iShard in range(nShards):
+    shardTag = fileTag+'_shard'+str(iShard)
+    shard = dict(job)
+    shard['firstEntry'] = iShard*nEntries//nShards
+    shard['lastEntry'] = (iShard+1)*nEntries//nShards
+    shard['logFile'] = 'logs/'+args.logTag+'/ttHHistogrammer_{0}'.format(shardTag)+'.log'
+    shard['submitDir'] = 'gridOutput/localJobs/'+shardTag
+    shard['histFile'] = shard['submitDir']+'/'+outHistName
+    shard['command'] = command+' --submitDir '+shard['submitDir']+' --firstEntry '+str(shard['firstEntry'])+' --lastEntry '+str(shard['lastEntry'])
+    shard['cost'] = float(cost)*(shard['lastEntry']-shard['firstEntry'])/max(nEntries, 1)
+    shards.append(shard)
+
+  return shards
+
+def getEntries(fileName):
+  info = inputIndex.get( os.path.basename(fileName) )
+  if buildInputIndex.isCurrent( info, fileName, args.treeName ):
+    return info['entries']
+
+  import ROOT
+  inFile = ROOT.TFile.Open(fileName, "READ")
+  tree = inFile.Get(args.treeName) if inFile else None
+  nEntries = tree.GetEntries() if tree else 0
+  if inFile:
+    inFile.Close()
+  return int(nEntries)
+
+def getJobCost(fileName):
+  if args.orderBy == "entries":
+    return getEntries(fileName)
+
+  return os.path.getsize(fileName)
+
+def run_jobs(jobs, ncores, manifest=None):
+  """Run all jobs, keeping ncores jobs running at all times.
+  Job states are recorded in the manifest as they change"""
+  queue = list(jobs)
+  running = {}
+  while len(queue) > 0 or len(running) > 0:
+    ## Fill every free slot before waiting ##
+    while len(queue) > 0 and len(running) < ncores:
+      job = queue.pop(0)
+      submit_local_job(job)
+      running[job['pid'].pid] = job
+      job['state'] = 'running'
+    if manifest:
+      saveManifest(manifest)
+
+    job = wait_completion(running)
+    if job['returnCode'] == 0 and os.path.exists(job['histFile']):
+      job['state'] = 'done'
+    else:
+      job['state'] = 'failed'
+    if manifest:
+      saveManifest(manifest)
   print "All jobs finished!"
 
+def submit_local_job(job):
+  ## Remove leftovers of an interrupted job, EventLoop will not reuse an existing submitDir ##
+  if os.path.exists(job['submitDir']):
+    shutil.rmtree(job['submitDir'])
+  job['logFileHandle'] = open(job['logFile'], 'w')
+  job['startTime'] = time.time()
+  job['pid'] = subprocess.Popen(job['command'], shell=True, stderr=job['logFileHandle'], stdout=job['logFileHandle'])
+
+def wait_completion(running):
+  """Block until one of the launched jobs exits, and return it"""
+  while True:
+    try:
+      pid, status, rusage = os.wait4(-1, 0)
+    except OSError as e:
+      if e.errno == errno.EINTR:
+        continue
+      raise
+    if pid in running:
+      break
+
+  job = running.pop(pid)
+  if os.WIFSIGNALED(status):
+    job['pid'].returncode = -os.WTERMSIG(status)
+  else:
+    job['pid'].returncode = os.WEXITSTATUS(status)
+  job['returnCode'] = job['pid'].returncode
+  job['logFileHandle'].close()
+  job['wallTime'] = time.time()-job['startTime']
+  job['cpuTime'] = rusage.ru_utime+rusage.ru_stime
+  job['maxRSS'] = rusage.ru_maxrss/1024. #kB -> MB
+
+  print "Process", pid, "has completed,", len(running), "still running"
+  if job['returnCode'] != 0:
+    print "WARNING: Job for", job['file'], "exited with code", job['returnCode'], "see", job['logFile']
+
+  return job
+
+############## Job telemetry #############################
+def getLogMetrics(logFileName):
+  """Read the event and byte counts printed by HistogramMiniTree::finalize"""
+  metrics = {'events': None, 'bytesRead': None}
+  if not os.path.exists(logFileName):
+    return metrics
+  with open(logFileName, 'r') as logFile:
+    for line in logFile:
+      match = re.search(r'Processed (\d+) events', line)
+      if match:
+        metrics['events'] = int(match.group(1))
+      match = re.search(r'Bytes read (\d+)', line)
+      if match:
+        metrics['bytesRead'] = int(match.group(1))
+  return metrics
+
+def writeSummary(jobs, sessionTime, summaryName, nSlowest=10):
+  """Write per-job metrics to summaryName.json / .csv and print the aggregate throughput and slowest jobs"""
+  columns = ['file', 'firstEntry', 'lastEntry', 'returnCode', 'wallTime', 'cpuTime', 'maxRSS', 'events', 'eventsPerSecond', 'bytesRead', 'inputSize']
+  rows = []
+  for job in jobs:
+    if not 'wallTime' in job:
+      continue
+    row = getLogMetrics(job['logFile'])
+    row['file'] = job['file']
+    row['firstEntry'] = job['firstEntry']
+    row['lastEntry'] = job.get('lastEntry', -1)
+    row['returnCode'] = job['returnCode']
+    row['wallTime'] = job['wallTime']
+    row['cpuTime'] = job['cpuTime']
+    row['maxRSS'] = job['maxRSS']
+    row['inputSize'] = os.path.getsize(job['file'])
+    row['eventsPerSecond'] = row['events']/job['wallTime'] if row['events'] is not None and job['wallTime'] > 0 else None
+    rows.append(row)
+
+  totalEvents = sum( row['events'] for row in rows if row['events'] is not None )
+  totalBytes = sum( row['bytesRead'] for row in rows if row['bytesRead'] is not None )
+  totalCPU = sum( row['cpuTime'] for row in rows )
+  summary = {}
+  summary['nJobs'] = len(rows)
+  summary['nFailed'] = len([row for row in rows if row['returnCode'] != 0])
+  summary['ncores'] = args.ncores
+  summary['nthreads'] = args.nthreads
+  summary['wallTime'] = sessionTime
+  summary['cpuTime'] = totalCPU
+  summary['cpuEfficiency'] = totalCPU/(sessionTime*args.ncores*args.nthreads) if sessionTime > 0 else None
+  summary['events'] = totalEvents
+  summary['eventsPerSecond'] = totalEvents/sessionTime if sessionTime > 0 else None
+  summary['bytesRead'] = totalBytes
+  summary['MBPerSecond'] = totalBytes/1E6/sessionTime if sessionTime > 0 else None
+  summary['maxRSS'] = max( [row['maxRSS'] for row in rows] + [0] )
+  slowest = sorted(rows, key=lambda row: row['wallTime'], reverse=True)[:nSlowest]
+  summary['slowest'] = [ [row['file'], row['firstEntry'], row['wallTime']] for row in slowest ]
+
+  with open(summaryName+'.json', 'w') as jsonFile:
+    json.dump({'summary': summary, 'jobs': rows}, jsonFile, indent=1, sort_keys=True)
+  with open(summaryName+'.csv', 'wb') as csvFile:
+    writer = csv.DictWriter(csvFile, fieldnames=columns)
+    writer.writeheader()
+    for row in rows:
+      writer.writerow(row)
+
+  print "\n{0} jobs ({1} failed) in {2:.1f} s on {3} cores, CPU efficiency {4}".format(summary['nJobs'], summary['nFailed'], sessionTime, args.ncores,
+      '{0:.0%}'.format(summary['cpuEfficiency']) if summary['cpuEfficiency'] is not None else 'n/a')
+  if summary['eventsPerSecond'] is not None and any( row['events'] is not None for row in rows ):
+    print "{0} events at {1:.0f} events/s, {2:.1f} MB/s read".format(totalEvents, summary['eventsPerSecond'], summary['MBPerSecond'])
+  if len(slowest) > 0:
+    print "Slowest jobs:"
+  for row in slowest:
+    print "  {0:8.1f} s  {1:8.1f} MB  {2}".format(row['wallTime'], row['maxRSS'], os.path.basename(row['file']))
+  print "Job summary written to", summaryName+'.json', "and", summaryName+'.csv'
+
 if __name__ == "__main__":
     main()
@@ -26,6 +26,7 @@ def main():
   plotRatio = False
 
   normToData = False
+  ncores = 4
   lumi = 232
   #Luminosities: PeriodC 85, PeriodD 80, PeriodE
 
@@ -33,35 +34,28 @@ def main():
   if not os.path.exists('logs/plotting/'):
     os.makedirs('logs/plotting/')
 
-  ncores = 4
-  pids, logFiles = [], []
-  ## Submit histogramming jobs ##
-  for plotDir in plotDirs:
-    if len(pids) >= ncores:
-      wait_completion(pids, logFiles)
-
-    logFile='logs/plotting/{0}'.format(plotDir)+'.log'
-
-
-    sendCommand = 'python ttHHistogrammer/scripts/plotting/plotHistograms.py -b --plotDir '+plotDir+' --inDir '+inDir+' --dataType '+dataType+' '
-    if len(bkgType) > 0:
-      sendCommand += '--bkgType '+bkgType+' '
-    if stackBkg:
-      sendCommand += '--stackBkg '
-    if plotRatio:
-      sendCommand += '--plotRatio '
-    if lumi > 0:
-      sendCommand += '--lumi '+str(lumi)+' '
-    print sendCommand
-
-    if not test:
-      res = submit_local_job(sendCommand, logFile)
-      pids.append(res[0])
-      logFiles.append(res[1])
-
-  wait_all(pids, logFiles)
-  for f in logFiles:
-    f.close()
+  ## Submit a single plotting job for all selections, so each input file is only read once ##
+  logFile='logs/plotting/plotHistograms.log'
+
+  sendCommand = 'python ttHHistogrammer/scripts/plotting/plotHistograms.py -b --plotDir '+','.join(plotDirs)+' --inDir '+inDir+' --dataType '+dataType+' '
+  if len(bkgType) > 0:
+    sendCommand += '--bkgType '+bkgType+' '
+  if stackBkg:
+    sendCommand += '--stackBkg '
+  if plotRatio:
+    sendCommand += '--plotRatio '
+  if lumi > 0:
+    sendCommand += '--lumi '+str(lumi)+' '
+  if ncores > 1:
+    sendCommand += '--ncores '+str(ncores)+' '
+  print sendCommand
+
+  if not test:
+    pids, logFiles = [], []
+    res = submit_local_job(sendCommand, logFile)
+    pids.append(res[0])
+    logFiles.append(res[1])
+    wait_all(pids, logFiles)
 
 def submit_local_job(exec_sequence, logfilename):
   output_f=open(logfilename, 'w')
@@ -1,66 +1,151 @@
 #!/usr/bin/env python
 
-###########################################################
-# reweightTrees.py                                        #
-# A short script to reweight TTrees by their initial      #
-# event number.  Allows for directly combining TTrees.    #
-# For more information contact Jeff.Dandoy@cern.ch        #
-###########################################################
-
-import glob, array, argparse
-##put argparse before ROOT call.  This allows for argparse help options to be printed properly (otherwise pyroot hijacks --help) and allows -b option to be forwarded to pyroot
-#parser = argparse.ArgumentParser(description="%prog [options]", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-#parser.add_argument("--pathToTrees", dest='pathToTrees', default="./gridOutput/tree", help="Path to the input trees")
-#parser.add_argument("--treeName", dest='treeName', default="outTree", help="Name of trees to be reweighted")
-#
-#args = parser.parse_args()
-
-
-from ROOT import *
-
-def splitTrees():
-  treeName = "nominal"
-  fileName = "user.nasbah.mc15_13TeV.410000.ttbar_hdamp172p5_nonallhad.Gradient_20160121_output.root"
-  values = [0, 4, 5]
-  outputName = ["L", "C", "B"]
-#  values = [0]
-#  outputName = ["L"]
-
-  inFile = TFile.Open(fileName, "READ")
+##############################################################
+# splitTree.py                                               #
+##############################################################
+# Split the TTrees of input files by the value of a branch,  #
+# i.e. ttbar into light, c and b by TopHeavyFlavorFilterFlag #
+##############################################################
+# Jeff.Dandoy and Nedaa.Asbah                                #
+##############################################################
+
+## Every input is read once: the split branch is evaluated for each entry, and the entries with ##
+## a requested value are read fully and filled into the output of that value.  The entry loop   ##
+## runs in compiled code, and the sumWeights tree is copied to every output.                    ##
+
+import os, sys, multiprocessing
+import argparse
+
+##put argparse before ROOT call.  This allows for argparse help options to be printed properly (otherwise pyroot hijacks --help)
+parser = argparse.ArgumentParser(description="%prog [options]", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument("files", nargs='+',
+     help="Input root files")
+parser.add_argument("--treeName", dest='treeName', default="nominal",
+     help="Name of the TTree to split")
+parser.add_argument("--branch", dest='branch', default="TopHeavyFlavorFilterFlag",
+     help="Branch, or TTreeFormula expression, whose value selects the output of each entry")
+parser.add_argument("--split", dest='split', nargs='+', default=["0:L", "4:C", "5:B"],
+     help="value:tag of each output.  Entries with any other value are dropped")
+parser.add_argument("--rename", dest='rename', default="ttbar",
+     help="Outputs are named by replacing this part of the input name with <rename>_<tag>, or by appending _<tag> if it is not found")
+parser.add_argument("--outDir", dest='outDir', default=None,
+     help="Directory of the outputs.  By default the directory of each input")
+parser.add_argument("--ncores", dest='ncores', default=4,
+     type=int, help="Number of files split in parallel")
+
+splitLoopCode = """
+#include "TTree.h"
+#include "TTreeFormula.h"
+#include <vector>
+
+// Fill each entry of tree into outTrees[i] if the formula evaluates to values[i], and return the filled entries
+std::vector<Long64_t> splitTreeEntries(TTree* tree, const char* expression, const std::vector<double>& values, const std::vector<TTree*>& outTrees){
+  std::vector<Long64_t> nFilled( values.size(), 0 );
+  TTreeFormula formula( "splitFormula", expression, tree );
+  tree->SetNotify( &formula );
+  Long64_t nEntries = tree->GetEntries();
+  for( Long64_t iEntry = 0; iEntry < nEntries; ++iEntry ){
+    if( tree->LoadTree(iEntry) < 0 )
+      break;
+    formula.GetNdata();
+    double value = formula.EvalInstance();
+    for( unsigned int iV = 0; iV < values.size(); ++iV ){
+      if( value != values.at(iV) )
+        continue;
+      tree->GetEntry(iEntry);
+      outTrees.at(iV)->Fill();
+      ++nFilled.at(iV);
+      break;
+    }
+  }
+  tree->SetNotify( 0 );
+  return nFilled;
+}
+"""
+
+def parseSplit( split ):
+  """[(value, tag)] of the value:tag arguments"""
+  values = []
+  for valueTag in split:
+    if not ':' in valueTag:
+      print "ERROR: --split arguments should be value:tag, not", valueTag
+      exit(1)
+    value, tag = valueTag.split(':', 1)
+    values.append( (float(value), tag) )
+  return values
+
+def getOutputName( fileName, tag, rename, outDir=None ):
+  baseName = os.path.basename(fileName)
+  if rename and rename in baseName:
+    baseName = baseName.replace(rename, rename+'_'+tag, 1)
+  else:
+    baseName = baseName[:-5]+'_'+tag+'.root' if baseName.endswith('.root') else baseName+'_'+tag
+  return os.path.join(outDir if outDir else os.path.dirname(fileName), baseName)
+
+def splitFile( splitArgs ):
+  fileName, treeName, branch, values, rename, outDir = splitArgs
+  import ROOT
+  ROOT.gROOT.SetBatch(True)
+  if not hasattr(ROOT, 'splitTreeEntries'):
+    ROOT.gInterpreter.Declare( splitLoopCode )
+
+  inFile = ROOT.TFile.Open(fileName, "READ")
+  if not inFile or inFile.IsZombie():
+    return fileName, "Could not open file"
   tree = inFile.Get( treeName )
-  TopFlag = array.array('i', [0])
-  tree.SetBranchAddress("TopHeavyFlavorFilterFlag", TopFlag)
-
-  for iV,value in enumerate(values):
-    outFile = TFile.Open(fileName.replace('ttbar','ttbar_'+outputName[iV]), "RECREATE" )
-    newTree = tree.CloneTree(0)
-
-    i = 0
-    maxEvents = 10000
-    print "Running over ", tree.GetEntries()
-    while tree.GetEntry(i):
-#      if i > maxEvents:
-#        break
-      if (i%10000) == 0:
-        print i
-      i += 1
-      if (TopFlag[0] != value):
-        continue
-      newTree.Fill()
-
-    outFile.Write()
-#    newTree.SetDirectory( outFile )
-    sumWeightsTree = inFile.Get( "sumWeights" )
-    outFile.cd()
-    sumWeightsTree.CloneTree().Write()
-#    sumWeightsTree.SetDirectory( outFile )
-#    newTree.Write("", TObject.kOverwrite)
-#    sumWeightsTree.Write("", TObject.kOverwrite)
-    outFile.Close()
+  if not tree:
+    inFile.Close()
+    return fileName, "No TTree "+treeName
+  sumWeightsTree = inFile.Get( "sumWeights" )
+
+  outFiles, outTrees = [], ROOT.std.vector('TTree*')()
+  outValues = ROOT.std.vector('double')()
+  for value, tag in values:
+    outFile = ROOT.TFile.Open( getOutputName(fileName, tag, rename, outDir), "RECREATE" )
+    if sumWeightsTree:
+      sumWeightsTree.CloneTree(-1, "fast").Write()
+    outTrees.push_back( tree.CloneTree(0) )
+    outValues.push_back( value )
+    outFiles.append( outFile )
+
+  nFilled = ROOT.splitTreeEntries( tree, branch, outValues, outTrees )
 
+  results = []
+  for iV, (value, tag) in enumerate(values):
+    outFiles[iV].cd()
+    outTrees[iV].Write("", ROOT.TObject.kOverwrite)
+    outFiles[iV].Close()
+    results.append( (tag, int(nFilled[iV])) )
+  nEntries = int(tree.GetEntries())
   inFile.Close()
+  if not sumWeightsTree:
+    print "WARNING: No sumWeights tree in", fileName
+  return fileName, (nEntries, results)
+
+def main():
+  args = parser.parse_args()
+  values = parseSplit( args.split )
+  if args.outDir and not os.path.exists(args.outDir):
+    os.makedirs(args.outDir)
+
+  splitArgs = [ (fileName, args.treeName, args.branch, values, args.rename, args.outDir) for fileName in args.files ]
+  nFailed = 0
+  pool = multiprocessing.Pool( max(1, min(args.ncores, len(splitArgs))) )
+  try:
+    for fileName, result in pool.imap_unordered( splitFile, splitArgs ):
+      if isinstance(result, str):
+        print "ERROR:", result, fileName
+        nFailed += 1
+        continue
+      nEntries, results = result
+      print "Split", nEntries, "entries of", os.path.basename(fileName)+":", ", ".join( "{0} {1}".format(tag, n) for tag, n in results )
+  finally:
+    pool.close()
+    pool.join()
 
+  if nFailed > 0:
+    sys.exit(1)
 
 if __name__ == "__main__":
-  splitTrees()
-  print "Finished splitTrees()"
+  main()
+  print "Finished splitTree.py"
@@ -26,9 +26,14 @@
 #include "TH2D.h"
 #include "TProfile.h"
 #include "TLorentzVector.h"
+#include "TFile.h"
+#include "TTree.h"
+#include "TTreeCache.h"
 
 #include <sstream>
 #include <vector>
+#include <unordered_map>
+#include <set>
 
 using namespace std;
 
@@ -44,6 +49,10 @@ class HistogramMiniTree : public xAH::Algorithm
     int m_eventCounter;     //!
 
     std::string m_name;
+    std::string m_inputIndex; // Text index of buildInputIndex.py, to take sumWeights and DSIDs from
+    int m_nThreads; // Threads reading the input, 1 for the single-threaded event loop
+    std::string m_skimDir; // Directory of skims of the inputs with the events passing any selection, empty for none
+    std::string m_extraTreeNames; // Comma separated trees read alongside the EventLoop tree, i.e. systematics, each in its own output directory
     float m_mcEventWeight;  //!
 
     struct Selection{
@@ -86,82 +95,133 @@ class HistogramMiniTree : public xAH::Algorithm
 
     vector< Selection* > selections;
 
+    // One line of the input index
+    struct InputFileInfo{
+      long long entries;
+      double sumWeights;
+      std::string dsid;
+      bool isData;
+      long long size;
+    };
+
   private:
 
     bool f_leptonDecision; //!
     bool m_isMC; //!
     std::string m_mcChannelNumber; //!
     float m_XSWeight; //!
+    std::unordered_map<std::string, float> m_XSWeights; //! DSID -> cross-section*k-factor, parsed once from XS_Samples.txt
+    std::unordered_map<std::string, InputFileInfo> m_inputFileInfos; //! file name -> input index line
     float m_totalNumEvents; //!
+    vector<unsigned int> m_BJetIndicies; //! b-tagged jet indices of the current event
 
     // Config file options //
     float m_bTagWP;
     std::string m_trigger;
     bool f_use2015;
     bool f_use2016;
+    int m_treeCacheSize; // MB, -1 to keep the EventLoop default
+    int m_treeCacheLearnEntries; // -1 for the ROOT default, 0 to cache only the enabled branches without learning
+    bool f_treeCacheAsync;
+
+    // TTreeCache statistics //
+    TTreeCache* m_treeCache; //!
+    long long m_cacheFileEvents; //!
+    double m_cacheFileHitRate; //!
+    double m_cacheFileEfficiency; //!
+    long long m_cacheEvents; //!
+    double m_cacheHitRateSum; //!
+    double m_cacheEfficiencySum; //!
 
 
 
 
     // Histograms //
-// !H! Define histogram containers here
-
-    // Electrons //
-    unsigned int numHistElectrons; //!
-    vector<TH1F*> h_el_pt_all; //!
-    vector<TH1F*> h_el_eta_all; //!
-    vector<TH1F*> h_el_phi_all; //!
-    vector<TH1F*> h_el_e_all; //!
-    vector< vector<TH1F*> > vh_el_pt; //!
-    vector< vector<TH1F*> > vh_el_eta; //!
-    vector< vector<TH1F*> > vh_el_phi; //!
-    vector< vector<TH1F*> > vh_el_e; //!
-
-    // Muons //
-    unsigned int numHistMuons; //!
-    vector<TH1F*> h_mu_pt_all; //!
-    vector<TH1F*> h_mu_eta_all; //!
-    vector<TH1F*> h_mu_phi_all; //!
-    vector<TH1F*> h_mu_e_all; //!
-    vector< vector<TH1F*> > vh_mu_pt; //!
-    vector< vector<TH1F*> > vh_mu_eta; //!
-    vector< vector<TH1F*> > vh_mu_phi; //!
-    vector< vector<TH1F*> > vh_mu_e; //!
-
-    // Jets //
-    unsigned int numHistJets; //!
-    vector<TH1F*> h_jet_n; //!
-    vector<TH1F*> h_jet_ht; //!
-    vector<TH1F*> h_jet_pt_all; //!
-    vector<TH1F*> h_jet_eta_all; //!
-    vector<TH1F*> h_jet_phi_all; //!
-    vector<TH1F*> h_jet_e_all; //!
-    vector<TH1F*> h_jet_mv2c10_all; //!
-    vector< vector<TH1F*> > vh_jet_pt; //!
-    vector< vector<TH1F*> > vh_jet_eta; //!
-    vector< vector<TH1F*> > vh_jet_phi; //!
-    vector< vector<TH1F*> > vh_jet_e; //!
-    vector< vector<TH1F*> > vh_jet_mv2c10; //!
-
-    // B-Jets //
-    vector<TH1F*> h_bjet_n; //!
-    vector<TH1F*> h_bjet_ht; //!
-    vector<TH1F*> h_bjet_pt_all; //!
-    vector<TH1F*> h_bjet_eta_all; //!
-    vector<TH1F*> h_bjet_phi_all; //!
-    vector<TH1F*> h_bjet_e_all; //!
-    vector<TH1F*> h_bjet_mv2c10_all; //!
-    vector< vector<TH1F*> > vh_bjet_pt; //!
-    vector< vector<TH1F*> > vh_bjet_eta; //!
-    vector< vector<TH1F*> > vh_bjet_phi; //!
-    vector< vector<TH1F*> > vh_bjet_e; //!
-    vector< vector<TH1F*> > vh_bjet_mv2c10; //!
-
-
-    // Others //
-    vector<TH1F*> h_met; //!
-    vector<TH1F*> h_ht_all; //!
-    vector<TH1F*> h_ClassifBDTOutput_withReco_basic; //!
+// !H! Histograms are defined in the histogram table, see data/HistogramTable.txt
+    std::string m_histTable;
+
+    enum HistObject { kElectron, kMuon, kJet, kBJet, kEvent };
+    enum ObjectVariable { kPt, kEta, kPhi, kE, kMv2c10 };
+    enum EventValue { kJetN, kJetHt, kBJetN, kBJetHt, kMet, kHtAll, kBDT, kNEventValues };
+
+    // One histogram of the table, expanded for each object position
+    struct HistDefinition{
+      std::string name;
+      std::string xTitle;
+      int object;
+      int variable; // ObjectVariable, or EventValue for per event histograms
+      int index;    // object position, -1 for all objects or -2 for per event histograms
+      int nBins;
+      double xMin;
+      double xMax;
+      vector<std::string> selections;
+    };
+
+    // A booked histogram and what fills it
+    struct FilledHist{
+      TH1F* hist;
+      int object;
+      int variable;
+      int index;
+    };
+
+    vector<HistDefinition> m_histDefinitions; //! shared by every tree
+    vector< vector<FilledHist> > m_selectionHists; //! booked histograms of each selection
+    std::set<std::string> m_usedBranches; //! branches read by the selections and the enabled histograms
+    bool m_usedEventValues[kNEventValues]; //!
+    double m_eventValues[kNEventValues]; //!
+
+    EL::StatusCode loadHistTable();
+    bool useSelection(const HistDefinition& definition, const std::string& selectionName);
+    const vector<float>* getObjectValues(int object, int variable);
+    void fillHists(unsigned int iS, float eventWeight);
+    vector< vector<FilledHist> > bookHists(HistogramManager* HM, const std::string& dirPrefix);
+
+    // Threaded mode //
+    // A histogram Fill recorded by a worker thread, replayed in entry order by the main thread
+    struct FillRecord{
+      TH1F* hist;
+      double value;
+      float weight;
+      FillRecord(TH1F* thisHist, double thisValue, float thisWeight) : hist(thisHist), value(thisValue), weight(thisWeight) {}
+    };
+
+    int m_threadBlockSize; // Entries queued per thread before they are read
+    vector<Long64_t> m_pendingEntries; //!
+    vector<HistogramMiniTree*> m_threadWorkers; //!
+    TFile* m_threadFile; //! input of a worker thread
+    TTree* m_threadTree; //! TTree of a worker thread or extra tree
+    vector<FillRecord>* m_fillBuffer; //! set while a worker thread records its fills
+
+    void fill(TH1F* hist, double value, float weight){
+      if( m_fillBuffer )
+        m_fillBuffer->push_back( FillRecord(hist, value, weight) );
+      else
+        hist->Fill( value, weight );
+    }
+    void setNormalization(TFile* inputFile, const std::string& inputFileName);
+    void copyConfiguration(HistogramMiniTree* worker);
+    void connectBranches(TTree* tree);
+    void processEvent();
+    void createThreadWorkers();
+    void deleteThreadWorkers();
+    void processPendingEntries();
+    void processEntries(vector<Long64_t>::const_iterator first, vector<Long64_t>::const_iterator last, vector<FillRecord>* fillBuffer);
+
+    // Extra trees //
+    vector<std::string> m_extraTrees; //!
+    vector<HistogramMiniTree*> m_treeWorkers; //! one per extra tree, reading it from the EventLoop input file
+    long long m_extraTreeEvents; //!
+    void createTreeWorkers(HistogramManager* HM);
+    void connectExtraTrees(TFile* inputFile);
+    void processExtraTrees(Long64_t entry, bool toEnd);
+
+    // Skims //
+    TFile* m_skimFile; //!
+    TTree* m_skimTree; //!
+    long long m_skimEvents; //!
+    void openSkim(TFile* inputFile, TTree* tree, const std::string& inputFileName);
+    void closeSkim();
 
 
 
@@ -227,7 +287,12 @@ public:
   // Tree *myTree; //!
   // TH1 *myHist; //!
 
+  EL::StatusCode loadXSWeights();
+  EL::StatusCode loadInputIndex();
   EL::StatusCode getLumiWeights();
+  unsigned long long getPassedSelections();
+  void setupTreeCache(TTree* tree);
+  void addTreeCacheStats();
 
   // this is a standard constructor
   HistogramMiniTree ();
@@ -12,6 +12,7 @@
 
 #include "xAODAnaHelpers/AnalysisBase.h"
 #include <string>
+#include <cstdlib>
 #include <unistd.h>
 
 #include "TEnv.h"
@@ -36,6 +37,12 @@ int main( int argc, char* argv[] ) {
   std::string submitDir  = "submitDir";
   std::string outputName;
   bool doCondor          = false;
+  long long firstEntry   = 0;
+  long long lastEntry    = -1;
+  std::string inputIndex = "";
+  int nThreads           = 1;
+  std::string skimDir    = "";
+  std::string extraTreeNames = "";
 
   /////////// Retrieve job arguments //////////////////////////
   std::vector< std::string> options;
@@ -55,6 +62,13 @@ int main( int argc, char* argv[] ) {
          << "  --submitDir       Name of output directory" << std::endl
          << "  --configName      Path to config file" << std::endl
          << "  --treeName        Name of input TTree" << std::endl
+         << "  --treeNames       Comma separated input TTrees, i.e. nominal and systematics, read in one job." << std::endl
+         << "                    The first is the --treeName, the others are written to directories <treeName>/" << std::endl
+         << "  --firstEntry      First TTree entry to process" << std::endl
+         << "  --lastEntry       Process entries up to, but not including, this one (-1 for all)" << std::endl
+         << "  --inputIndex      Text input index of buildInputIndex.py, for sumWeights and DSIDs" << std::endl
+         << "  --nthreads        Number of threads reading the input (output identical to 1 thread)" << std::endl
+         << "  --skimDir         Also write the events passing any selection to skims of the inputs in this directory" << std::endl
          << "  --condor          Option for running condor (Disabled)" << std::endl
          << std::endl;
     exit(1);
@@ -120,6 +134,67 @@ int main( int argc, char* argv[] ) {
          iArg += 2;
        }
 
+    } else if (options.at(iArg).compare("--treeNames") == 0) {
+       char tmpChar = options.at(iArg+1)[0];
+       if (iArg+1 == argc || tmpChar == '-' ) {
+         std::cout << " --treeNames should be followed by a comma separated list of tree names" << std::endl;
+         return 1;
+       } else {
+         std::string treeNames = options.at(iArg+1);
+         treeName = treeNames.substr(0, treeNames.find(','));
+         extraTreeNames = (treeNames.find(',') == std::string::npos) ? "" : treeNames.substr(treeNames.find(',')+1);
+         iArg += 2;
+       }
+
+    } else if (options.at(iArg).compare("--firstEntry") == 0) {
+       char tmpChar = options.at(iArg+1)[0];
+       if (iArg+1 == argc || tmpChar == '-' ) {
+         std::cout << " --firstEntry should be followed by an entry number" << std::endl;
+         return 1;
+       } else {
+         firstEntry = std::stoll( options.at(iArg+1) );
+         iArg += 2;
+       }
+
+    } else if (options.at(iArg).compare("--lastEntry") == 0) {
+       if (iArg+1 == argc) {
+         std::cout << " --lastEntry should be followed by an entry number" << std::endl;
+         return 1;
+       } else {
+         lastEntry = std::stoll( options.at(iArg+1) );
+         iArg += 2;
+       }
+
+    } else if (options.at(iArg).compare("--inputIndex") == 0) {
+       char tmpChar = options.at(iArg+1)[0];
+       if (iArg+1 == argc || tmpChar == '-' ) {
+         std::cout << " --inputIndex should be followed by an index file" << std::endl;
+         return 1;
+       } else {
+         inputIndex = options.at(iArg+1);
+         iArg += 2;
+       }
+
+    } else if (options.at(iArg).compare("--nthreads") == 0) {
+       char tmpChar = options.at(iArg+1)[0];
+       if (iArg+1 == argc || tmpChar == '-' ) {
+         std::cout << " --nthreads should be followed by a number of threads" << std::endl;
+         return 1;
+       } else {
+         nThreads = std::stoi( options.at(iArg+1) );
+         iArg += 2;
+       }
+
+    } else if (options.at(iArg).compare("--skimDir") == 0) {
+       char tmpChar = options.at(iArg+1)[0];
+       if (iArg+1 == argc || tmpChar == '-' ) {
+         std::cout << " --skimDir should be followed by a directory" << std::endl;
+         return 1;
+       } else {
+         skimDir = options.at(iArg+1);
+         iArg += 2;
+       }
+
     } else if (options.at(iArg).compare("--condor") == 0) {
       std::cout << "Running on condor" << std::endl;
       doCondor = true;
@@ -204,6 +279,18 @@ int main( int argc, char* argv[] ) {
   //  Set the number of events
   TEnv* config = new TEnv(gSystem->ExpandPathName( configName.c_str() ));
   int nEvents = config->GetValue("MaxEvent",       -1);
+
+  // Restrict the job to the entry range [firstEntry, lastEntry)
+  if(firstEntry > 0)
+    job.options()->setDouble(EL::Job::optSkipEvents, firstEntry);
+  if(lastEntry >= 0){
+    if(lastEntry <= firstEntry){
+      std::cout << " --lastEntry must be larger than --firstEntry" << std::endl;
+      return 1;
+    }
+    if(nEvents <= 0 || lastEntry-firstEntry < nEvents)
+      nEvents = lastEntry-firstEntry;
+  }
   if(nEvents > 0)
     job.options()->setDouble(EL::Job::optMaxEvents, nEvents);
 
@@ -214,6 +301,19 @@ int main( int argc, char* argv[] ) {
   HistogramMiniTree* procMiniTree = new HistogramMiniTree();
   cout << "HistogramMiniTreeConfig is " << HistogramMiniTreeConfig << endl;
   procMiniTree->setName("ttHHistogrammer")->setConfig( HistogramMiniTreeConfig.c_str() );
+  procMiniTree->m_inputIndex = inputIndex;
+  procMiniTree->m_nThreads = nThreads;
+  procMiniTree->m_extraTreeNames = extraTreeNames;
+  if( skimDir.size() > 0 ){
+    gSystem->mkdir( skimDir.c_str(), kTRUE );
+    char* fullSkimDir = realpath( skimDir.c_str(), NULL ); // the job runs from the submission directory
+    if( !fullSkimDir ){
+      std::cout << " Could not create the skim directory " << skimDir << std::endl;
+      return 1;
+    }
+    procMiniTree->m_skimDir = fullSkimDir;
+    free( fullSkimDir );
+  }
 
   // Add configured algos to event loop job
   job.algsAdd( procMiniTree );